@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Cancellation latency benchmark against synthetic HLS.
+
+Starts a download, cancels it once transfers are in flight and measures how
+long download_video takes to return. Scenarios cover workers in the middle
+of a body, workers blocked waiting for response headers and workers waiting
+for bandwidth tokens. After each cancel the same downloader starts the next
+job right away, and the time to its first segment shows that the cancelled
+job's connections were released. Runs fully offline.
+
+    python benchmarks/bench_cancel.py
+    python benchmarks/bench_cancel.py --repeat 10 --bound 0.1
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hls_server import SyntheticHLS, start_server
+
+# name -> (SyntheticHLS options, job rate limit in bytes/s)
+SCENARIOS = {
+    'mid-body': ({'segment_size': 4 * 1024 * 1024, 'bandwidth': 512 * 1024}, None),
+    'awaiting-headers': ({'segment_size': 256 * 1024, 'latency': 1.0}, None),
+    'throttled': ({'segment_size': 1024 * 1024}, 64 * 1024),
+}
+
+
+def run_once(url, rate_limit, temp_dir, workers):
+    from bohep_downloader.downloader import BohepDownloader
+
+    downloader = BohepDownloader(rate_limit=rate_limit)
+    downloader.max_workers = workers
+    downloader.output_format = 'ts'
+    downloader.segment_retries = 0
+    first_bytes = threading.Event()
+    downloader.progress_subscribers.append(lambda snapshot: snapshot['bytes'] and first_bytes.set())
+
+    def job(name):
+        try:
+            downloader.download_video(url, os.path.join(temp_dir, name + '.ts'))
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=job, args=('cancelled',))
+    thread.start()
+    # Let the requests get going: body bytes flowing, or blocked for headers
+    first_bytes.wait(1.0)
+    time.sleep(0.2)
+    started = time.perf_counter()
+    downloader.cancel()
+    thread.join()
+    cancel_latency = time.perf_counter() - started
+
+    # The next job on the same downloader should get connections right away
+    downloader.reset_cancellation()
+    downloader.set_rate_limit(None)
+    first_bytes.clear()
+    thread = threading.Thread(target=job, args=('next',))
+    started = time.perf_counter()
+    thread.start()
+    next_start = time.perf_counter() - started if first_bytes.wait(15) else float('inf')
+    downloader.cancel()
+    thread.join()
+    return cancel_latency, next_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='cancellations per scenario')
+    parser.add_argument('--workers', type=int, default=5, help='BohepDownloader.max_workers')
+    parser.add_argument('--bound', type=float, default=0.1, help='allowed cancel latency in seconds')
+    args = parser.parse_args()
+
+    failed = []
+    print(f"{'scenario':<18} {'p50 ms':>8} {'max ms':>8} {'next job ms':>12}")
+    for name, (options, rate_limit) in SCENARIOS.items():
+        hls = SyntheticHLS(segment_count=50, variants=(720,), **options)
+        server = start_server(hls)
+        url = f"http://127.0.0.1:{server.server_port}/720p/index.m3u8"
+        latencies, next_starts = [], []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for _ in range(args.repeat):
+                latency, next_start = run_once(url, rate_limit, temp_dir, args.workers)
+                latencies.append(latency)
+                next_starts.append(next_start)
+        server.shutdown()
+        print(f"{name:<18} {statistics.median(latencies) * 1000:>8.1f} {max(latencies) * 1000:>8.1f} "
+              f"{statistics.median(next_starts) * 1000:>12.1f}")
+        if max(latencies) > args.bound:
+            failed.append(name)
+
+    if failed:
+        print(f"Cancel latency above {args.bound * 1000:.0f} ms in: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of the download pipeline against synthetic HLS.
+
+Serves generated playlists and MPEG-TS segments from a local server running
+in a separate process (so its CPU and memory don't count), downloads the
+media playlist with BohepDownloader.download_video and reports MB/s, wall
+time, CPU time, peak RSS and the connections the server accepted. Runs
+fully offline.
+
+    python benchmarks/bench_pipeline.py --segments 200 --segment-size 1024
+    python benchmarks/bench_pipeline.py --latency 0.05 --bandwidth 8 --error-rate 0.02
+    python benchmarks/bench_pipeline.py --suite --json results.json
+    python benchmarks/bench_pipeline.py --suite --compare results.json
+    python benchmarks/bench_pipeline.py --transports --latency 0.02
+
+--http2 downloads over HTTP/2 (h2c with prior knowledge; needs httpx[http2]
+and h2), and --transports runs the scenario over HTTP/1.1 and HTTP/2.
+
+Output is written as raw MPEG-TS (output_format='ts') unless --remux is
+given, so FFmpeg is not needed.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hls_server import serve_in_process
+
+# name -> command line options, run each in its own process so peak RSS is per scenario
+SUITE = {
+    'baseline': [],
+    'many-small': ['--segments', '1000', '--segment-size', '128'],
+    'latency-50ms': ['--latency', '0.05'],
+    'bandwidth-4MBps': ['--bandwidth', '4', '--segments', '60'],
+    'errors-5pct': ['--error-rate', '0.05'],
+}
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def run_scenario(args):
+    from bohep_downloader.downloader import BohepDownloader
+
+    options = {
+        'segment_count': args.segments,
+        'segment_size': args.segment_size * 1024,
+        'variants': (args.variant,),
+        'latency': args.latency,
+        'bandwidth': args.bandwidth * 1024 * 1024 if args.bandwidth else None,
+        'error_rate': args.error_rate,
+    }
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_in_process, args=(queue, options, args.http2), daemon=True)
+    server.start()
+    try:
+        port = queue.get(timeout=30)
+        url = f"http://127.0.0.1:{port}/{args.variant}p/index.m3u8"
+
+        downloader = BohepDownloader()
+        downloader.max_workers = args.workers
+        downloader.memory_budget = args.memory_budget * 1024 * 1024
+        downloader.output_format = 'mp4' if args.remux else 'ts'
+        downloader.job_id = 'benchmark'
+        if args.http2 and not downloader.use_http2(cleartext=True):
+            raise SystemExit("--http2 needs httpx[http2]")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, 'benchmark.' + downloader.output_format)
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            output_path = downloader.download_video(url, output_path)
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            size = os.path.getsize(output_path)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats") as response:
+            server_stats = json.load(response)
+    finally:
+        server.terminate()
+        server.join()
+
+    summary = downloader.metrics.summary()
+    segment_stats = summary['requests'].get('segment', {}).get('127.0.0.1', {})
+    connect_seconds = sum(
+        hosts['127.0.0.1']['connect']['mean'] * hosts['127.0.0.1']['connect']['count']
+        for hosts in summary['requests'].values() if '127.0.0.1' in hosts
+    )
+    return {
+        'bytes': size,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'mb_per_second': size / wall / 1024 ** 2,
+        'cpu_seconds_per_gb': cpu / (size / 1024 ** 3) if size else 0.0,
+        'peak_rss_mb': peak_rss() / 1024 ** 2,
+        'retries': segment_stats.get('retries', 0),
+        'segment_ttfb_p95': segment_stats.get('ttfb', {}).get('p95', 0.0),
+        'connections': server_stats['connections'] - 1,  # not counting the /stats request
+        'connect_seconds': connect_seconds,
+    }
+
+
+def print_results(results):
+    print(f"{'scenario':<18} {'MB/s':>9} {'wall s':>8} {'CPU s':>8} {'CPU s/GB':>9} {'RSS MB':>8} {'retries':>8}"
+          f" {'conns':>6} {'conn ms':>8}")
+    for name, r in results.items():
+        print(f"{name:<18} {r['mb_per_second']:>9.1f} {r['wall_seconds']:>8.2f} {r['cpu_seconds']:>8.2f} "
+              f"{r['cpu_seconds_per_gb']:>9.2f} {r['peak_rss_mb']:>8.1f} {r['retries']:>8}"
+              f" {r.get('connections', 0):>6} {r.get('connect_seconds', 0.0) * 1000:>8.1f}")
+
+
+def compare(results, baseline_path, tolerance):
+    """Return the scenarios whose throughput fell more than tolerance below the baseline."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['mb_per_second']
+        change = (r['mb_per_second'] - before) / before if before else 0.0
+        print(f"{name:<18} {before:>9.1f} -> {r['mb_per_second']:>9.1f} MB/s ({change:+.1%})")
+        if change < -tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=200, help='segments in the media playlist')
+    parser.add_argument('--segment-size', type=int, default=512, help='segment size in KiB')
+    parser.add_argument('--variant', type=int, default=720, help='variant height to download')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='per-connection cap in MiB/s')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of segment requests answered 503')
+    parser.add_argument('--workers', type=int, default=5, help='BohepDownloader.max_workers')
+    parser.add_argument('--memory-budget', type=int, default=256, help='segment store budget in MiB (0 = disk)')
+    parser.add_argument('--remux', action='store_true', help='remux to MP4 with FFmpeg')
+    parser.add_argument('--http2', action='store_true', help='download over HTTP/2 (h2c)')
+    parser.add_argument('--transports', action='store_true', help='run the scenario over HTTP/1.1 and HTTP/2')
+    parser.add_argument('--suite', action='store_true', help='run the standard scenarios')
+    parser.add_argument('--json', metavar='OUT', help='write results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare with a previous --json file')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed throughput drop for --compare')
+    parser.add_argument('--name', default='custom', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.suite or args.transports:
+        if args.suite:
+            scenarios = SUITE
+        else:
+            # Same scenario options, without the ones handled here
+            options, skip = [], False
+            for arg in sys.argv[1:]:
+                if not skip and arg not in ('--transports', '--http2', '--json', '--compare', '--tolerance'):
+                    options.append(arg)
+                skip = arg in ('--json', '--compare', '--tolerance')
+            scenarios = {'http1.1': options, 'http2': options + ['--http2']}
+        results = {}
+        for name, options in scenarios.items():
+            with tempfile.NamedTemporaryFile(suffix='.json') as out:
+                subprocess.run([sys.executable, __file__, '--name', name, '--json', out.name] + options,
+                               check=True, stdout=subprocess.DEVNULL)
+                results.update(json.load(out))
+    else:
+        results = {args.name: run_scenario(args)}
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"Throughput regression in: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Playlist memory benchmark: m3u8 object graph vs. SegmentTable.
+
+Generates media playlists of 1k/10k/100k segments with signed CDN URLs and
+measures, with tracemalloc, the memory a parsed playlist keeps alive, the
+peak while parsing and the parse time. The m3u8 row also sets segment.uri
+and segment.base_uri the way download_video used to. The scheduler column
+is the memory of the SegmentAttempt and future objects queued at once: one
+per segment before, a few per worker now.
+
+    python benchmarks/bench_playlist.py
+    python benchmarks/bench_playlist.py --sizes 1000 20000 --relative
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import m3u8
+
+from bohep_downloader.hedging import SegmentAttempt
+from bohep_downloader.playlist import parse_playlist
+
+BASE_URL = 'https://stream.example.com/hls/720p/'
+
+
+def make_playlist(count, relative=False):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+    for i in range(count):
+        lines.append('#EXTINF:4.000000,')
+        if relative:
+            lines.append(f'seg{i:06d}.ts')
+        else:
+            lines.append(f'https://cdn{i % 4}.example.com/v/8f3a2c/720p/seg{i:06d}.ts'
+                         f'?token={i * 2654435761 % 16 ** 32:032x}&expires=1700000000')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def load_m3u8(text):
+    playlist = m3u8.loads(text)
+    for segment in playlist.segments:
+        if not segment.uri.startswith(('http://', 'https://')):
+            segment.uri = BASE_URL + segment.uri
+        segment.base_uri = BASE_URL
+    return playlist
+
+
+def load_table(data):
+    # Fed in network-sized chunks, as load_playlist does
+    return parse_playlist((data[i:i + 65536] for i in range(0, len(data), 65536)), BASE_URL)
+
+
+def queue_attempts(count):
+    return [(Future(), SegmentAttempt(i, BASE_URL)) for i in range(count)]
+
+
+def measure(loader, *args):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = loader(*args)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--relative', action='store_true', help='relative segment URIs')
+    parser.add_argument('--workers', type=int, default=5, help='BohepDownloader.max_workers')
+    args = parser.parse_args()
+
+    mb = 1024 * 1024
+    print(f"{'segments':>9} {'parser':<7} {'retained MB':>12} {'peak MB':>8} {'parse s':>8} {'scheduler MB':>13}")
+    for count in args.sizes:
+        text = make_playlist(count, args.relative)
+        rows = (
+            ('m3u8', load_m3u8, text, count),
+            ('table', load_table, text.encode(), min(count, args.workers * 4)),
+        )
+        for name, loader, source, queued in rows:
+            retained, peak, elapsed = measure(loader, source)
+            scheduler = measure(queue_attempts, queued)[0]
+            print(f"{count:>9} {name:<7} {retained / mb:>12.2f} {peak / mb:>8.2f} {elapsed:>8.2f} "
+                  f"{scheduler / mb:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
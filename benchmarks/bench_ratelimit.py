@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Bandwidth limit accuracy benchmark against synthetic HLS.
+
+Downloads synthetic segments with a job rate limit and compares the achieved
+throughput with the configured rate. Segments smaller than the largest read
+size used to be overcharged, so the small-segment scenarios are the ones to
+watch. Exits non-zero when the achieved rate strays more than --tolerance
+from the limit. Runs fully offline.
+
+    python benchmarks/bench_ratelimit.py
+    python benchmarks/bench_ratelimit.py --segments 40 --tolerance 0.15
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hls_server import SyntheticHLS, start_server
+
+# name -> (segment size in bytes, job rate limit in bytes/s)
+SCENARIOS = {
+    'small-1MiB/s': (256 * 1024, 1024 * 1024),
+    'small-2MiB/s': (256 * 1024, 2 * 1024 * 1024),
+    'tiny-512KiB/s': (32 * 1024, 512 * 1024),
+    'large-4MiB/s': (2 * 1024 * 1024, 4 * 1024 * 1024),
+}
+
+
+def run_once(url, rate_limit, output_file, workers):
+    from bohep_downloader.downloader import BohepDownloader
+
+    downloader = BohepDownloader(rate_limit=rate_limit)
+    downloader.max_workers = workers
+    downloader.output_format = 'ts'
+    downloader.scan_timestamps = False
+    started = time.perf_counter()
+    # Keep the downloader's progress prints out of the table
+    with contextlib.redirect_stdout(io.StringIO()):
+        downloader.download_video(url, output_file)
+    elapsed = time.perf_counter() - started
+    return os.path.getsize(output_file), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=20, help='segments per scenario')
+    parser.add_argument('--workers', type=int, default=5, help='BohepDownloader.max_workers')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative difference between achieved and configured rate')
+    args = parser.parse_args()
+
+    failed = []
+    print(f"{'scenario':<16} {'limit KiB/s':>12} {'achieved KiB/s':>15} {'ratio':>7}")
+    for name, (segment_size, rate_limit) in SCENARIOS.items():
+        hls = SyntheticHLS(segment_count=args.segments, segment_size=segment_size, variants=(720,))
+        server = start_server(hls)
+        url = f"http://127.0.0.1:{server.server_port}/720p/index.m3u8"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            nbytes, elapsed = run_once(url, rate_limit, os.path.join(temp_dir, 'out.ts'), args.workers)
+        server.shutdown()
+        # The bucket starts with no tokens, then allows one second of burst
+        # while it refills, so the expected time is nbytes / rate
+        achieved = nbytes / elapsed
+        ratio = achieved / rate_limit
+        print(f"{name:<16} {rate_limit / 1024:>12.0f} {achieved / 1024:>15.0f} {ratio:>7.2f}")
+        if abs(ratio - 1) > args.tolerance:
+            failed.append(name)
+
+    if failed:
+        print(f"Achieved rate off by more than {args.tolerance:.0%} in: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Compare the legacy iter_content(8192) segment loop with SegmentWriter.
+
+Serves a random blob from a local HTTP server and downloads it repeatedly with
+both strategies, reporting throughput (MB/s) and CPU seconds per GB.
+
+    python benchmarks/bench_segment_writer.py --size 256 --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bohep_downloader.segment_writer import SegmentWriter
+
+
+def start_server(payload):
+    """Serve payload on every GET from a background thread."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp2t')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def legacy_loop(session, url, output_file):
+    """The loop download_segment used before SegmentWriter."""
+    response = session.get(url, stream=True)
+    response.raise_for_status()
+    with open(output_file, 'wb') as f:
+        for data in response.iter_content(8192):
+            f.write(data)
+
+
+def writer_loop(session, url, output_file, writer):
+    response = session.get(url, stream=True)
+    response.raise_for_status()
+    writer.write(response, output_file)
+    response.raw.release_conn()
+
+
+def measure(name, fn, repeat, size):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    total_gb = size * repeat / 1024 ** 3
+    print(f"{name:<16} {size * repeat / wall / 1024 ** 2:>10.1f} MB/s {cpu / total_gb:>10.2f} CPU s/GB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=256, help='payload size in MiB')
+    parser.add_argument('--repeat', type=int, default=5, help='downloads per strategy')
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    server = start_server(os.urandom(size))
+    url = f"http://127.0.0.1:{server.server_port}/segment.ts"
+    session = requests.Session()
+    writer = SegmentWriter()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_file = os.path.join(temp_dir, 'segment.ts')
+        # Warm up the connection and the page cache
+        legacy_loop(session, url, output_file)
+
+        print(f"{args.size} MiB x {args.repeat} downloads")
+        measure('iter_content', lambda: legacy_loop(session, url, output_file), args.repeat, size)
+        measure('SegmentWriter', lambda: writer_loop(session, url, output_file, writer), args.repeat, size)
+        print(f"final read size: {writer.read_size // 1024} KiB")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""Local synthetic HLS server for offline benchmarks.
+
+Serves a master playlist, one media playlist per variant and generated
+MPEG-TS segments (PAT/PMT plus a video PES per frame with real PTS values),
+with configurable per-request latency, per-connection bandwidth cap and
+error rate. With http2=True a connection opening with the HTTP/2 preface is
+served over HTTP/2 with prior knowledge (h2c, needs the h2 package), all
+others over HTTP/1.1.
+
+    /master.m3u8
+    /<height>p/index.m3u8
+    /<height>p/seg_00000.ts
+    /stats                      request, error, connection and byte counters
+"""
+
+import json
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:  # optional, only needed for http2=True
+    h2 = None
+
+TS_PACKET_SIZE = 188
+H2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+VIDEO_PID = 0x100
+PMT_PID = 0x1000
+
+
+def _crc32_mpeg(data):
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) & 0xFFFFFFFF if crc & 0x80000000 else (crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+def _psi_packet(pid, table):
+    section = table + struct.pack('>I', _crc32_mpeg(table))
+    payload = b'\x00' + section  # pointer field
+    header = bytes([0x47, 0x40 | (pid >> 8), pid & 0xFF, 0x10])
+    return header + payload + b'\xff' * (TS_PACKET_SIZE - 4 - len(payload))
+
+
+def _pat():
+    body = struct.pack('>HBBBHH', 1, 0xC1, 0, 0, 1, 0xE000 | PMT_PID)
+    return _psi_packet(0, bytes([0x00]) + struct.pack('>H', 0xB000 | (len(body) + 4)) + body)
+
+
+def _pmt():
+    body = struct.pack('>HBBBHH', 1, 0xC1, 0, 0, 0xE000 | VIDEO_PID, 0xF000)
+    body += struct.pack('>BHH', 0x1B, 0xE000 | VIDEO_PID, 0xF000)  # H.264 stream, no descriptors
+    return _psi_packet(PMT_PID, bytes([0x02]) + struct.pack('>H', 0xB000 | (len(body) + 4)) + body)
+
+
+def encode_pts(pts, marker=0x2):
+    """Encode a 33-bit PTS in the 5-byte PES header format."""
+    return bytes([
+        (marker << 4) | (((pts >> 30) & 0x07) << 1) | 1,
+        (pts >> 22) & 0xFF,
+        (((pts >> 15) & 0x7F) << 1) | 1,
+        (pts >> 7) & 0xFF,
+        ((pts & 0x7F) << 1) | 1,
+    ])
+
+
+def make_segment_template(size, frames):
+    """Build a TS segment of about `size` bytes with `frames` PES packets.
+
+    Returns (template, pts_offsets): the offsets of the PTS fields so each
+    request can patch in the timestamps of its segment.
+    """
+    packets = max(2 + frames, size // TS_PACKET_SIZE)
+    data = bytearray(_pat() + _pmt())
+    pts_offsets = []
+    payload_packets = packets - 2
+    pes_every = max(1, payload_packets // frames)
+    cc = 0
+    for i in range(payload_packets):
+        start = i % pes_every == 0 and len(pts_offsets) < frames
+        header = bytes([0x47, (0x40 if start else 0x00) | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0x10 | cc])
+        cc = (cc + 1) & 0x0F
+        if start:
+            pes = b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05'
+            pts_offsets.append(len(data) + 4 + len(pes))
+            payload = pes + encode_pts(0)
+        else:
+            payload = b''
+        data += header + payload + bytes((i + n) & 0xFF for n in range(TS_PACKET_SIZE - 4 - len(payload)))
+    return bytes(data), pts_offsets
+
+
+class SyntheticHLS:
+    """Playlist and segment generator shared by the request handlers."""
+
+    def __init__(self, segment_count=200, segment_size=512 * 1024, segment_duration=4.0,
+                 variants=(1080, 720, 360), latency=0.0, bandwidth=None, error_rate=0.0, seed=1):
+        self.segment_count = segment_count
+        self.segment_duration = segment_duration
+        self.variants = {}
+        for height in variants:
+            # Lower variants get proportionally smaller segments
+            size = max(TS_PACKET_SIZE * 4, int(segment_size * height / max(variants)))
+            self.variants[f'{height}p'] = (height, make_segment_template(size, int(segment_duration * 25)))
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self.bytes_sent = 0
+
+    def master_playlist(self):
+        lines = ['#EXTM3U']
+        for name, (height, (template, _)) in self.variants.items():
+            bandwidth = int(len(template) * 8 / self.segment_duration)
+            width = height * 16 // 9
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}')
+            lines.append(f'{name}/index.m3u8')
+        return '\n'.join(lines) + '\n'
+
+    def media_playlist(self):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{int(self.segment_duration + 0.999)}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        for i in range(self.segment_count):
+            lines.append(f'#EXTINF:{self.segment_duration:.3f},')
+            lines.append(f'seg_{i:05d}.ts')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def segment(self, variant, index):
+        template, pts_offsets = self.variants[variant][1]
+        data = bytearray(template)
+        frame = 90000 // 25
+        base = int(index * self.segment_duration * 90000)
+        for n, offset in enumerate(pts_offsets):
+            data[offset:offset + 5] = encode_pts(base + n * frame)
+        return data
+
+    def respond(self, path):
+        """Return (status, content type, body) for a request path."""
+        path = path.split('?', 1)[0].lstrip('/')
+        parts = path.split('/')
+        playlist = 'application/vnd.apple.mpegurl'
+        if path == 'master.m3u8':
+            return 200, playlist, self.master_playlist().encode()
+        if path == 'stats':
+            with self._lock:
+                stats = {'requests': self.requests, 'errors': self.errors,
+                         'connections': self.connections, 'bytes_sent': self.bytes_sent}
+            return 200, 'application/json', json.dumps(stats).encode()
+        if len(parts) == 2 and parts[0] in self.variants:
+            if parts[1] == 'index.m3u8':
+                return 200, playlist, self.media_playlist().encode()
+            if parts[1].startswith('seg_') and parts[1].endswith('.ts'):
+                index = int(parts[1][4:-3])
+                if index < self.segment_count:
+                    if self.should_fail():
+                        return 503, None, None
+                    return 200, 'video/mp2t', self.segment(parts[0], index)
+        return 404, None, None
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def count(self, nbytes=0, error=False):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += nbytes
+            if error:
+                self.errors += 1
+
+
+def make_handler(hls, http2=False):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            with hls._lock:
+                hls.connections += 1
+
+        def handle(self):
+            if http2 and self.request.recv(len(H2_PREFACE), socket.MSG_PEEK) == H2_PREFACE:
+                serve_h2(hls, self.request)
+                return
+            super().handle()
+
+        def do_GET(self):
+            if hls.latency:
+                time.sleep(hls.latency)
+            status, content_type, body = hls.respond(self.path)
+            if status != 200:
+                hls.count(error=True)
+                self.send_error(status)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self._send(body)
+            hls.count(len(body))
+
+        def _send(self, body):
+            view = memoryview(body)
+            if not hls.bandwidth:
+                self.wfile.write(view)
+                return
+            # Per-connection bandwidth cap: send 16 KiB chunks on schedule
+            chunk = 16 * 1024
+            started = time.monotonic()
+            for offset in range(0, len(view), chunk):
+                due = started + offset / hls.bandwidth
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.wfile.write(view[offset:offset + chunk])
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve_h2(hls, sock):
+    """Serve one HTTP/2 connection until the client closes it.
+
+    Responses are sent as flow control, the per-request latency and the
+    per-connection bandwidth cap allow, interleaving the streams.
+    """
+    if h2 is None:
+        raise ImportError("HTTP/2 serving requires the h2 package")
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+    conn.initiate_connection()
+    sock.sendall(conn.data_to_send())
+    pending = {}  # stream id -> [ready time, (status, content type, body), unsent body or None]
+    started = time.monotonic()
+    sent = 0
+
+    while True:
+        now = time.monotonic()
+        for stream_id, entry in list(pending.items()):
+            ready, (status, content_type, body), view = entry
+            if ready > now:
+                continue
+            try:
+                if view is None:
+                    if status != 200:
+                        hls.count(error=True)
+                        conn.send_headers(stream_id, [(':status', str(status))], end_stream=True)
+                        del pending[stream_id]
+                        continue
+                    conn.send_headers(stream_id, [
+                        (':status', '200'), ('content-type', content_type), ('content-length', str(len(body))),
+                    ])
+                    view = entry[2] = memoryview(body)
+                    hls.count(len(body))
+                allowed = len(view)
+                if hls.bandwidth:
+                    allowed = min(allowed, max(0, int((now - started) * hls.bandwidth) - sent + 16 * 1024))
+                while allowed:
+                    size = min(allowed, conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size)
+                    if size <= 0:
+                        break
+                    conn.send_data(stream_id, view[:size])
+                    view = entry[2] = view[size:]
+                    allowed -= size
+                    sent += size
+                if not len(view):
+                    conn.end_stream(stream_id)
+                    del pending[stream_id]
+            except h2.exceptions.StreamClosedError:
+                pending.pop(stream_id, None)
+        data = conn.data_to_send()
+        if data:
+            sock.sendall(data)
+
+        # Wait for the client, the next response due, or the bandwidth cap
+        timeout = None
+        if any(entry[0] > now for entry in pending.values()):
+            timeout = max(0.0, min(entry[0] for entry in pending.values()) - now)
+        if hls.bandwidth and any(entry[2] is not None for entry in pending.values()):
+            timeout = 0.005 if timeout is None else min(timeout, 0.005)
+        readable, _, _ = select.select([sock], [], [], timeout)
+        if not readable:
+            continue
+        try:
+            data = sock.recv(65536)
+        except OSError:
+            return
+        if not data:
+            return
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                path = dict(event.headers).get(':path', '/')
+                pending[event.stream_id] = [time.monotonic() + hls.latency, hls.respond(path), None]
+            elif isinstance(event, h2.events.StreamReset):
+                pending.pop(event.stream_id, None)
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                sock.sendall(conn.data_to_send())
+                return
+        sock.sendall(conn.data_to_send())
+
+
+def start_server(hls, host='127.0.0.1', port=0, http2=False):
+    """Start serving `hls` from a background thread and return the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(hls, http2))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_in_process(queue, options, http2=False):
+    """multiprocessing target: serve until killed, reporting the port through queue."""
+    server = start_server(SyntheticHLS(**options), http2=http2)
+    queue.put(server.server_port)
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve synthetic HLS content.')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--segments', type=int, default=200)
+    parser.add_argument('--segment-size', type=int, default=512 * 1024)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes/s per connection')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--http2', action='store_true', help='also accept HTTP/2 with prior knowledge')
+    args = parser.parse_args()
+    server = start_server(SyntheticHLS(args.segments, args.segment_size, latency=args.latency,
+                                       bandwidth=args.bandwidth, error_rate=args.error_rate),
+                          port=args.port, http2=args.http2)
+    print(f"Serving on http://127.0.0.1:{server.server_port}/master.m3u8")
+    threading.Event().wait()
@@ -1,4 +1,9 @@
-from bohep_downloader.gui import main
+import sys
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        from bohep_downloader.daemon import main
+        main(sys.argv[2:])
+    else:
+        from bohep_downloader.gui import main
+        main()
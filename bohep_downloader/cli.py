@@ -1,18 +1,97 @@
 #!/usr/bin/env python3
 
+import argparse
 import sys
-import os
-from bohep_downloader.downloader import VideoDownloader
+
+from bohep_downloader.downloader import BohepDownloader
+from bohep_downloader.tracing import tracer
+from bohep_downloader.progress import JsonLogProgress, TqdmProgress
+from bohep_downloader.remux import RemuxPool
+from bohep_downloader.segment_cache import SegmentCache
 
 def main():
     """Main entry point for the CLI."""
-    if len(sys.argv) != 2:
-        print("Usage: bohep-download <url>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(prog="bohep-download", description="Download a video.")
+    parser.add_argument("url", nargs="+", help="video page URL(s); several are remuxed in the background")
+    parser.add_argument("-q", "--quality", default="720p",
+                        help="video quality, e.g. 720p, or auto to pick by measured throughput (default: 720p)")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="minutes a download may take with --quality auto (default: the video's duration)")
+    parser.add_argument("-o", "--output-dir", default=None, help="save directory (default: ~/Downloads)")
+    parser.add_argument("--trace", metavar="OUT.json", help="write a Chrome/Perfetto trace of the pipeline stages")
+    parser.add_argument("--progress", choices=["bar", "json", "none"], default="bar",
+                        help="progress display: tqdm bar, JSON lines on stderr, or none (default: bar)")
+    parser.add_argument("--remux-workers", type=int, default=None,
+                        help="concurrent FFmpeg remuxes for several URLs (default: CPU count)")
+    parser.add_argument("--ffmpeg-threads", type=int, default=None, help="FFmpeg -threads value")
+    parser.add_argument("--ffmpeg-nice", type=int, default=None,
+                        help="FFmpeg niceness increment (default: 0, or 10 for several URLs)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="segment cache directory (default: ~/.cache/bohep_downloader/segments)")
+    parser.add_argument("--cache-size", type=int, default=2048, help="segment cache size cap in MB (default: 2048)")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the segment cache")
+    parser.add_argument("--http2", action="store_true",
+                        help="fetch over HTTP/2 where the server supports it (needs httpx[http2])")
+    args = parser.parse_args()
 
-    url = sys.argv[1]
-    downloader = VideoDownloader()
-    downloader.download(url)
+    if args.trace:
+        tracer.enable()
+
+    downloader = BohepDownloader()
+    if args.progress == "json":
+        downloader.progress_subscribers.append(JsonLogProgress())
+    elif args.progress == "bar":
+        try:
+            downloader.progress_subscribers.append(TqdmProgress(position=0, leave=True))
+        except ImportError:
+            # tqdm is optional; download without a bar
+            pass
+    if not args.no_cache:
+        downloader.segment_cache = SegmentCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    if args.http2:
+        downloader.use_http2()
+    downloader.ffmpeg_threads = args.ffmpeg_threads
+    if args.deadline is not None:
+        downloader.auto_quality_deadline = args.deadline * 60
+    if args.ffmpeg_nice is not None:
+        downloader.ffmpeg_nice = args.ffmpeg_nice
+    
+    failed = False
+    remux_pool = None
+    if len(args.url) > 1:
+        # Keep downloading the next video while earlier ones remux
+        remux_pool = RemuxPool(
+            workers=args.remux_workers,
+            nice=10 if args.ffmpeg_nice is None else args.ffmpeg_nice,
+            threads=args.ffmpeg_threads
+        )
+        downloader.remux_pool = remux_pool
+    
+    try:
+        tasks = []
+        for url in args.url:
+            try:
+                downloader.download(url, quality=args.quality, save_dir=args.output_dir)
+            except Exception:
+                # download() already printed the error
+                failed = True
+                continue
+            if downloader.remux_task is not None:
+                tasks.append(downloader.remux_task)
+        
+        for task in tasks:
+            try:
+                print(f"Remuxed: {task.result()}")
+            except Exception as e:
+                print(f"Error: remuxing {task.output_path} failed: {e}")
+                failed = True
+    finally:
+        if remux_pool is not None:
+            remux_pool.shutdown()
+        if args.trace:
+            tracer.write(args.trace)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
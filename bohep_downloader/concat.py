@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import errno
+import os
+
+# Errors meaning "this syscall can't do this pair of file descriptors"
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSOCK, errno.EBADF}
+
+
+class Concatenator:
+    """Appends segment files and buffers to one output without Python bytes copies.
+
+    Files are joined in the kernel with os.copy_file_range, or os.sendfile
+    when the output is not a regular file (e.g. a pipe into FFmpeg), falling
+    back to readinto through one reusable buffer. In-memory segments are
+    written straight from their buffers.
+    """
+
+    def __init__(self, fileobj, chunk_size=1024 * 1024):
+        # Anything already buffered by Python must land before raw fd writes
+        if hasattr(fileobj, 'flush'):
+            fileobj.flush()
+        self.fd = fileobj.fileno()
+        self.chunk_size = chunk_size
+        self.use_copy_file_range = hasattr(os, 'copy_file_range')
+        self.use_sendfile = hasattr(os, 'sendfile')
+        self._buffer = None
+        self.bytes_written = 0
+        self.methods = {}  # method -> number of files joined with it
+
+    def _count(self, method):
+        self.methods[method] = self.methods.get(method, 0) + 1
+
+    def append_buffer(self, data):
+        """Append a bytes-like object (bytearray, memoryview, ...)."""
+        self._write(data)
+        self._count('memory')
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+            self.bytes_written += written
+
+    def append_file(self, path):
+        """Append the whole content of the file at path."""
+        with open(path, 'rb', buffering=0) as src:
+            size = os.fstat(src.fileno()).st_size
+            if self.use_copy_file_range and self._copy_file_range(src.fileno(), size):
+                self._count('copy_file_range')
+                return
+            if self.use_sendfile and self._sendfile(src.fileno(), size):
+                self._count('sendfile')
+                return
+            self._readinto(src)
+            self._count('readinto')
+
+    def _copy_file_range(self, src_fd, size):
+        offset = 0
+        while offset < size:
+            try:
+                copied = os.copy_file_range(src_fd, self.fd, size - offset, offset)
+            except OSError as e:
+                if e.errno in _UNSUPPORTED and offset == 0:
+                    # Not supported for this pair (pipe, cross-device on old
+                    # kernels, ...); don't try again for this output
+                    self.use_copy_file_range = False
+                    return False
+                raise
+            if copied == 0:
+                break
+            offset += copied
+            self.bytes_written += copied
+        return True
+
+    def _sendfile(self, src_fd, size):
+        offset = 0
+        while offset < size:
+            try:
+                sent = os.sendfile(self.fd, src_fd, offset, size - offset)
+            except OSError as e:
+                if e.errno in _UNSUPPORTED and offset == 0:
+                    # e.g. macOS only sends to sockets
+                    self.use_sendfile = False
+                    return False
+                raise
+            if sent == 0:
+                break
+            offset += sent
+            self.bytes_written += sent
+        return True
+
+    def _readinto(self, src):
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(self.chunk_size))
+        while True:
+            n = src.readinto(self._buffer)
+            if not n:
+                break
+            self._write(self._buffer[:n])
+
+
+def concat_files(paths, output_path):
+    """Join files into output_path and return the Concatenator used."""
+    with open(output_path, 'wb', buffering=0) as f:
+        concat = Concatenator(f)
+        for path in paths:
+            concat.append_file(path)
+    return concat
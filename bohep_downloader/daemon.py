@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""Headless download daemon with a local JSON/HTTP job API.
+
+    python -m bohep_downloader serve --port 8765 --workers 2
+
+    POST /jobs                  {"url": ..., "quality": "720p", "save_dir": ..., "rate_limit": ...}
+    GET  /jobs                  list jobs
+    GET  /jobs/<id>             job status (queued, running, remuxing, done, failed, cancelled)
+    POST /jobs/<id>/cancel      cancel a queued or running job (DELETE /jobs/<id> also works)
+    GET  /jobs/<id>/events      progress as Server-Sent Events
+    GET  /metrics, /metrics.json
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
+
+import requests
+
+from bohep_downloader.downloader import BohepDownloader
+from bohep_downloader.metrics import default_registry
+from bohep_downloader.node_decoder import node_decoder
+from bohep_downloader.remux import RemuxPool
+from bohep_downloader.segment_cache import SegmentCache
+from bohep_downloader.http2 import mount_http2_adapter
+from bohep_downloader.transport import AbortScope, mount_timed_adapter
+
+FINAL_STATES = ('done', 'failed', 'cancelled')
+
+
+class Job:
+    """One download submitted to the daemon."""
+
+    def __init__(self, url, quality='720p', save_dir=None, rate_limit=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.quality = quality
+        self.save_dir = save_dir
+        self.rate_limit = rate_limit
+        self.state = 'queued'
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.downloader = None
+        self.scope = None  # AbortScope of the page resolve
+        self.remux_task = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'url': self.url,
+                'quality': self.quality,
+                'state': self.state,
+                'progress': self.progress,
+                'result': self.result,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+            }
+
+    def listen(self):
+        """Return a queue receiving (event, data) pairs, starting with the current state."""
+        listener = Queue()
+        with self._lock:
+            self._listeners.append(listener)
+            listener.put(('state', {'state': self.state}))
+            if self.progress is not None:
+                listener.put(('progress', self.progress))
+        return listener
+
+    def unlisten(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _emit(self, event, data):
+        for listener in self._listeners:
+            listener.put((event, data))
+
+    def on_progress(self, snapshot):
+        """Progress callback of the job; snapshots already arrive rate limited."""
+        with self._lock:
+            self.progress = snapshot
+            self._emit('progress', snapshot)
+            cancelling = self.state == 'cancelling'
+        # download() clears the cancel flag when it starts; re-apply a cancel
+        # that arrived before that
+        if cancelling and self.downloader is not None:
+            self.downloader.cancel()
+
+    def set_state(self, state, result=None, error=None):
+        with self._lock:
+            if self.state in FINAL_STATES or (state == 'running' and self.state != 'queued'):
+                return False
+            self.state = state
+            if state == 'running':
+                self.started = time.time()
+            if state in FINAL_STATES:
+                self.finished = time.time()
+                self.result = result
+                self.error = error
+            self._emit('state', {'state': state, 'result': result, 'error': error})
+            return True
+
+
+class DownloadDaemon:
+    """Runs submitted jobs on a fixed set of workers that stay warm between jobs.
+
+    All workers share one HTTP session, so the connection pool (and with it
+    TCP/TLS connections to the video and CDN hosts) survives across jobs; each
+    worker keeps its own BohepDownloader for per-job state. Remuxing runs in
+    a shared RemuxPool, so workers start the next download right away.
+    """
+
+    def __init__(self, workers=2, save_dir=None, max_finished=100, remux_workers=None, segment_cache=None,
+                 http2=False):
+        self.save_dir = save_dir
+        self.max_finished = max_finished
+        self.remux_pool = RemuxPool(workers=remux_workers)
+        self.segment_cache = segment_cache
+        self.session = requests.Session()
+        mount_timed_adapter(self.session, pool_maxsize=20)
+        self.http2_adapter = None
+        if http2:
+            # Mounted before the workers share the session; pages still go
+            # over HTTP/1.1 and jobs add their media URLs to the adapter
+            try:
+                self.http2_adapter = mount_http2_adapter(self.session, pool_maxsize=20)
+            except ImportError as e:
+                print(f"{e}; using HTTP/1.1")
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._workers = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f'daemon-worker-{i}', daemon=True)
+            thread.start()
+            self._workers.append(thread)
+
+    def create_downloader(self):
+        downloader = BohepDownloader()
+        # Share the warm session, keeping the downloader's browser headers
+        self.session.headers.update(downloader.session.headers)
+        downloader.session = self.session
+        downloader.http2_adapter = self.http2_adapter
+        downloader.remux_pool = self.remux_pool
+        downloader.segment_cache = self.segment_cache
+        return downloader
+
+    def submit(self, url, quality='720p', save_dir=None, rate_limit=None):
+        job = Job(url, quality, save_dir or self.save_dir, rate_limit)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+        self._queue.put(job)
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in FINAL_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in jobs]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.set_state('cancelling'):
+            if job.scope is not None:
+                job.scope.abort()
+            if job.downloader is not None:
+                job.downloader.cancel()
+            if job.remux_task is not None:
+                job.remux_task.cancel()
+        return job
+
+    def _work(self):
+        downloader = self.create_downloader()
+        while True:
+            job = self._queue.get()
+            if job.state != 'queued':
+                # Cancelled before it started
+                job.set_state('cancelled')
+                continue
+            self._run(downloader, job)
+
+    def _run(self, downloader, job):
+        downloader.job_id = job.id
+        downloader.job_bucket.set_rate(job.rate_limit)
+        job.downloader = downloader
+        job.scope = AbortScope()
+        if not job.set_state('running'):
+            # Cancelled while being picked up
+            job.set_state('cancelled')
+            job.downloader = None
+            return
+        try:
+            # Resolved here so that a cancel can abort it, and isn't lost when
+            # download() clears the cancel flag
+            resolution = downloader.resolve(job.url, job.scope)
+            if job.state == 'cancelling':
+                job.set_state('cancelled')
+                return
+            result = downloader.download(job.url, quality=job.quality, save_dir=job.save_dir,
+                                         progress_callback=job.on_progress, resolution=resolution)
+            if downloader.is_cancelled():
+                job.set_state('cancelled')
+            elif downloader.remux_task is not None:
+                job.remux_task = downloader.remux_task
+                job.set_state('remuxing')
+                job.remux_task.future.add_done_callback(lambda future: self._remuxed(job, result))
+            else:
+                job.set_state('done', result=result)
+        except Exception as e:
+            cancelled = job.state == 'cancelling' or downloader.is_cancelled()
+            job.set_state('cancelled' if cancelled else 'failed', error=str(e))
+        finally:
+            job.downloader = None
+            job.scope = None
+            # Without this, a cancel arriving after the job ended would stick
+            downloader.reset_cancellation()
+
+
+    def _remuxed(self, job, result):
+        task = job.remux_task
+        if task.cancelled.is_set():
+            job.set_state('cancelled')
+            return
+        try:
+            task.result()
+        except Exception as e:
+            job.set_state('failed', error=str(e))
+            return
+        # The task updated result (the job's stats) with the final output file
+        job.set_state('done', result=result)
+
+
+class _DaemonHandler(BaseHTTPRequestHandler):
+    daemon = None
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_path(self):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            return parts[1], parts[2:]
+        return None, None
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/jobs':
+            self._send_json(200, {'jobs': self.daemon.list_jobs()})
+            return
+        if path == '/metrics':
+            body = default_registry.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if path == '/metrics.json':
+            self._send_json(200, default_registry.summary())
+            return
+
+        job_id, rest = self._job_path()
+        job = self.daemon.get(job_id) if job_id else None
+        if job is None:
+            self._send_json(404, {'error': 'not found'})
+        elif rest == []:
+            self._send_json(200, job.to_dict())
+        elif rest == ['events']:
+            self._stream_events(job)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/jobs':
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                data = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(data, dict):
+                    raise ValueError("Request body must be a JSON object")
+                if not data.get('url'):
+                    raise ValueError("'url' is required")
+                job = self.daemon.submit(
+                    data['url'],
+                    quality=data.get('quality', '720p'),
+                    save_dir=data.get('save_dir'),
+                    rate_limit=data.get('rate_limit'),
+                )
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            self._send_json(201, job.to_dict())
+            return
+
+        job_id, rest = self._job_path()
+        if job_id and rest == ['cancel']:
+            self._cancel(job_id)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_DELETE(self):
+        job_id, rest = self._job_path()
+        if job_id and rest == []:
+            self._cancel(job_id)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _cancel(self, job_id):
+        job = self.daemon.cancel(job_id)
+        if job is None:
+            self._send_json(404, {'error': 'not found'})
+        else:
+            self._send_json(200, job.to_dict())
+
+    def _stream_events(self, job):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        listener = job.listen()
+        try:
+            while True:
+                try:
+                    event, data = listener.get(timeout=15)
+                except Empty:
+                    self.wfile.write(b': keepalive\n\n')
+                    self.wfile.flush()
+                    continue
+                self.wfile.write(f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode())
+                self.wfile.flush()
+                if event == 'state' and data['state'] in FINAL_STATES:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away
+            pass
+        finally:
+            job.unlisten(listener)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_daemon_server(daemon, port=8765, host='127.0.0.1'):
+    """Serve the job API for daemon from a background thread."""
+    handler = type('DaemonHandler', (_DaemonHandler,), {'daemon': daemon})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving job API on http://{host}:{server.server_port}/jobs")
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bohep_downloader serve", description="Run the download daemon.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port to bind (default: 8765)")
+    parser.add_argument("--workers", type=int, default=2, help="concurrent jobs (default: 2)")
+    parser.add_argument("--remux-workers", type=int, default=None, help="concurrent FFmpeg remuxes (default: CPU count)")
+    parser.add_argument("-o", "--output-dir", default=None, help="default save directory (default: ~/Downloads)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="segment cache directory (default: ~/.cache/bohep_downloader/segments)")
+    parser.add_argument("--cache-size", type=int, default=2048, help="segment cache size cap in MB (default: 2048)")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the segment cache")
+    parser.add_argument("--http2", action="store_true",
+                        help="fetch over HTTP/2 where the server supports it (needs httpx[http2])")
+    args = parser.parse_args(argv)
+
+    segment_cache = None
+    if not args.no_cache:
+        segment_cache = SegmentCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    daemon = DownloadDaemon(workers=args.workers, save_dir=args.output_dir, remux_workers=args.remux_workers,
+                            segment_cache=segment_cache, http2=args.http2)
+    server = start_daemon_server(daemon, args.port, args.host)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        node_decoder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,6 @@ import requests
 import m3u8
 from bs4 import BeautifulSoup
 from pathlib import Path
-from tqdm import tqdm
 import ffmpeg
 import tempfile
 import subprocess
@@ -19,11 +18,35 @@ import threading
 from queue import Queue
 import shutil
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from typing import Optional, Callable
+import io
 import time
+import http.client
+from urllib.parse import urlsplit
+
+from bohep_downloader.ratelimit import TokenBucket, default_limiter
+from bohep_downloader.hedging import HedgePolicy, SegmentAttempt
+from bohep_downloader.segment_writer import SegmentWriter
+from bohep_downloader.segment_store import DiskSegmentStore, MemorySegmentStore, MemorySink
+from bohep_downloader.metrics import RequestMetrics, default_registry
+from bohep_downloader.transport import (AbortScope, KillOnAbort, mount_timed_adapter, prewarm, register_abortable,
+                                        take_connect_time)
+from bohep_downloader.http2 import mount_http2_adapter
+from bohep_downloader.tracing import tracer
+from bohep_downloader.progress import ProgressBus
+from bohep_downloader.ts_validator import InvalidSegmentError, TSValidator, is_ts_url
+from bohep_downloader.ts_normalizer import TSNormalizer
+from bohep_downloader.timeline import Timeline, scan_pts
+from bohep_downloader.quality import QualitySelector
+from bohep_downloader.playlist import PlaylistParser
+from bohep_downloader.resolution import Resolution
+from bohep_downloader.expiry import URLRefresher
+from bohep_downloader.node_decoder import node_decoder
+from bohep_downloader.segment_strategy import STOPPED, is_probe_error, is_strategy_error, segment_strategies
 
 class BohepDownloader:
-    def __init__(self):
+    def __init__(self, limiter=None, rate_limit=None):
         self.download_dir = str(Path.home() / "Downloads")
         self.session = requests.Session()
         self.session.headers.update({
@@ -48,23 +71,164 @@ class BohepDownloader:
         self.output_file = None
         self.progress_callback = None
         self.cancelled = False
+        self.cancel_event = threading.Event()  # set together with cancelled, for interruptible waits
         self._lock = threading.Lock()
+        self._attempts = {}  # future -> SegmentAttempt of the running job, for cancel()
+        self._playlist_scope = AbortScope()  # scope of the playlist request in flight
+        # Bandwidth limits: shared global/per-host limiter plus a per-job bucket
+        self.limiter = limiter or default_limiter
+        self.job_bucket = TokenBucket(rate_limit)
+        # Per-request timings, aggregated per job and process-wide
+        mount_timed_adapter(self.session)
+        self.metrics_registry = default_registry
+        self.metrics = RequestMetrics()
+        self.job_id = None  # defaults to the output file name
+        # Segment engine settings
+        self.max_workers = 5
+        self.segment_retries = 2
+        # Hedge a segment once it runs longer than multiplier x the percentile
+        # latency of this job; set hedge_multiplier to None to disable
+        self.hedge_percentile = 95
+        self.hedge_multiplier = 2.0
+        self.max_hedges = 2
+        self.hedge_hosts = []  # alternate hosts for hedged requests
+        self.stats = {}
+        self._local = threading.local()  # per-worker reusable buffers
+        # Progress snapshots go to these subscribers (e.g. TqdmProgress) and
+        # the progress_callback at most once per progress_interval seconds
+        self.progress_subscribers = []
+        self.progress_interval = 0.1
+        self.progress = None  # ProgressBus of the running job
+        # Keep segments in RAM up to this many bytes, then spill to disk
+        # ('oldest' or 'largest' first); 0 stores every segment on disk
+        self.memory_budget = 256 * 1024 * 1024
+        self.spill_policy = 'oldest'
+        # 'mp4' remuxes with FFmpeg; 'ts' joins the raw MPEG-TS segments
+        self.output_format = 'mp4'
+        # Seconds allowed for the video page request and the Node.js decode
+        self.page_timeout = 30
+        # Decodes go to this long-lived Node.js process (shared by default);
+        # None starts Node.js for every decode
+        self.node_decoder = node_decoder
+        # (connect, read) timeouts of playlist and segment requests
+        self.request_timeout = (10, 60)
+        # FFmpeg niceness increment and -threads (None lets FFmpeg decide)
+        self.ffmpeg_nice = 0
+        self.ffmpeg_threads = None
+        # With a RemuxPool, finished segment sets are remuxed in the background
+        # and download() returns as soon as the segments are in
+        self.remux_pool = None
+        self.remux_task = None  # RemuxTask of the last download, if any
+        # Optional SegmentCache checked before fetching each segment
+        self.segment_cache = None
+        # Check MPEG-TS sync, alignment and length while segments stream in
+        # and re-fetch bad ones; strict_continuity also rejects CC errors
+        self.validate_segments = True
+        self.strict_continuity = False
+        # Strip fake image headers (PNG, JPEG, ...) some CDNs put in front of
+        # TS segments, writing only the TS data
+        self.normalize_segments = True
+        self.validation = {'invalid_segments': 0, 'continuity_errors': 0, 'stripped_wrappers': 0, 'stripped_bytes': 0}
+        # Read each segment's PTS range for time-based progress and the
+        # timeline (real duration, gaps) reported before the remux
+        self.scan_timestamps = True
+        self.timeline = None  # Timeline of the running job
+        # quality='auto' samples this many segments of the best variant and
+        # picks the highest variant projected to finish within the deadline
+        # (seconds; None means no slower than real time)
+        self.auto_quality_samples = 5
+        self.auto_quality_deadline = None
+        self.prefetched_segments = {}  # segment URL -> data sampled by auto quality
+        self.prefetched_playlist = None  # SegmentTable of the variant auto quality chose
+        self.http2_adapter = None  # HTTP2Adapter installed by use_http2()
+        # Open max_workers connections to the media host while the playlist
+        # is fetched, so the first wave of segments doesn't connect at once
+        self.prewarm_connections = True
+        # Variant URLs from resolve() are reused by download() until they
+        # expire; this is their lifetime when the URLs carry no expiry
+        self.resolution_max_age = 900
+        self.resolution = None  # Resolution of the running job
+        self.variant = None  # variant of the running job
+        self.playlist_url = None  # media playlist of the running job
+        # Segments failing with 403/410 on this many segments means the
+        # signed URLs expired: refresh them and retry, up to max_url_refreshes
+        self.expiry_threshold = 3
+        self.max_url_refreshes = 2
+        # Per-host segment URL extension and Range behaviour, learned from
+        # the first segment (shared by all downloaders; None disables probing)
+        self.segment_strategies = segment_strategies
+
+    def use_http2(self, max_streams_per_host=100, cleartext=False):
+        """Fetch playlists and segments over HTTP/2 where the server supports it.
+
+        The video page is still fetched over HTTP/1.1; each playlist's and
+        segment's directory is added to the adapter as the job reaches them.
+        Call it before starting a download. Returns False (and keeps
+        HTTP/1.1) when httpx isn't installed.
+        """
+        try:
+            self.http2_adapter = mount_http2_adapter(
+                self.session, max_streams_per_host=max_streams_per_host, cleartext=cleartext)
+        except ImportError as e:
+            print(f"{e}; using HTTP/1.1")
+            return False
+        return True
+
+    def mount_media_url(self, url):
+        """Route the requests below a playlist or segment URL's directory over HTTP/2, if enabled."""
+        if self.http2_adapter is not None:
+            self.http2_adapter.add_media_url(url)
 
     def reset_cancellation(self):
         """Reset the cancellation flag."""
         with self._lock:
             self.cancelled = False
+            self.cancel_event.clear()
 
     def cancel(self):
-        """Cancel the current download operation."""
+        """Cancel the current download operation.
+
+        Queued segment requests are dropped and in-flight ones have their
+        connections shut down, so workers blocked on a response return at
+        once; FFmpeg is terminated within its 50 ms poll.
+        """
         with self._lock:
             self.cancelled = True
+            self.cancel_event.set()
+            attempts = list(self._attempts.items())
+        self._playlist_scope.abort()
+        for future, attempt in attempts:
+            future.cancel()
+            attempt.cancel()
+        # Wake up workers waiting for bandwidth tokens
+        self.job_bucket.wake()
+        self.limiter.wake()
 
     def is_cancelled(self):
         """Check if the download has been cancelled."""
         with self._lock:
             return self.cancelled
 
+    def set_rate_limit(self, rate, host=None):
+        """Set a bandwidth limit in bytes/s at runtime (None for unlimited).
+
+        Without a host this limits the current job; with a host it limits all
+        jobs fetching from that host.
+        """
+        if host:
+            self.limiter.set_host_rate(host, rate)
+        else:
+            self.job_bucket.set_rate(rate)
+
+    def throttle(self, amount, url=None):
+        """Wait for bandwidth tokens; raise if the download gets cancelled meanwhile."""
+        if not self.limiter.throttle(amount, url, self.job_bucket, self.is_cancelled):
+            raise ValueError("Download cancelled by user")
+
+    def refund(self, amount, url=None):
+        """Give back bandwidth paid with throttle() for bytes that never arrived."""
+        self.limiter.refund(amount, url, self.job_bucket)
+
     def extract_video_id(self, url):
         """Extract video ID from the URL."""
         # Try different URL patterns
@@ -295,9 +459,8 @@ class BohepDownloader:
                             return None
                         
                         # Run Node.js with the file
-                        result = subprocess.run([node_path, js_file_path, eval_content], 
-                                             capture_output=True, 
-                                             text=True)
+                        with tracer.span('node_decode', 'subprocess'):
+                            result = self.run_node(node_path, js_file_path, eval_content)
                         
                         if result.returncode == 0 and result.stdout:
                             decoded = result.stdout.strip()
@@ -414,7 +577,8 @@ class BohepDownloader:
         """Get the m3u8 playlist URL from the page."""
         try:
             print(f"Fetching page: {page_url}")
-            response = self.session.get(page_url)
+            with tracer.span('page_fetch', url=page_url):
+                response = self.session.get(page_url, timeout=self.page_timeout)
             response.raise_for_status()
             
             # First try to find m3u8 URLs directly in the page content
@@ -454,7 +618,8 @@ class BohepDownloader:
             
             if eval_line:
                 # Decode eval content
-                decoded_content = self.decode_eval(eval_line)
+                with tracer.span('decode_eval'):
+                    decoded_content = self.decode_eval(eval_line)
                 if decoded_content:
                     # Extract video URLs from decoded content
                     video_urls, _, _ = self.extract_video_info(decoded_content)
@@ -563,204 +728,744 @@ class BohepDownloader:
             raise Exception(f"Failed to fetch content: HTTP {response.status_code}")
 
     def download_segments(self, segments, output_file, progress_callback=None):
-        """Download video segments and combine them."""
-        temp_dir = Path(tempfile.mkdtemp())
+        """Download the segments of a SegmentTable, combine them and return the output path.
+
+        The table may still be filling from open_playlist(); segments are
+        dispatched as they are parsed.
+        """
+        store = self.create_segment_store()
+        total_segments = len(segments)
+        segments.reset_state()
+        progress = self.progress = ProgressBus(total_segments, self.progress_interval)
+        progress.media_total = segments.duration()
+        timeline = self.timeline = Timeline()
+        for subscriber in self.progress_subscribers:
+            progress.subscribe(subscriber)
+        if progress_callback:
+            progress.subscribe(progress_callback)
+        progress.start()
         try:
-            # Create a single progress bar for all segments
-            total_segments = len(segments)
-            pbar = tqdm(total=total_segments, desc="Downloading segments", unit="segment", position=0, leave=True)
-            
-            # Variables for progress tracking
-            completed_segments = 0
-            start_time = time.time()
-            
-            # Download segments concurrently
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                futures = []
-                for i, segment in enumerate(segments):
+            # Latency tracking for hedged requests against straggler segments
+            hedge_policy = HedgePolicy(
+                percentile=self.hedge_percentile,
+                multiplier=self.hedge_multiplier,
+                hosts=self.hedge_hosts
+            )
+            attempts = self._attempts = {}  # future -> SegmentAttempt, while in flight
+            running = {}  # index of an unfinished segment -> list of SegmentAttempt
+            hedged = set()  # indexes of segments that already got a hedge
+            # Only a few segments per worker are queued at a time, so a huge
+            # playlist doesn't get a future and an attempt for every segment
+            queue_depth = self.max_workers * 4
+            next_index = 0
+            # Segments to fetch again from fresh URLs after the signed ones expired
+            refresher = URLRefresher(segments, self.refresh_playlist, self.expiry_threshold, self.max_url_refreshes)
+            cache_before = self.segment_cache.summary() if self.segment_cache is not None else None
+            self.validation = {'invalid_segments': 0, 'continuity_errors': 0, 'stripped_wrappers': 0, 'stripped_bytes': 0}
+            
+            # Download segments concurrently; hedges get their own small pool so
+            # they never queue behind the segments they are meant to rescue
+            with tracer.span('segment_transfer') as span, \
+                    ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='segment-worker') as executor, \
+                    ThreadPoolExecutor(max_workers=max(1, self.max_hedges), thread_name_prefix='hedge-worker') as hedge_executor, \
+                    self._abort_on_error(attempts, executor, hedge_executor):
+                pending = set()
+                while True:
+                    # The playlist may still be growing
+                    progress.total = len(segments)
+                    progress.media_total = segments.duration()
+                    if segments.loaded and segments.error is not None and not self.is_cancelled():
+                        raise segments.error
+                    while (refresher.retry or next_index < len(segments)) and len(running) < queue_depth \
+                            and not self.is_cancelled():
+                        if refresher.retry:
+                            index = refresher.retry.pop(0)
+                        else:
+                            index = next_index
+                            next_index += 1
+                        segment = refresher.segment(index)
+                        attempt = SegmentAttempt(index, self.segment_url(segment))
+                        attempt.generation = refresher.refreshes
+                        future = executor.submit(self._run_attempt, store, segment, attempt)
+                        with self._lock:
+                            attempts[future] = attempt
+                        running[index] = [attempt]
+                        pending.add(future)
+                    
+                    # Wait for all downloads to complete
+                    if not pending:
+                        if segments.loaded and next_index >= len(segments) and not refresher.retry:
+                            break
+                        if not self.is_cancelled():
+                            # Waiting for the playlist to catch up
+                            segments.wait(next_index + 1, timeout=0.1)
+                            continue
                     if self.is_cancelled():
+                        # cancel() already aborted the requests it saw; catch any submitted since
+                        self._abort_attempts(attempts, executor, hedge_executor)
                         break
                     
-                    segment_file = temp_dir / f"segment_{i:05d}.ts"
-                    futures.append(
-                        executor.submit(
-                            self.download_segment,
-                            segment,
-                            segment_file,
-                            None  # Don't pass progress_callback to download_segment
-                        )
+                    done, pending = concurrent.futures.wait(
+                        pending, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED
                     )
-                
-                # Wait for all downloads to complete
-                for future in futures:
-                    if self.is_cancelled():
-                        break
-                    future.result()
-                    completed_segments += 1
-                    pbar.update(1)
                     
-                    # Calculate speed and ETA
-                    elapsed_time = time.time() - start_time
-                    speed = completed_segments / elapsed_time if elapsed_time > 0 else 0
-                    remaining_segments = total_segments - completed_segments
-                    eta = remaining_segments / speed if speed > 0 else 0
+                    for future in done:
+                        with self._lock:
+                            attempt = attempts.pop(future)
+                        if segments.is_done(attempt.index):
+                            # The other request for this segment already won
+                            if attempt.sink is not None:
+                                store.discard(attempt.sink)
+                            continue
+                        
+                        siblings = [a for a in running[attempt.index] if a is not attempt]
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            if attempt.sink is not None:
+                                store.discard(attempt.sink)
+                            # Only fail the segment if no other request can still deliver it
+                            if any(not a.abort.is_set() for a in siblings) and not self.is_cancelled():
+                                running[attempt.index] = siblings
+                                continue
+                            if not self.is_cancelled() and refresher.record(attempt.index, e, attempt.generation):
+                                # Probably an expired signed URL; retried after a refresh
+                                del running[attempt.index]
+                                hedged.discard(attempt.index)
+                                continue
+                            raise
+                        if result is None:
+                            store.discard(attempt.sink)
+                            continue
+                        
+                        # First request to finish wins; cancel the loser
+                        segments.mark_done(attempt.index)
+                        del running[attempt.index]
+                        hedged.discard(attempt.index)
+                        for other in siblings:
+                            other.cancel()
+                        store.commit(attempt.index, attempt.sink)
+                        hedge_policy.record(time.monotonic() - attempt.started)
+                        if attempt.hedge:
+                            hedge_policy.wins += 1
+                        
+                        segment = segments[attempt.index]
+                        timeline.add(attempt.index, attempt.media, segment.duration, segment.discontinuity)
+                        # Progress by media time, from the timestamps when the segment had them
+                        progress.segment_done(attempt.media['duration'] if attempt.media else segment.duration or 0)
+                    
+                    if refresher.due(idle=not running):
+                        print(f"\n{len(refresher.failed)} segments were refused (HTTP 403/410), "
+                              f"refreshing the segment URLs")
+                        with tracer.span('url_refresh', segments=len(refresher.failed)):
+                            refresher.refresh_urls()
+                        continue
                     
-                    # Update GUI progress (0-90%)
-                    if progress_callback:
-                        percentage = (completed_segments / total_segments) * 90
-                        progress_callback({
-                            'percentage': percentage,
-                            'completed': completed_segments,
-                            'total': total_segments,
-                            'speed': speed,
-                            'eta': eta,
-                            'stage': 'download'
-                        })
+                    # Fire a duplicate request for segments running past the threshold
+                    threshold = hedge_policy.threshold()
+                    if threshold is None:
+                        continue
+                    now = time.monotonic()
+                    for index, segment_attempts in running.items():
+                        if index in hedged:
+                            continue
+                        first = segment_attempts[0]
+                        if first.started is None or now - first.started < threshold:
+                            continue
+                        hedge = SegmentAttempt(index, hedge_policy.hedge_url(first.url), hedge=True)
+                        hedge.generation = first.generation
+                        future = hedge_executor.submit(self._run_attempt, store, refresher.segment(index), hedge)
+                        with self._lock:
+                            attempts[future] = hedge
+                        segment_attempts.append(hedge)
+                        pending.add(future)
+                        hedged.add(index)
+                        hedge_policy.hedged += 1
+                
+                total_segments = len(segments)
+                span.set(segments=total_segments)
             
-            pbar.close()
+            self.stats['hedging'] = hedge_policy.summary()
+            if refresher.refreshes:
+                self.stats['url_refresh'] = refresher.summary()
+            if self.segment_strategies is not None:
+                self.stats['segment_strategies'] = {
+                    host: {'extension': strategy.extension, 'range': strategy.use_range}
+                    for host, strategy in self.segment_strategies.known().items()
+                }
+            self.stats['segment_store'] = store.summary()
+            if self.validate_segments:
+                self.stats['validation'] = dict(self.validation)
+            if self.segment_cache is not None:
+                cache = self.segment_cache.summary()
+                self.stats['segment_cache'] = {
+                    'hits': cache['hits'] - cache_before['hits'],
+                    'misses': cache['misses'] - cache_before['misses'],
+                    'hit_bytes': cache['hit_bytes'] - cache_before['hit_bytes'],
+                    'cache_bytes': cache['bytes'],
+                }
+            if self.scan_timestamps:
+                self.stats['timeline'] = timeline.summary()
+            if self.http2_adapter is not None:
+                self.stats['transport'] = dict(self.http2_adapter.stats, http1_hosts=self.http2_adapter.http1_hosts)
+            if hedge_policy.hedged:
+                print(f"\nHedged {hedge_policy.hedged} straggler segments, {hedge_policy.wins} hedges won")
             
             if self.is_cancelled():
                 return
             
+            if self.scan_timestamps:
+                self.report_timeline(self.stats['timeline'])
+            
             # Combine segments using FFmpeg
+            progress.publish()  # final download snapshot before the stage changes
             print("\nCombining segments...")
-            if progress_callback:
-                progress_callback({
-                    'percentage': 90,
-                    'completed': total_segments,
-                    'total': total_segments,
-                    'speed': 0,
-                    'eta': 0,
-                    'stage': 'combine'
-                })
+            progress.report({
+                'percentage': 90,
+                'completed': total_segments,
+                'total': total_segments,
+                'speed': 0,
+                'eta': 0,
+                'stage': 'combine'
+            })
+            
+            print(f"Peak segment memory: {store.peak_resident_bytes / 1024 / 1024:.1f} MB")
+            if self.remux_pool is not None and self.output_format != 'ts':
+                # Hand the segments over and move on to the next download
+                self.remux_task = self.remux_pool.submit(self, store, output_file, self.stats, progress_callback)
+                store = None
+                return output_file
             
-            self.combine_segments(temp_dir, output_file, progress_callback)
+            with tracer.span('combine_segments', output=output_file):
+                output_file = self.combine_segments(store, output_file, progress.report)
+            return output_file
             
         finally:
-            # Clean up temp directory
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            self._attempts = {}
+            # Free buffered segments and clean up temp files
+            if store is not None:
+                store.close()
+            progress.close()
+
+    def segment_url(self, segment):
+        """Return the absolute URL of a playlist segment."""
+        # Handle relative URLs by combining with base URL
+        segment_url = segment.uri
+        if not segment_url.startswith(('http://', 'https://')):
+            # Get base URL from the segment's base URI
+            base_url = segment.base_uri
+            if not base_url:
+                raise ValueError("No base URL available for relative segment URL")
+            segment_url = base_url + segment_url
+        return segment_url
+
+    def segment_writer(self):
+        """Return the reusable segment writer of the calling worker thread."""
+        writer = getattr(self._local, 'writer', None)
+        if writer is None:
+            writer = self._local.writer = SegmentWriter()
+        return writer
+
+    def _abort_attempts(self, attempts, *executors):
+        """Drop the queued segment requests and abort the ones in flight."""
+        with self._lock:
+            items = list(attempts.items())
+        for future, attempt in items:
+            future.cancel()
+            attempt.cancel()
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @contextmanager
+    def _abort_on_error(self, attempts, *executors):
+        """Abort the job's segment requests when the block fails, so the executors don't finish them first."""
+        try:
+            yield
+        except BaseException:
+            self._abort_attempts(attempts, *executors)
+            raise
+
+    def create_segment_store(self):
+        """Create the store that holds a job's segments until they are combined."""
+        if self.memory_budget:
+            return MemorySegmentStore(self.memory_budget, spill_policy=self.spill_policy)
+        return DiskSegmentStore()
+
+    def _run_attempt(self, store, segment, attempt):
+        """Run one request for a segment, recording when it actually started."""
+        attempt.started = time.monotonic()
+        attempt.sink = store.create(attempt.index, 1 if attempt.hedge else 0)
+        cache_url = self.segment_url(segment)
+        data = self.prefetched_segments.pop(cache_url, None)
+        if data is not None:
+            # Already downloaded while sampling throughput
+            attempt.sink.write(data)
+            if self.progress is not None:
+                self.progress.add_bytes(len(data))
+            if self.segment_cache is not None:
+                self.segment_cache.put(cache_url, data=data)
+            attempt.media = self.scan_segment(cache_url, attempt.sink)
+            return attempt.sink
+        if self.segment_cache is not None and not attempt.hedge:
+            with tracer.span('segment_cache', 'segment', index=attempt.index) as span:
+                validator = self.segment_validator(cache_url)
+                size = self.segment_cache.read_into(cache_url, attempt.sink, validator=validator)
+                span.set(hit=size is not None)
+            if size is not None:
+                if self.progress is not None:
+                    self.progress.add_bytes(size)
+                attempt.media = self.scan_segment(cache_url, attempt.sink)
+                return attempt.sink
+            if hasattr(attempt.sink, 'truncate'):
+                # A failed read may have left partial data behind
+                attempt.sink.seek(0)
+                attempt.sink.truncate()
+        with tracer.span('segment', 'segment', index=attempt.index, hedge=attempt.hedge) as span, attempt.scope:
+            result = self.download_segment(segment, attempt.sink, None, url=attempt.url, abort=attempt.abort)
+            span.set(won=result is not None)
+        if result is not None:
+            if self.segment_cache is not None:
+                self.cache_segment(cache_url, attempt.sink)
+            attempt.media = self.scan_segment(cache_url, attempt.sink)
+        return result
+
+    def scan_segment(self, url, sink):
+        """Return the PTS range of a finished segment sink, or None."""
+        if not self.scan_timestamps or urlsplit(url).path.lower().endswith(
+                ('.m4s', '.mp4', '.m4a', '.aac', '.vtt')):
+            return None
+        try:
+            with tracer.span('pts_scan', 'segment'):
+                if isinstance(sink, MemorySink):
+                    return scan_pts(sink.buffer)
+                sink.flush()
+                with open(sink.name, 'rb') as f:
+                    return scan_pts(f)
+        except (OSError, ValueError) as e:
+            # The timeline is informational; fall back to the EXTINF duration
+            print(f"Could not scan timestamps of {url}: {e}")
+            return None
+
+    def report_timeline(self, timeline):
+        """Print the real duration and any gaps or discontinuities before combining."""
+        if not timeline['scanned']:
+            return
+        print(f"\nMedia duration: {timeline['duration']:.1f}s "
+              f"(playlist says {timeline['playlist_duration']:.1f}s)")
+        for gap in timeline['gaps']:
+            print(f"Warning: {gap['missing']:.2f}s of media missing before segment {gap['index']}")
+        for jump in timeline['discontinuities']:
+            if not jump['signalled']:
+                print(f"Warning: timestamps jump {jump['jump']:+.2f}s at segment {jump['index']}")
+
+    def cache_segment(self, url, sink):
+        """Store a downloaded segment sink in the segment cache."""
+        try:
+            if isinstance(sink, MemorySink):
+                self.segment_cache.put(url, data=sink.buffer)
+            else:
+                sink.flush()
+                self.segment_cache.put(url, path=sink.name)
+        except OSError as e:
+            # The cache is best effort
+            print(f"Could not cache segment {url}: {e}")
+
+    def is_retryable(self, error):
+        """Return True for transient errors worth retrying a segment for."""
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            status = error.response.status_code
+            return status >= 500 or status == 429
+        return isinstance(error, (
+            InvalidSegmentError,
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            http.client.HTTPException,
+            ConnectionError,
+        ))
+
+    def download_segment(self, segment, output_file, progress_callback=None, url=None, abort=None):
+        """Download a single segment with progress tracking.
+
+        output_file is a path or a writable sink from a SegmentStore. The
+        request is made the way segment_strategies learned for the host
+        (see HostStrategies), probing the host first if it is new. Transient
+        failures are retried up to segment_retries times. Returns None if
+        `abort` is set before the transfer completes.
+        """
+        segment_url = url or self.segment_url(segment)
+        if self.segment_strategies is None:
+            return self._download_with_retries(segment_url, None, output_file, progress_callback, abort)
+        
+        def should_stop():
+            return self.is_cancelled() or (abort is not None and abort.is_set())
+        
+        host = urlsplit(segment_url).netloc
+        strategy = self.segment_strategies.begin(host, should_stop)
+        if strategy is not None and strategy is not STOPPED:
+            try:
+                return self._download_with_retries(*strategy.apply(segment_url), output_file, progress_callback,
+                                                   abort, source_url=segment_url)
+            except Exception as e:
+                if self.is_cancelled() or not is_strategy_error(e):
+                    raise
+                print(f"Segment requests to {host} stopped working ({e}), probing again")
+                self.segment_strategies.forget(host, strategy)
+            strategy = self.segment_strategies.begin(host, should_stop)
+            if strategy is not None and strategy is not STOPPED:
+                # Another worker already probed the host again
+                return self._download_with_retries(*strategy.apply(segment_url), output_file, progress_callback,
+                                                   abort, source_url=segment_url)
+        if strategy is STOPPED:
+            # Stopped while another worker probed the host
+            if self.is_cancelled():
+                raise ValueError("Download cancelled by user")
+            return None
+        return self._probe_segment(host, segment_url, output_file, progress_callback, abort)
+
+    def _probe_segment(self, host, segment_url, output_file, progress_callback, abort):
+        """Try each candidate strategy for a segment and remember the one that works.
+
+        Only called by the worker that owns the host's probe (see HostStrategies.begin).
+        """
+        learned = None
+        first_error = None
+        try:
+            for strategy in self.segment_strategies.candidates(segment_url):
+                self.segment_strategies.count('probes')
+                try:
+                    result = self._download_with_retries(*strategy.apply(segment_url), output_file,
+                                                         progress_callback, abort, source_url=segment_url)
+                except Exception as e:
+                    if self.is_cancelled() or not is_probe_error(e):
+                        raise
+                    first_error = first_error or e
+                    self._reset_output(output_file)
+                    continue
+                if result is not None:
+                    learned = strategy
+                    if first_error is not None:
+                        print(f"Segments of {host} need {strategy}")
+                return result
+            raise first_error
+        finally:
+            self.segment_strategies.end(host, learned)
+
+    def _reset_output(self, output_file):
+        """Start a segment sink over after a failed request."""
+        if hasattr(output_file, 'write'):
+            output_file.seek(0)
+            output_file.truncate()
+
+    def _download_with_retries(self, segment_url, headers, output_file, progress_callback, abort, source_url=None):
+        """Fetch a segment URL, retrying transient failures up to segment_retries times.
+
+        source_url is the segment's URL in the playlist when segment_url was
+        rewritten by a SegmentStrategy; it decides how the body is checked.
+        """
+        retries = 0
+        while True:
+            try:
+                return self._fetch_segment(segment_url, output_file, progress_callback, abort, retries, headers,
+                                           source_url)
+            except Exception as e:
+                if self.is_cancelled():
+                    raise ValueError("Download cancelled by user")
+                if retries >= self.segment_retries or not self.is_retryable(e) or (abort is not None and abort.is_set()):
+                    response = getattr(e, 'response', None)
+                    self.metrics.record(
+                        'segment', urlsplit(segment_url).hostname,
+                        status=response.status_code if response is not None else None,
+                        retries=retries, error=True
+                    )
+                    raise e
+                
+                retries += 1
+                if isinstance(e, InvalidSegmentError):
+                    self._count_validation('invalid_segments')
+                print(f"Retrying segment {segment_url} ({retries}/{self.segment_retries}): {e}")
+                # Start the segment over
+                self._reset_output(output_file)
+                if self.cancel_event.wait(min(0.25 * 2 ** retries, 2.0)):
+                    raise ValueError("Download cancelled by user")
+
+    def _fetch_segment(self, segment_url, output_file, progress_callback, abort, retries, headers=None,
+                       source_url=None):
+        """Make one request for a segment and record its timings."""
+        # Pay for a small first read before connecting, so that workers in
+        # excess of the available bandwidth wait here instead of opening sockets;
+        # the rest is paid as it arrives and whatever wasn't received is refunded
+        writer = self.segment_writer()
+        paid = SegmentWriter.MIN_READ
+        self.throttle(paid, segment_url)
+        received = 0
 
-    def download_segment(self, segment, output_file, progress_callback=None):
-        """Download a single segment with progress tracking."""
         try:
-            # Handle relative URLs by combining with base URL
-            segment_url = segment.uri
-            if not segment_url.startswith(('http://', 'https://')):
-                # Get base URL from the segment's base URI
-                base_url = segment.base_uri
-                if not base_url:
-                    raise ValueError("No base URL available for relative segment URL")
-                segment_url = base_url + segment_url
-
-            response = self.session.get(segment_url, stream=True)
+            take_connect_time()
+            started = time.perf_counter()
+            response = self.session.get(segment_url, headers=headers, stream=True, timeout=self.request_timeout)
+            headers_received = time.perf_counter()
+            connect = take_connect_time()
             response.raise_for_status()
-            
+        
             total_size = int(response.headers.get('content-length', 0))
-            block_size = 8192
-            downloaded = 0
-            
-            # Download with progress tracking
-            with open(output_file, 'wb') as f:
-                for data in response.iter_content(block_size):
-                    if self.is_cancelled():
-                        break
-                    
-                    f.write(data)
-                    downloaded += len(data)
-                    
-                    if progress_callback and total_size:
-                        # Calculate segment progress (0-100%)
-                        segment_progress = (downloaded / total_size) * 100
-                        progress_callback({
-                            'percentage': segment_progress,
-                            'completed': downloaded,
-                            'total': total_size,
-                            'speed': 0,  # Speed is calculated in download_segments
-                            'eta': 0,    # ETA is calculated in download_segments
-                            'stage': 'segment'
-                        })
+        
+            counted = 0
+        
+            def on_read(downloaded):
+                nonlocal paid, counted, received
+                received = downloaded
+                if downloaded > paid:
+                    self.throttle(downloaded - paid, segment_url)
+                    paid = downloaded
+                if self.progress is not None:
+                    self.progress.add_bytes(downloaded - counted)
+                    counted = downloaded
             
+                if progress_callback and total_size:
+                    # Calculate segment progress (0-100%)
+                    segment_progress = (downloaded / total_size) * 100
+                    progress_callback({
+                        'percentage': segment_progress,
+                        'completed': downloaded,
+                        'total': total_size,
+                        'speed': 0,  # Speed is calculated in download_segments
+                        'eta': 0,    # ETA is calculated in download_segments
+                        'stage': 'segment'
+                    })
+        
+            def should_stop():
+                return self.is_cancelled() or (abort is not None and abort.is_set())
+        
+            # Download with progress tracking, validating the data as it arrives
+            # Checked as what the playlist lists, not as the extension a probe tried
+            validator = self.segment_validator(source_url or segment_url, response)
+            normalizer = self.segment_normalizer(source_url or segment_url)
+            try:
+                downloaded = writer.write(response, output_file, on_read, should_stop, validator, normalizer)
+                if validator is not None and not should_stop():
+                    result = validator.finish()
+                    if result['continuity_errors']:
+                        self._count_validation('continuity_errors', result['continuity_errors'])
+            except Exception:
+                # Drop the connection rather than reading the rest of a bad body
+                response.close()
+                raise
+        
+            if should_stop():
+                # Cancelled, or lost the race against a hedged request
+                response.close()
+                if abort is not None and abort.is_set():
+                    if not hasattr(output_file, 'write'):
+                        os.remove(output_file)
+                    return None
+                return output_file
+        
+            # Body fully read; hand the connection back to the pool
+            response.raw.release_conn()
+            if normalizer is not None and normalizer.stripped:
+                self._count_validation('stripped_wrappers')
+                self._count_validation('stripped_bytes', normalizer.stripped)
+            self.metrics.record(
+                'segment', urlsplit(segment_url).hostname, response.status_code,
+                connect=connect,
+                ttfb=headers_received - started - connect,
+                transfer=time.perf_counter() - headers_received,
+                nbytes=downloaded,
+                retries=retries
+            )
             return output_file
-            
-        except Exception as e:
-            if self.is_cancelled():
-                raise ValueError("Download cancelled by user")
-            raise e
+        finally:
+            self.refund(paid - received, segment_url)
+
+    def segment_validator(self, segment_url, response=None):
+        """Return a TSValidator for a segment response (or cache hit), or None if it isn't checked."""
+        if not self.validate_segments or not is_ts_url(segment_url):
+            return None
+        expected_length = None
+        if response is not None and response.headers.get('content-encoding', 'identity').lower() == 'identity':
+            content_length = response.headers.get('content-length')
+            if content_length and content_length.isdigit():
+                expected_length = int(content_length)
+        return TSValidator(expected_length, self.strict_continuity)
+
+    def segment_normalizer(self, segment_url):
+        """Return a TSNormalizer for a segment, or None if its body is written as is."""
+        if not self.normalize_segments or not is_ts_url(segment_url):
+            return None
+        return TSNormalizer()
+
+    def _count_validation(self, key, amount=1):
+        with self._lock:
+            self.validation[key] += amount
+
+    def find_ffmpeg(self):
+        """Return the path of the FFmpeg executable to use."""
+        # Get the path to the bundled FFmpeg
+        if getattr(sys, 'frozen', False):
+            # Running in a bundle
+            bundle_dir = os.path.dirname(sys.executable)
+            ffmpeg_path = os.path.join(bundle_dir, "ffmpeg")
+            if not os.path.exists(ffmpeg_path):
+                # Try alternative locations
+                alt_paths = [
+                    os.path.join(bundle_dir, "ffmpeg"),
+                    os.path.join(os.path.dirname(bundle_dir), "MacOS", "ffmpeg"),
+                    os.path.join(bundle_dir, "..", "MacOS", "ffmpeg"),
+                    "/usr/local/bin/ffmpeg",
+                    "/opt/homebrew/bin/ffmpeg"
+                ]
+                for path in alt_paths:
+                    if os.path.exists(path):
+                        ffmpeg_path = path
+                        break
+                else:
+                    raise Exception("FFmpeg not found in the application bundle")
+            return ffmpeg_path
+        # Running in development
+        return "ffmpeg"
+
+    def combine_segments(self, store, output_path, progress_callback=None, stats=None, is_cancelled=None,
+                         nice=None, threads=None):
+        """Combine downloaded segments into a single file and return its path.
 
-    def combine_segments(self, segments_dir, output_path, progress_callback=None):
-        """Combine downloaded segments into a single file using FFmpeg."""
+        Remuxes with FFmpeg unless output_format is 'ts'. If FFmpeg is missing
+        or fails, the raw MPEG-TS segments are joined into a .ts file instead.
+        A RemuxPool passes the stats dict and cancel check of the job it runs
+        for, since the downloader may already be on its next job.
+        """
+        stats = self.stats if stats is None else stats
+        is_cancelled = is_cancelled or self.is_cancelled
+        if self.output_format == 'ts':
+            return self.concat_segments(store, output_path, progress_callback, stats)
+        
         try:
-            # Get the path to the bundled FFmpeg
-            if getattr(sys, 'frozen', False):
-                # Running in a bundle
-                bundle_dir = os.path.dirname(sys.executable)
-                ffmpeg_path = os.path.join(bundle_dir, "ffmpeg")
-                if not os.path.exists(ffmpeg_path):
-                    # Try alternative locations
-                    alt_paths = [
-                        os.path.join(bundle_dir, "ffmpeg"),
-                        os.path.join(os.path.dirname(bundle_dir), "MacOS", "ffmpeg"),
-                        os.path.join(bundle_dir, "..", "MacOS", "ffmpeg"),
-                        "/usr/local/bin/ffmpeg",
-                        "/opt/homebrew/bin/ffmpeg"
-                    ]
-                    for path in alt_paths:
-                        if os.path.exists(path):
-                            ffmpeg_path = path
-                            break
-                    else:
-                        raise Exception("FFmpeg not found in the application bundle")
-            else:
-                # Running in development
-                ffmpeg_path = "ffmpeg"
-            
-            print(f"Using FFmpeg from: {ffmpeg_path}")
-            
-            # Create a file list for FFmpeg
-            file_list = os.path.join(segments_dir, "file_list.txt")
+            self.remux_segments(store, output_path, progress_callback, is_cancelled, nice, threads)
+            stats['combine'] = {'method': 'ffmpeg'}
+            return output_path
+        except Exception as e:
+            if is_cancelled():
+                raise
+            print(f"FFmpeg failed ({e}), falling back to direct TS concatenation...")
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return self.concat_segments(store, os.path.splitext(output_path)[0] + '.ts', progress_callback, stats)
+
+    def concat_segments(self, store, output_path, progress_callback=None, stats=None):
+        """Join the raw MPEG-TS segments into output_path without FFmpeg."""
+        with open(output_path, 'wb', buffering=0) as f:
+            concat = store.write_to(f)
+        (self.stats if stats is None else stats)['combine'] = {'method': 'concat', 'concat': concat.methods}
+        if progress_callback:
+            progress_callback({
+                'percentage': 100,
+                'stage': 'complete',
+                'completed': 5,
+                'total': 5,
+                'speed': 0,
+                'eta': 0
+            })
+        return output_path
+
+    def remux_segments(self, store, output_path, progress_callback=None, is_cancelled=None, nice=None, threads=None):
+        """Remux downloaded segments from a SegmentStore into output_path using FFmpeg.
+
+        nice and threads default to ffmpeg_nice and ffmpeg_threads.
+        """
+        is_cancelled = is_cancelled or self.is_cancelled
+        nice = self.ffmpeg_nice if nice is None else nice
+        threads = self.ffmpeg_threads if threads is None else threads
+        ffmpeg_path = self.find_ffmpeg()
+        print(f"Using FFmpeg from: {ffmpeg_path}")
+        
+        file_list = None
+        paths = store.paths()
+        if paths is not None:
+            # All segments are files: use FFmpeg's concat demuxer
+            file_list = os.path.join(os.path.dirname(paths[0]), "file_list.txt")
             with open(file_list, "w") as f:
-                for segment in sorted(os.listdir(segments_dir)):
-                    if segment.endswith(".ts"):
-                        f.write(f"file '{os.path.join(segments_dir, segment)}'\n")
-            
-            # Use FFmpeg to combine segments
-            cmd = [
-                ffmpeg_path,
-                "-f", "concat",
-                "-safe", "0",
-                "-i", file_list,
-                "-c", "copy",
-                "-bsf:a", "aac_adtstoasc",
-                output_path
-            ]
-            
-            # Create a progress bar for FFmpeg
-            progress_bar = tqdm(total=100, desc="Combining segments", unit="%", position=0, leave=True)
+                for segment in paths:
+                    f.write(f"file '{segment}'\n")
+            input_args = ["-f", "concat", "-safe", "0", "-i", file_list]
+        else:
+            # Segments live in memory: stream them through FFmpeg's stdin
+            input_args = ["-f", "mpegts", "-i", "pipe:0"]
+        
+        cmd = [
+            ffmpeg_path,
+            "-hide_banner",
+            "-loglevel", "error",
+            *input_args,
+            "-c", "copy",
+            "-bsf:a", "aac_adtstoasc",
+            *(["-threads", str(threads)] if threads else []),
+            output_path
+        ]
+        
+        popen_args = {}
+        if nice and sys.platform == 'win32':
+            popen_args['creationflags'] = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        
+        try:
             last_progress = 95  # Start from where download_segments left off
             
             # Start FFmpeg process
             process = subprocess.Popen(
                 cmd,
-                stdout=subprocess.PIPE,
+                stdin=subprocess.PIPE if file_list is None else subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
-                universal_newlines=True
+                **popen_args
             )
+            if nice and hasattr(os, 'setpriority'):
+                try:
+                    os.setpriority(os.PRIO_PROCESS, process.pid, os.getpriority(os.PRIO_PROCESS, 0) + nice)
+                except OSError:
+                    # FFmpeg already exited, or not permitted
+                    pass
+            
+            feeder = None
+            if file_list is None:
+                def feed():
+                    try:
+                        store.write_to(process.stdin)
+                    except (BrokenPipeError, ValueError):
+                        # FFmpeg exited or was terminated
+                        pass
+                    finally:
+                        try:
+                            process.stdin.close()
+                        except BrokenPipeError:
+                            pass
+                feeder = threading.Thread(target=feed, daemon=True)
+                feeder.start()
             
-            # Monitor FFmpeg progress
+            # Monitor FFmpeg progress, checking for cancellation every 50 ms
+            next_progress = time.monotonic()
             while True:
                 # Check if process has finished
-                if process.poll() is not None:
+                try:
+                    process.wait(timeout=0.05)
                     break
+                except subprocess.TimeoutExpired:
+                    pass
                 
                 # Check for cancellation
-                if self.is_cancelled():
+                if is_cancelled():
                     process.terminate()
+                    try:
+                        process.wait(timeout=2)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
                     raise Exception("Download cancelled by user")
                 
+                if time.monotonic() < next_progress:
+                    continue
+                next_progress += 0.5
+                
                 # Update progress (simulate progress from 95% to 100%)
                 if last_progress < 100:
                     last_progress += 1
-                    progress_bar.update(1)
                     if progress_callback:
                         progress_callback({
                             'percentage': last_progress,
@@ -770,12 +1475,12 @@ class BohepDownloader:
                             'speed': 0,
                             'eta': 0
                         })
-                
-                time.sleep(0.5)
+            
+            if feeder is not None:
+                feeder.join()
             
             # Ensure progress reaches 100%
             if last_progress < 100:
-                progress_bar.update(100 - last_progress)
                 if progress_callback:
                     progress_callback({
                         'percentage': 100,
@@ -786,62 +1491,135 @@ class BohepDownloader:
                         'eta': 0
                     })
             
-            # Close progress bar
-            progress_bar.close()
-            
             # Check if FFmpeg completed successfully
             if process.returncode != 0:
-                stderr_output = process.stderr.read() if process.stderr else "No error output available"
+                stderr_output = process.stderr.read().decode('utf-8', errors='replace') if process.stderr else "No error output available"
                 raise Exception(f"Failed to combine segments. FFmpeg error: {stderr_output}")
             
-            # Clean up temporary files
-            os.remove(file_list)
-            shutil.rmtree(segments_dir)
+        finally:
+            # Clean up the file list
+            if file_list and os.path.exists(file_list):
+                os.remove(file_list)
+
+    def load_playlist(self, url):
+        """Fetch a media playlist and parse it into a SegmentTable with absolute URLs."""
+        parser = PlaylistParser(url.rsplit('/', 1)[0] + '/')
+        self._fetch_playlist(url, parser)
+        playlist = parser.table
+        if playlist.error is not None:
+            raise playlist.error
+        if not len(playlist):
+            raise Exception("No segments found in playlist")
+        return playlist
+
+    def open_playlist(self, url):
+        """Start fetching a media playlist and return its SegmentTable once it has a segment.
+
+        The rest of the playlist is parsed on a background thread, so segment
+        downloads can start within its first kilobytes; download_segments
+        picks up segments as they are added.
+        """
+        parser = PlaylistParser(url.rsplit('/', 1)[0] + '/')
+        reader = threading.Thread(target=self._fetch_playlist, args=(url, parser), name='playlist-reader',
+                                  daemon=True)
+        reader.start()
+        playlist = parser.table
+        playlist.wait(1)
+        if not len(playlist):
+            reader.join()
+            if playlist.error is not None:
+                raise playlist.error
+            raise Exception("No segments found in playlist")
+        return playlist
+
+    def refresh_playlist(self):
+        """Load the running job's playlist with fresh URLs, after its signed URLs expired.
+
+        When the playlist came from download(), the video page is resolved
+        again and the variant of the same resolution is loaded; otherwise
+        the same playlist URL is fetched again.
+        """
+        url = self.playlist_url
+        if self.resolution is not None and self.variant is not None and self.variant['url'] == url:
+            print("Resolving the video page again for fresh URLs")
+            resolution = self.resolve(self.resolution.page_url)
+            variant = resolution.select(self.variant['resolution'])
+            if not variant:
+                raise ValueError(f"No {self.variant['resolution']}p variant after resolving again")
+            self.resolution, self.variant = resolution, variant
+            url = self.playlist_url = variant['url']
+        return self.load_playlist(url)
+
+    def _fetch_playlist(self, url, parser):
+        """Stream a playlist into parser, closing it or failing it with the error."""
+        try:
+            # Remove Range header for playlist request
+            headers = self.session.headers.copy()
+            headers.pop('Range', None)
+            self.mount_media_url(url)
+            scope = self._playlist_scope = AbortScope()
+            if self.is_cancelled():
+                scope.abort()
+            take_connect_time()
+            started = time.perf_counter()
+            with tracer.span('playlist_fetch', url=url) as span, scope:
+                response = self.session.get(url, headers=headers, timeout=self.request_timeout, stream=True)
+                connect = take_connect_time()
+                headers_received = response.elapsed.total_seconds()
+                ok = response.status_code in [200, 206]
+                with response:
+                    # read1 returns what has arrived instead of waiting for a full chunk
+                    read = getattr(response.raw, 'read1', response.raw.read)
+                    while ok:
+                        chunk = read(64 * 1024, decode_content=True)
+                        if not chunk:
+                            break
+                        parser.feed(chunk)
+                span.set(bytes=parser.bytes, segments=len(parser.table))
+            self.metrics.record(
+                'playlist', urlsplit(url).hostname, response.status_code,
+                connect=connect,
+                ttfb=max(0.0, headers_received - connect),
+                transfer=max(0.0, time.perf_counter() - started - headers_received),
+                nbytes=parser.bytes,
+                error=not ok
+            )
             
+            if not ok:
+                raise Exception(f"Failed to fetch playlist: HTTP {response.status_code}")
         except Exception as e:
-            # Clean up on error
-            if os.path.exists(file_list):
-                os.remove(file_list)
-            if os.path.exists(segments_dir):
-                shutil.rmtree(segments_dir)
-            raise e
+            if self.is_cancelled():
+                parser.fail(Exception("Download cancelled by user"))
+            else:
+                parser.fail(Exception(f"Failed to fetch playlist: {str(e)}"))
+            return
+        parser.close()
+
+    def begin_job(self, name):
+        """Start a job's instrumentation: its request metrics, and no progress bus until segments start."""
+        self.metrics = self.metrics_registry.job(self.job_id or name)
+        self.progress = None
 
     def download_video(self, url, output_path):
-        """Download video using segment-by-segment approach."""
+        """Download video using segment-by-segment approach and return the output path."""
+        self.begin_job(os.path.splitext(os.path.basename(output_path))[0])
+        return self._download_playlist(url, output_path)
+
+    def _download_playlist(self, url, output_path, playlist=None):
+        """Download a media playlist into output_path; playlist is its SegmentTable if already loaded."""
         try:
-            # Get base URL for segments
-            base_url = url.rsplit('/', 1)[0] + '/'
-            
-            # Fetch and parse the playlist
-            try:
-                # Remove Range header for playlist request
-                headers = self.session.headers.copy()
-                headers.pop('Range', None)
-                response = self.session.get(url, headers=headers)
-                
-                if response.status_code not in [200, 206]:
-                    raise Exception(f"Failed to fetch playlist: HTTP {response.status_code}")
-                playlist_content = response.content
-            except Exception as e:
-                raise Exception(f"Failed to fetch playlist: {str(e)}")
-            
-            # Decode playlist content
-            try:
-                playlist_text = playlist_content.decode()
-            except UnicodeDecodeError:
-                playlist_text = playlist_content.decode('utf-8', errors='ignore')
-            
-            # Load playlist and set base URI
-            playlist = m3u8.loads(playlist_text)
-            
-            # Ensure all segments have absolute URLs
-            for segment in playlist.segments:
-                if not segment.uri.startswith(('http://', 'https://')):
-                    segment.uri = base_url + segment.uri
-                segment.base_uri = base_url
-            
-            if not playlist.segments:
-                raise Exception("No segments found in playlist")
+            self.playlist_url = url
+            # Before pre-warming, which only applies to HTTP/1.1 hosts
+            self.mount_media_url(url)
+            if playlist is None:
+                if self.prewarm_connections:
+                    prewarm(self.session, url, self.max_workers)
+                playlist = self.open_playlist(url)
+            segment_url = playlist[0].uri
+            self.mount_media_url(segment_url)
+            if self.prewarm_connections and urlsplit(segment_url).netloc != urlsplit(url).netloc:
+                # Segments are served from another host (e.g. a CDN)
+                prewarm(self.session, segment_url, self.max_workers)
             
             # Create output directory if it doesn't exist
             output_dir = os.path.dirname(output_path)
@@ -849,26 +1627,130 @@ class BohepDownloader:
                 os.makedirs(output_dir)
             
             # Download and combine segments
-            self.download_segments(playlist.segments, output_path, self.progress_callback)
+            return self.download_segments(playlist, output_path, self.progress_callback)
             
         except Exception as e:
             raise Exception(f"Failed to download video: {str(e)}")
 
+    def select_auto_quality(self, video_urls):
+        """Sample the throughput on the best variant and return the variant to download.
+
+        The first auto_quality_samples segments of the highest variant are
+        fetched concurrently; if that variant is chosen they and its playlist
+        (prefetched_playlist) are reused instead of being downloaded again.
+        """
+        variants = [
+            v for v in video_urls
+            if isinstance(v, dict) and v.get('url') and isinstance(v.get('resolution'), (int, float))
+        ]
+        if not variants:
+            raise ValueError("Could not find suitable video quality")
+        best = max(variants, key=lambda v: v['resolution'])
+        
+        with tracer.span('auto_quality', url=best['url']):
+            playlist = self.load_playlist(best['url'])
+            media_duration = playlist.duration()
+            selector = QualitySelector(variants, media_duration, self.auto_quality_deadline)
+            samples = playlist[:max(1, self.auto_quality_samples)]
+            
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sample-worker') as executor:
+                futures = {executor.submit(self._sample_segment, segment): segment for segment in samples}
+                data = {self.segment_url(futures[future]): future.result() for future in as_completed(futures)}
+            selector.record_sample(
+                best,
+                sum(len(d) for d in data.values()),
+                sum(segment.duration or 0 for segment in samples),
+                time.monotonic() - started
+            )
+        
+        chosen = selector.choose()
+        self.stats['auto_quality'] = selector.summary(chosen)
+        print(f"Measured {selector.throughput / 1024 / 1024:.2f} MB/s; projected download times:",
+              self.stats['auto_quality']['projected'])
+        if chosen is best:
+            self.prefetched_segments = data
+            self.prefetched_playlist = playlist
+        return chosen
+
+    def _sample_segment(self, segment):
+        sink = io.BytesIO()
+        self.download_segment(segment, sink)
+        return sink.getvalue()
+
     def get_output_filename(self) -> str:
         """Return the path of the downloaded video file."""
         return str(self.output_file) if self.output_file else ""
     
-    def download(self, url: str, quality: str = "720p", save_dir: Optional[str] = None, progress_callback: Optional[Callable[[float], None]] = None) -> None:
-        """Download a video from the given URL."""
+    def run_node(self, node_path, script, code):
+        """Run a Node.js decode and return the CompletedProcess.
+
+        The decode goes to node_decoder when set, and to a Node.js process of
+        its own if that fails. Either process joins the calling thread's
+        AbortScope, so aborting the scope kills it.
+        """
+        if self.node_decoder is not None:
+            try:
+                return self.node_decoder.run(node_path, script, code, timeout=self.page_timeout)
+            except subprocess.TimeoutExpired:
+                raise
+            except (OSError, subprocess.SubprocessError) as e:
+                print(f"Node.js decoder failed, starting Node.js for this decode: {e}")
+        args = [node_path, script, code]
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        register_abortable(KillOnAbort(process))
+        try:
+            stdout, stderr = process.communicate(timeout=self.page_timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    def resolve(self, url, scope=None):
+        """Fetch and decode a video page and return a Resolution of its variants.
+
+        Pass the result to download() to skip resolving the page again. With
+        an AbortScope, another thread can stop the resolve: scope.abort()
+        closes its connections and kills the Node.js decode.
+        """
+        video_id = self.extract_video_id(url)
+        if not video_id:
+            raise ValueError("Invalid URL format")
+        scope = scope or AbortScope()
+        try:
+            with tracer.span('resolve', url=url), scope:
+                video_urls = self.get_m3u8_url(url)
+        except Exception:
+            # Failing because of the abort is reported as the cancellation below
+            if not scope.aborted:
+                raise
+        if scope.aborted:
+            raise ValueError("URL check cancelled")
+        if not video_urls:
+            raise ValueError("No video URLs found")
+        return Resolution(url, video_id, video_urls, max_age=self.resolution_max_age)
+
+    def download(self, url: str, quality="720p", save_dir: Optional[str] = None, progress_callback: Optional[Callable[[float], None]] = None, rate_limit: Optional[float] = None, resolution: Optional[Resolution] = None) -> dict:
+        """Download a video from the given URL and return a JSON-serializable summary.
+
+        quality is a resolution such as "720p", "auto", or one of the variant
+        dicts of `resolution`. A Resolution from resolve() for the same URL
+        is used as long as it hasn't expired, instead of fetching the page
+        again.
+        """
         self.progress_callback = progress_callback
         self.reset_cancellation()
+        self.stats = {}
+        self.remux_task = None
+        self.prefetched_segments = {}
+        self.prefetched_playlist = None
+        # rate_limit only applies to this call; the previous limit comes back after it
+        previous_rate = (self.job_bucket.rate, self.job_bucket.burst)
+        if rate_limit is not None:
+            self.set_rate_limit(rate_limit)
         
         try:
-            # Extract video ID
-            video_id = self.extract_video_id(url)
-            if not video_id:
-                raise ValueError("Invalid URL format")
-            
             # Set output directory
             if not save_dir:
                 save_dir = str(Path.home() / "Downloads")
@@ -876,48 +1758,41 @@ class BohepDownloader:
             # Create output directory if it doesn't exist
             os.makedirs(save_dir, exist_ok=True)
             
-            # Convert target quality to integer (e.g., "720p" -> 720)
-            target_resolution = int(quality.replace('p', ''))
-            
-            # Get fresh video URLs
-            video_urls = self.get_m3u8_url(url)
-            if not video_urls:
-                raise ValueError("No video URLs found")
-            
-            # Find exact quality match first
-            selected_url = None
-            selected_resolution = None
+            # Reuse the caller's resolution unless it is for another page or expired
+            reused = resolution is not None and resolution.page_url == url and not resolution.expired()
+            if resolution is not None and resolution.page_url == url and not reused:
+                print("Resolved video URLs have expired, resolving again")
+            if not reused:
+                resolution = self.resolve(url)
+            self.resolution = resolution
+            self.stats['resolve'] = {'reused': reused, 'age': round(time.time() - resolution.resolved_at, 1)}
+            video_id = resolution.video_id
+            video_urls = resolution.variants
             
             # Print available qualities for debugging
             print("Available qualities:", [f"{url_info.get('resolution')}p" for url_info in video_urls if isinstance(url_info, dict)])
-            print("Target resolution:", target_resolution)
             
-            # Find exact match or closest quality
-            for url_info in video_urls:
-                if not isinstance(url_info, dict):
-                    continue
-                    
-                resolution = url_info.get('resolution')
-                if not isinstance(resolution, (int, float)):
-                    continue
-                    
-                video_url = url_info.get('url')
-                if not video_url:
-                    continue
-                
-                if resolution == target_resolution:
-                    selected_url = video_url
-                    selected_resolution = resolution
-                    break
-                elif not selected_resolution or abs(resolution - target_resolution) < abs(selected_resolution - target_resolution):
-                    selected_url = video_url
-                    selected_resolution = resolution
+            auto = isinstance(quality, str) and quality.lower() == 'auto'
+            if isinstance(quality, dict):
+                # A variant of the caller's resolution; pick it again if that was refreshed
+                selected = quality if any(quality is v for v in video_urls) else resolution.select(quality['resolution'])
+            elif auto:
+                # The samples belong to this job's metrics, not the previous one's
+                self.begin_job(video_id)
+                selected = self.select_auto_quality(video_urls)
+            else:
+                print("Target resolution:", int(quality.replace('p', '')))
+                # Find exact match or closest quality
+                selected = resolution.select(quality)
             
-            if not selected_url:
+            if not selected:
                 raise ValueError("Could not find suitable video quality")
+            self.variant = selected
+            selected_url = selected['url']
+            selected_resolution = selected['resolution']
             
             # Set output filename
-            output_file = os.path.join(save_dir, f"{video_id}-{selected_resolution}p.mp4")
+            output_file = os.path.join(save_dir, f"{video_id}-{selected_resolution}p.{self.output_format}")
             
             # Download the video
             if progress_callback:
@@ -927,20 +1802,38 @@ class BohepDownloader:
             print(f"Selected quality: {selected_resolution}p")
             print(f"Selected URL: {selected_url}")
             
-            self.download_video(selected_url, output_file)
+            # The combine step may fall back to a .ts file
+            with tracer.span('download_video', url=selected_url):
+                if auto:
+                    playlist, self.prefetched_playlist = self.prefetched_playlist, None
+                    output_file = self._download_playlist(selected_url, output_file, playlist) or output_file
+                else:
+                    output_file = self.download_video(selected_url, output_file) or output_file
+            self.output_file = output_file
             
             if progress_callback:
                 progress_callback({'percentage': 100, 'completed': 0, 'total': 0, 'speed': 0, 'eta': 0})
             
-            if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+            if self.remux_task is not None:
+                # remux_task.result() returns the final path once FFmpeg is done
+                print(f"\nSegments downloaded, queued for remux to: {output_file}")
+            elif os.path.exists(output_file) and os.path.getsize(output_file) > 0:
                 print(f"\nDownload completed! File saved as: {output_file}")
             else:
                 raise Exception("Download failed - output file is empty or does not exist")
             
+            self.metrics.finish()
+            # A remux that already finished may have recorded a fallback path
+            self.stats.setdefault('output_file', output_file)
+            self.stats['metrics'] = self.metrics.summary()
+            return self.stats
+            
         except Exception as e:
             print(f"Error: {str(e)}")
             raise
         finally:
+            if rate_limit is not None:
+                self.job_bucket.set_rate(*previous_rate)
             if self.temp_dir and os.path.exists(self.temp_dir):
                 shutil.rmtree(self.temp_dir)
 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import requests
+
+# Statuses a CDN answers expired or revoked signed URLs with
+EXPIRY_STATUSES = (403, 410)
+
+
+def is_expiry_error(error):
+    """Return True if a segment failed the way an expired signed URL does."""
+    return (isinstance(error, requests.HTTPError) and error.response is not None
+            and error.response.status_code in EXPIRY_STATUSES)
+
+
+class URLRefresher:
+    """Moves a download onto fresh segment URLs when the signed ones expire.
+
+    Segments failing with 403/410 are set aside instead of failing the job.
+    Once `threshold` segments have, or nothing else is left in flight, the
+    job's URLs are considered expired: refresh() loads a fresh playlist
+    (re-resolving the page when possible) and the set-aside segments are
+    queued in `retry`. Requests that were already running with the old
+    URLs go straight to `retry` when they fail. Segments are matched by
+    media sequence number, so a fresh playlist that starts at a different
+    sequence still lines up, and segments already downloaded are kept.
+    """
+
+    def __init__(self, segments, refresh, threshold=3, max_refreshes=2):
+        self.segments = segments  # SegmentTable the job started with
+        self.refresh = refresh  # returns a fresh, loaded SegmentTable
+        self.threshold = threshold
+        self.max_refreshes = max_refreshes
+        self.fresh = None
+        self.offset = 0  # index in fresh = index in segments + offset
+        self.failed = set()  # indexes set aside since the last refresh
+        self.retry = []  # indexes to fetch again from the current URLs
+        self.refreshes = 0  # also the generation of the current URLs
+        self.retried = 0
+
+    def segment(self, index):
+        """Return the segment to fetch for an index, from the fresh playlist if there is one."""
+        if self.fresh is not None and 0 <= index + self.offset < len(self.fresh):
+            return self.fresh[index + self.offset]
+        return self.segments[index]
+
+    def record(self, index, error, generation):
+        """Set a failed segment aside; return False if the error isn't expiry-like.
+
+        generation is the `refreshes` count the failed request's URL came from.
+        """
+        if not is_expiry_error(error):
+            return False
+        if generation < self.refreshes:
+            # Its URL was already replaced; no reason to refresh again
+            self.retry.append(index)
+            self.retried += 1
+            return True
+        if self.refreshes >= self.max_refreshes:
+            return False
+        self.failed.add(index)
+        return True
+
+    def due(self, idle):
+        """Return True if the set-aside segments should be retried from a fresh playlist now."""
+        return bool(self.failed) and (len(self.failed) >= self.threshold or idle)
+
+    def refresh_urls(self):
+        """Load a fresh playlist and queue the set-aside segments for retry."""
+        self.refreshes += 1
+        fresh = self.refresh()
+        offset = self.segments.media_sequence - fresh.media_sequence
+        missing = [i for i in self.failed if not 0 <= i + offset < len(fresh)]
+        if missing:
+            raise Exception(
+                f"Refreshed playlist does not cover segment {min(missing)} "
+                f"(media sequence {self.segments.media_sequence + min(missing)})"
+            )
+        self.fresh = fresh
+        self.offset = offset
+        self.retry.extend(sorted(self.failed))
+        self.retried += len(self.failed)
+        self.failed.clear()
+
+    def summary(self):
+        return {'refreshes': self.refreshes, 'retried_segments': self.retried}
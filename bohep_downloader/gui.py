@@ -3,9 +3,11 @@ from tkinter import ttk, messagebox, filedialog
 import threading
 import os
 from bohep_downloader.downloader import BohepDownloader
+from bohep_downloader.transport import AbortScope
 from pathlib import Path
 import re
-from queue import Queue
+import time
+from queue import Queue, Empty
 
 class BohepDownloaderGUI:
     def __init__(self, root):
@@ -132,13 +134,24 @@ class BohepDownloaderGUI:
         self.cancel_button = ttk.Button(button_container, text="Cancel", command=self.cancel_download, state=tk.DISABLED)
         self.cancel_button.pack(side=tk.LEFT, ipadx=15, ipady=8)
         
-        # Initialize downloader
-        self.downloader = None
+        # One downloader, and so one warm session, for all checks and downloads
+        self.downloader = BohepDownloader()
         self.download_thread = None
         self.available_qualities = []
         self.video_urls = None  # Store video URLs after checking
+        self.resolution = None  # Resolution of the checked URL, reused by the download
         self.is_downloading = False
         
+        # URL checks run on a worker thread and report back through this queue
+        self.check_queue = Queue()
+        self.check_timeout = 45  # seconds
+        self.check_id = 0  # results of older checks are ignored
+        self.checking_url = None
+        self.check_scope = None  # AbortScope of the running check
+        self.checked_url = None
+        self.check_started = None
+        self.spinner_index = 0
+        
         # Add hover effects to buttons
         self.add_hover_effects()
         
@@ -154,56 +167,129 @@ class BohepDownloaderGUI:
             button.bind("<Enter>", on_enter)
             button.bind("<Leave>", on_leave)
             
+    SPINNER = "|/-\\"
+    
     def check_url(self):
-        """Check URL and update available qualities."""
+        """Check URL in the background and update available qualities."""
         try:
             url = self.url_entry.get().strip()
             if not url:
                 raise ValueError("Please enter a video URL")
-            
-            self.check_url_button.config(state=tk.DISABLED)
-            self.update_status("Checking URL...")
-            
-            # Create downloader instance
-            self.downloader = BohepDownloader()
-            
-            # Get video URLs and store them
-            self.video_urls = self.downloader.get_m3u8_url(url)
-            
-            if not self.video_urls:
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        # Repeated checks of the same URL: reuse the result or the running check
+        if url == self.checking_url:
+            return
+        if url == self.checked_url and self.video_urls:
+            self.update_status("URL checked successfully")
+            return
+        
+        self.check_id += 1
+        self.checking_url = url
+        self.check_started = time.monotonic()
+        self.check_url_button.config(text="Cancel", command=self.cancel_check)
+        
+        # Aborted by cancel_check(), which kills the page request and Node.js decode
+        self.check_scope = AbortScope()
+        threading.Thread(target=self._check_worker, args=(self.check_id, url, self.check_scope),
+                         daemon=True).start()
+        self._poll_check()
+    
+    def _check_worker(self, check_id, url, scope):
+        """Resolve the video URLs off the Tk thread."""
+        try:
+            resolution = self.downloader.resolve(url, scope)
+            self.check_queue.put((check_id, url, resolution, None))
+        except Exception as e:
+            self.check_queue.put((check_id, url, None, e))
+    
+    def _poll_check(self):
+        """Animate the spinner and apply check results on the Tk thread."""
+        try:
+            while True:
+                check_id, url, resolution, error = self.check_queue.get_nowait()
+                if check_id != self.check_id or self.checking_url is None:
+                    # Cancelled, timed out or superseded by a newer check
+                    continue
+                self._finish_check()
+                if error is not None:
+                    self._check_failed(str(error))
+                else:
+                    self._apply_check(url, resolution)
+                return
+        except Empty:
+            pass
+        
+        if self.checking_url is None:
+            return
+        if time.monotonic() - self.check_started > self.check_timeout:
+            self._finish_check()
+            self._check_failed(f"Timed out after {self.check_timeout} seconds")
+            return
+        
+        self.spinner_index = (self.spinner_index + 1) % len(self.SPINNER)
+        self.update_status(f"Checking URL... {self.SPINNER[self.spinner_index]}")
+        self.root.after(100, self._poll_check)
+    
+    def _finish_check(self):
+        # Stops the check if it is still running (cancelled or timed out)
+        if self.check_scope is not None:
+            self.check_scope.abort()
+            self.check_scope = None
+        self.checking_url = None
+        self.check_url_button.config(text="Check URL", command=self.check_url)
+    
+    def cancel_check(self):
+        """Stop waiting for the running URL check."""
+        if self.checking_url is None:
+            return
+        self._finish_check()
+        self.update_status("URL check cancelled")
+    
+    def _apply_check(self, url, resolution):
+        video_urls = resolution.variants
+        try:
+            if not video_urls:
                 raise ValueError("No video URLs found")
             
             # Update available qualities
-            self.available_qualities = []
-            for url_info in self.video_urls:
+            available_qualities = []
+            for url_info in video_urls:
                 if isinstance(url_info, dict) and 'resolution' in url_info:
-                    resolution = url_info['resolution']
-                    if isinstance(resolution, (int, float)):
-                        self.available_qualities.append(f"{resolution}p")
+                    height = url_info['resolution']
+                    if isinstance(height, (int, float)):
+                        available_qualities.append(f"{height}p")
             
             # Remove duplicates and sort
-            self.available_qualities = sorted(list(set(self.available_qualities)), 
-                                           key=lambda x: int(x.replace('p', '')), 
-                                           reverse=True)
+            available_qualities = sorted(list(set(available_qualities)),
+                                         key=lambda x: int(x.replace('p', '')),
+                                         reverse=True)
             
-            if not self.available_qualities:
+            if not available_qualities:
                 raise ValueError("No valid qualities found")
-            
-            self.quality_combo['values'] = self.available_qualities
-            
-            # Select highest quality by default
-            if self.available_qualities:
-                self.quality_var.set(self.available_qualities[0])
-            
-            self.update_status("URL checked successfully")
-            self.check_url_button.config(state=tk.NORMAL)
-            
         except Exception as e:
-            self.update_status("Error checking URL")
-            messagebox.showerror("Error", str(e))
-            self.check_url_button.config(state=tk.NORMAL)
-            self.downloader = None
-            self.video_urls = None
+            self._check_failed(str(e))
+            return
+        
+        self.resolution = resolution
+        self.video_urls = video_urls
+        self.checked_url = url
+        self.available_qualities = available_qualities
+        # "auto" picks the quality by the throughput measured on the first segments
+        self.quality_combo['values'] = self.available_qualities + ['auto']
+        
+        # Select highest quality by default
+        self.quality_var.set(self.available_qualities[0])
+        self.update_status("URL checked successfully")
+    
+    def _check_failed(self, message):
+        self.update_status("Error checking URL")
+        messagebox.showerror("Error", message)
+        self.resolution = None
+        self.video_urls = None
+        self.checked_url = None
     
     def browse_location(self):
         directory = filedialog.askdirectory(initialdir=self.location_entry.get())
@@ -260,9 +346,6 @@ class BohepDownloaderGUI:
                 self.progress_var.set(progress_data)
                 if progress_data < 100:
                     self.progress_details.config(text=f"Processing: {progress_data:.1f}%")
-            
-            # Force GUI update
-            self.root.update_idletasks()
         except Exception as e:
             print(f"Error updating progress: {e}")
             # Don't raise the error to avoid breaking the download
@@ -326,10 +409,6 @@ class BohepDownloaderGUI:
             if not save_dir:
                 save_dir = str(Path.home() / "Downloads")
             
-            # Ensure we have a valid downloader instance
-            if not self.downloader:
-                self.downloader = BohepDownloader()
-            
             # Reset cancellation flag
             self.downloader.reset_cancellation()
             
@@ -338,7 +417,8 @@ class BohepDownloaderGUI:
             self.update_status("Preparing download...")
             self.root.update_idletasks()  # Force GUI update
             
-            # Create a simple progress callback that directly updates the GUI
+            # Progress snapshots arrive from the downloader's progress bus at
+            # most progress_interval apart; apply them on the Tk thread
             def progress_callback(progress_data):
                 # Use a simple function to avoid recursion
                 def update():
@@ -351,7 +431,9 @@ class BohepDownloaderGUI:
                 url=url,
                 quality=quality,
                 save_dir=save_dir,
-                progress_callback=progress_callback
+                progress_callback=progress_callback,
+                # Skip the page fetch and decode done by check_url
+                resolution=self.resolution if url == self.checked_url else None
             )
             
             # Check if download was cancelled
@@ -392,6 +474,9 @@ class BohepDownloaderGUI:
         if self.is_downloading:
             return
             
+        # A check still running would share the downloader's session with the download
+        self.cancel_check()
+        
         # Disable download button and enable cancel button
         self.download_button.config(state=tk.DISABLED)
         self.cancel_button.config(state=tk.NORMAL)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import bisect
+import itertools
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+from bohep_downloader.transport import AbortScope
+
+
+class HedgePolicy:
+    """Tracks segment latencies for a job and decides when to hedge a straggler."""
+
+    def __init__(self, percentile=95, multiplier=2.0, min_samples=10, min_delay=1.0, hosts=None):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.hosts = list(hosts or [])
+        self._host_cycle = itertools.cycle(self.hosts) if self.hosts else None
+        self._lock = threading.Lock()
+        self._latencies = []  # kept sorted
+        self.hedged = 0
+        self.wins = 0
+
+    def record(self, seconds):
+        """Record the latency of a completed segment."""
+        with self._lock:
+            bisect.insort(self._latencies, seconds)
+
+    def threshold(self):
+        """Return the elapsed time after which a segment gets hedged, or None."""
+        with self._lock:
+            count = len(self._latencies)
+            if not self.multiplier or count < self.min_samples:
+                return None
+            # Nearest-rank percentile
+            rank = max(0, min(count - 1, int(round(self.percentile / 100.0 * count)) - 1))
+            return max(self.min_delay, self.multiplier * self._latencies[rank])
+
+    def hedge_url(self, url):
+        """Return the URL for a duplicate request, on an alternate host if configured."""
+        if self._host_cycle is None:
+            return url
+        with self._lock:
+            host = next(self._host_cycle)
+        parts = urlsplit(url)
+        return urlunsplit((parts.scheme, host, parts.path, parts.query, parts.fragment))
+
+    def summary(self):
+        """Return hedge counters for reporting and threshold tuning."""
+        return {
+            'hedged': self.hedged,
+            'hedge_wins': self.wins,
+            'threshold': self.threshold(),
+            'percentile': self.percentile,
+            'multiplier': self.multiplier,
+        }
+
+
+class SegmentAttempt:
+    """One request for a segment; a hedged segment has two of them."""
+
+    def __init__(self, index, url, hedge=False):
+        self.index = index
+        self.url = url
+        self.hedge = hedge
+        self.abort = threading.Event()
+        self.started = None
+        self.sink = None  # created by the worker when the request starts
+        self.media = None  # PTS scan of the finished segment
+        self.scope = AbortScope()  # connections of this request, for cancel()
+        self.generation = 0  # URL refresh the request's URL comes from
+
+    def cancel(self):
+        """Stop the request, closing its connection if it is in flight."""
+        self.abort.set()
+        self.scope.abort()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+
+import http.client
+import os
+import posixpath
+import socket
+import ssl
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.cookies import extract_cookies_to_jar
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+
+from bohep_downloader.transport import TimedHTTPAdapter, add_connect_time, register_abortable
+
+try:
+    import httpx
+except ImportError:  # optional, only needed for HTTP2Adapter (pip install httpx[http2])
+    httpx = None
+
+# Connection-specific headers are not allowed in HTTP/2 requests
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+# httpcore's HTTP/2 connection state isn't fully thread-safe; these escape
+# from it when threads race on a connection, which then is broken
+INTERNAL_ERRORS = (KeyError, RuntimeError)
+
+
+class _Stream:
+    """One HTTP/2 request in flight, registered with the caller's AbortScope."""
+
+    __slots__ = ('adapter', 'host', 'aborted')
+
+    def __init__(self, adapter, host):
+        self.adapter = adapter
+        self.host = host
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+        self.adapter._abort(self.host)
+
+    def check(self, request):
+        if self.aborted:
+            raise requests.ConnectionError("Request aborted", request=request)
+
+
+class _OriginalResponse:
+    """Stands in for the http.client response requests reads Set-Cookie headers from."""
+
+    def __init__(self, headers):
+        self.msg = http.client.HTTPMessage()
+        for key, value in headers.multi_items():
+            self.msg[key] = value
+
+
+class _StreamBody:
+    """File-like view of an httpx response body, used as requests.Response.raw.
+
+    Data is already decoded, so the SegmentWriter reads it through read().
+    The host's stream slot is released once the body is exhausted or closed.
+    httpx errors are raised as their requests equivalents.
+    """
+
+    def __init__(self, response, release, stream, request):
+        self._response = response
+        self._chunks = response.iter_bytes()
+        self._pending = b''
+        self._release = release
+        self._stream = stream
+        self._request = request
+        self._original_response = _OriginalResponse(response.headers)
+
+    def _next(self):
+        self._stream.check(self._request)
+        try:
+            return next(self._chunks, b'')
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(e, request=self._request)
+        except (httpx.TransportError, *INTERNAL_ERRORS) as e:
+            self._stream.check(self._request)
+            raise requests.ConnectionError(e, request=self._request)
+
+    def read(self, amt=None, decode_content=True):
+        if amt is None:
+            chunks = [self._pending]
+            while True:
+                chunk = self._next()
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            self._pending = b''
+            self.close()
+            return b''.join(chunks)
+        # Like a socket, return what the next chunk holds rather than waiting for amt bytes
+        if not self._pending:
+            self._pending = self._next()
+        data, self._pending = self._pending[:amt], self._pending[amt:]
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        self._response.close()
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    release_conn = close
+
+
+class HTTP2Adapter(BaseAdapter):
+    """requests transport adapter that sends requests over HTTP/2 with httpx.
+
+    All requests to a host share one multiplexed connection instead of
+    opening one connection per concurrent request. At most
+    `max_streams_per_host` requests per host are in flight; the rest wait
+    for a free stream. Hosts that don't speak HTTP/2 are served over
+    HTTP/1.1: over TLS httpx negotiates that itself, and a host that fails
+    the HTTP/2 connection preface is remembered and sent to `fallback` (a
+    TimedHTTPAdapter). Plain http:// URLs go to the fallback unless
+    `cleartext` is set, which speaks HTTP/2 with prior knowledge (h2c).
+    requests' `verify`, `cert` and proxy settings are applied: each
+    combination of them gets its own httpx client.
+
+    The adapter is meant for media traffic only. It is mounted once for all
+    URLs, before any request is made, and sends a request over HTTP/2 only
+    if it lies below the directory of a playlist or segment URL given to
+    add_media_url(); everything else, such as the page fetch, goes to
+    `fallback`. Changing the session's adapters while other threads send
+    requests isn't safe, so media URLs are kept in the adapter instead, up
+    to the `max_media_prefixes` most recently added directories. Requests
+    join the caller's AbortScope. As
+    a connection carries many requests, aborting one only stops it at its
+    next read; once every request to a host is aborted, the host's
+    connections are shut down, which wakes all of them at once.
+
+    `stats` counts connections, TLS handshakes, connect time, requests per
+    HTTP version and fallbacks; `http1_hosts` lists the hosts that failed
+    the HTTP/2 preface.
+    """
+
+    def __init__(self, max_streams_per_host=100, max_connections=20, cleartext=False, fallback=None,
+                 max_media_prefixes=1024):
+        if httpx is None:
+            raise ImportError("HTTP2Adapter requires httpx with HTTP/2 support (pip install httpx[http2])")
+        super().__init__()
+        self.max_streams_per_host = max_streams_per_host
+        self.cleartext = cleartext
+        self.max_connections = max_connections
+        self._clients = {}  # (verify, cert, proxy) -> httpx.Client
+        self.fallback = fallback or TimedHTTPAdapter(pool_maxsize=max_connections)
+        self._lock = threading.Lock()
+        self._slots = {}  # host -> BoundedSemaphore of max_streams_per_host
+        self._http1_hosts = set()  # hosts that failed the HTTP/2 preface
+        self._http2_hosts = set()  # hosts that answered over HTTP/2
+        self._streams = {}  # host -> set of _Stream in flight
+        self._sockets = {}  # host -> sockets of its httpx connections
+        self._local = threading.local()
+        self.max_media_prefixes = max_media_prefixes
+        self._media_prefixes = OrderedDict()  # directory URL -> None, least recently added first
+        self.stats = Counter()
+
+    def _client(self, verify, cert, proxy):
+        """Return the httpx client for a request's TLS and proxy settings."""
+        key = (verify, cert, proxy)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = httpx.Client(
+                    http1=not self.cleartext,
+                    http2=True,
+                    verify=_ssl_context(verify, cert),
+                    proxy=proxy,
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections),
+                    follow_redirects=False,
+                )
+            return client
+
+    @property
+    def http1_hosts(self):
+        with self._lock:
+            return sorted(self._http1_hosts)
+
+    def add_media_url(self, url):
+        """Send the requests below url's directory over HTTP/2; return the directory URL."""
+        parts = urlsplit(url)
+        directory = posixpath.dirname(parts.path)
+        prefix = f"{parts.scheme.lower()}://{parts.netloc.lower()}{directory.rstrip('/')}/"
+        with self._lock:
+            self._media_prefixes[prefix] = None
+            self._media_prefixes.move_to_end(prefix)
+            while len(self._media_prefixes) > self.max_media_prefixes:
+                self._media_prefixes.popitem(last=False)
+        return prefix
+
+    def is_media_url(self, url):
+        """Return True if url lies below a directory given to add_media_url()."""
+        parts = urlsplit(url)
+        base = f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+        directory = posixpath.dirname(parts.path).rstrip('/')
+        with self._lock:
+            while True:
+                if f"{base}{directory}/" in self._media_prefixes:
+                    return True
+                if not directory:
+                    return False
+                directory = posixpath.dirname(directory).rstrip('/')
+
+    def adapter_for(self, url):
+        """Return the adapter that sends requests for url: this one or `fallback`."""
+        parts = urlsplit(url)
+        if (parts.scheme == 'http' and not self.cleartext) or parts.netloc in self._http1_hosts:
+            return self.fallback
+        return self if self.is_media_url(url) else self.fallback
+
+    def _abort(self, host):
+        # Shut the host's connections down once no live request is left on them
+        with self._lock:
+            if any(not stream.aborted for stream in self._streams.get(host, ())):
+                return
+            sockets = self._sockets.pop(host, set())
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # Already closed
+                pass
+
+    def _finish(self, stream, slot):
+        with self._lock:
+            streams = self._streams.get(stream.host)
+            if streams is not None:
+                streams.discard(stream)
+        slot.release()
+
+    def _slot(self, host):
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = self._slots[host] = threading.BoundedSemaphore(self.max_streams_per_host)
+            return slot
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _trace(self, event, info):
+        # httpcore trace extension, called on the requesting thread
+        if event in ('connection.connect_tcp.started', 'connection.start_tls.started'):
+            self._local.started = time.perf_counter()
+        elif event in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+            elapsed = time.perf_counter() - self._local.started
+            add_connect_time(elapsed)
+            self._count('connect_time', elapsed)
+            self._count('connections' if event == 'connection.connect_tcp.complete' else 'tls_handshakes')
+            sock = info['return_value'].get_extra_info('socket')
+            if event == 'connection.connect_tcp.complete' and sock is not None:
+                with self._lock:
+                    sockets = self._sockets.setdefault(self._local.host, set())
+                    # Forget the sockets of connections closed since
+                    sockets.difference_update([s for s in sockets if s.fileno() == -1])
+                    sockets.add(sock)
+
+    def _timeout(self, timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        host = urlsplit(request.url).netloc
+        if self.adapter_for(request.url) is not self:
+            return self.fallback.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert,
+                                      proxies=proxies)
+        client = self._client(verify, cert, select_proxy(request.url, proxies or {}))
+
+        slot = self._slot(host)
+        slot.acquire()
+        inflight = _Stream(self, host)
+        with self._lock:
+            self._streams.setdefault(host, set()).add(inflight)
+        try:
+            register_abortable(inflight)
+            inflight.check(request)
+            headers = [(k, v) for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+            started = time.perf_counter()
+            self._local.host = host
+            response = client.send(
+                client.build_request(
+                    request.method, request.url, headers=headers, content=request.body,
+                    timeout=self._timeout(timeout), extensions={'trace': self._trace}
+                ),
+                stream=True
+            )
+        except httpx.TimeoutException as e:
+            self._finish(inflight, slot)
+            raise requests.Timeout(e, request=request)
+        except httpx.TransportError as e:
+            self._finish(inflight, slot)
+            inflight.check(request)
+            if host not in self._http2_hosts and isinstance(e, httpx.RemoteProtocolError):
+                # Not an HTTP/2 server; use HTTP/1.1 from now on (listed in http1_hosts)
+                with self._lock:
+                    self._http1_hosts.add(host)
+                self._count('fallbacks')
+                return self.fallback.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert,
+                                          proxies=proxies)
+            raise requests.ConnectionError(e, request=request)
+        except INTERNAL_ERRORS as e:
+            self._finish(inflight, slot)
+            raise requests.ConnectionError(e, request=request)
+        except BaseException:
+            self._finish(inflight, slot)
+            raise
+
+        if response.http_version == 'HTTP/2':
+            with self._lock:
+                self._http2_hosts.add(host)
+        self._count(response.http_version)
+        return self.build_response(request, response, lambda: self._finish(inflight, slot),
+                                   time.perf_counter() - started, inflight)
+
+    def build_response(self, request, response, release, elapsed, inflight):
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.headers = CaseInsensitiveDict(response.headers)
+        result.encoding = get_encoding_from_headers(result.headers)
+        result.reason = response.reason_phrase
+        result.url = request.url
+        result.request = request
+        result.connection = self
+        result.elapsed = timedelta(seconds=elapsed)
+        result.raw = _StreamBody(response, release, inflight, request)
+        extract_cookies_to_jar(result.cookies, request, result.raw)
+        return result
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+        self.fallback.close()
+
+
+def _ssl_context(verify, cert):
+    """Build the SSL context for requests' verify (bool or CA bundle path) and cert settings."""
+    if isinstance(verify, str):
+        if os.path.isdir(verify):
+            context = ssl.create_default_context(capath=verify)
+        else:
+            context = ssl.create_default_context(cafile=verify)
+    else:
+        context = ssl.create_default_context()
+        if not verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+    if cert:
+        certfile, keyfile = cert if isinstance(cert, tuple) else (cert, None)
+        context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def mount_http2_adapter(session, urls=(), max_streams_per_host=100, pool_maxsize=20, cleartext=False):
+    """Create an HTTP2Adapter, mount it on session for http and https, and add urls as media URLs.
+
+    Call this before the session is shared with other threads. The adapter
+    session had for https:// serves everything that isn't media traffic;
+    more media URLs can be added at any time with adapter.add_media_url(url).
+    """
+    fallback = session.get_adapter('https://')
+    adapter = HTTP2Adapter(max_streams_per_host=max_streams_per_host, max_connections=pool_maxsize,
+                           cleartext=cleartext, fallback=fallback if isinstance(fallback, TimedHTTPAdapter) else None)
+    for url in urls:
+        adapter.add_media_url(url)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return adapter
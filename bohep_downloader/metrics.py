@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PHASES = ('connect', 'ttfb', 'transfer', 'total')
+
+# Metric name (without the bohep_ or bohep_job_ prefix) -> (type, help)
+METRIC_TYPES = OrderedDict([
+    ('requests_total', ('counter', 'HTTP requests by kind, host and status.')),
+    ('request_errors_total', ('counter', 'Requests that failed.')),
+    ('request_retries_total', ('counter', 'Retries made before a request succeeded or gave up.')),
+    ('request_bytes_total', ('counter', 'Response body bytes received.')),
+    ('request_duration_seconds', ('histogram', 'Request phase durations (connect, ttfb, transfer, total).')),
+    ('throughput_bytes_per_second', ('gauge', 'Segment bytes per second of wall time.')),
+])
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram that also keeps recent samples for quantiles."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets=BUCKETS, max_samples=10000):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+    def prometheus(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class HostStats:
+    """Request counters and timing histograms for one (kind, host) pair."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.status = {}
+        self.histograms = {phase: Histogram() for phase in PHASES}
+
+    def summary(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'status': dict(self.status),
+            **{phase: self.histograms[phase].summary() for phase in PHASES},
+        }
+
+
+class RequestMetrics:
+    """Per-request timings aggregated per request kind and host."""
+
+    def __init__(self, name=None, parent=None):
+        self.name = name
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.hosts = {}  # (kind, host) -> HostStats
+        self.started = time.time()
+        self.finished = None
+
+    def record(self, kind, host, status=None, connect=0.0, ttfb=0.0, transfer=0.0, nbytes=0, retries=0, error=False):
+        """Record one finished request (status is None when no response arrived)."""
+        with self._lock:
+            stats = self.hosts.get((kind, host))
+            if stats is None:
+                stats = self.hosts[(kind, host)] = HostStats()
+            stats.requests += 1
+            stats.retries += retries
+            stats.bytes += nbytes
+            if error:
+                stats.errors += 1
+            key = str(status) if status is not None else 'none'
+            stats.status[key] = stats.status.get(key, 0) + 1
+            for phase, value in (('connect', connect), ('ttfb', ttfb), ('transfer', transfer),
+                                 ('total', connect + ttfb + transfer)):
+                stats.histograms[phase].observe(value)
+        if self.parent is not None:
+            self.parent.record(kind, host, status, connect, ttfb, transfer, nbytes, retries, error)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self):
+        """Return a JSON-serializable summary."""
+        with self._lock:
+            kinds = {}
+            for (kind, host), stats in self.hosts.items():
+                kinds.setdefault(kind, {})[host] = stats.summary()
+            segment_bytes = sum(s.bytes for (kind, _), s in self.hosts.items() if kind == 'segment')
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            'elapsed': elapsed,
+            'segment_bytes': segment_bytes,
+            'throughput': segment_bytes / elapsed if elapsed > 0 else 0.0,
+            'requests': kinds,
+        }
+
+    def prometheus(self, prefix, series, extra_labels=''):
+        """Append this job's samples to series, a dict of metric name -> lines."""
+        def add(name, line):
+            series.setdefault(prefix + name, []).append(line)
+
+        with self._lock:
+            for (kind, host), stats in sorted(self.hosts.items()):
+                labels = f'{extra_labels}kind="{kind}",host="{host}"'
+                for status, count in sorted(stats.status.items()):
+                    add('requests_total', f'{prefix}requests_total{{{labels},status="{status}"}} {count}')
+                add('request_errors_total', f'{prefix}request_errors_total{{{labels}}} {stats.errors}')
+                add('request_retries_total', f'{prefix}request_retries_total{{{labels}}} {stats.retries}')
+                add('request_bytes_total', f'{prefix}request_bytes_total{{{labels}}} {stats.bytes}')
+                for phase in PHASES:
+                    for line in stats.histograms[phase].prometheus(
+                            f'{prefix}request_duration_seconds', f'{labels},phase="{phase}"'):
+                        add('request_duration_seconds', line)
+
+
+class MetricsRegistry:
+    """Process-wide metrics plus the metrics of the most recent jobs."""
+
+    def __init__(self, max_jobs=20):
+        self.total = RequestMetrics('all')
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self.jobs = OrderedDict()
+
+    def job(self, name):
+        """Create the metrics of a new job; they also feed the process-wide totals."""
+        metrics = RequestMetrics(name, parent=self.total)
+        with self._lock:
+            self.jobs[name] = metrics
+            self.jobs.move_to_end(name)
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        return metrics
+
+    def summary(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return {'total': self.total.summary(), 'jobs': {job.name: job.summary() for job in jobs}}
+
+    def prometheus(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        series = {}
+        self.total.prometheus('bohep_', series)
+        with self._lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            job.prometheus('bohep_job_', series, f'job="{job.name}",')
+            series.setdefault('bohep_job_throughput_bytes_per_second', []).append(
+                f'bohep_job_throughput_bytes_per_second{{job="{job.name}"}} {job.summary()["throughput"]}')
+
+        lines = []
+        for name, (metric_type, help_text) in METRIC_TYPES.items():
+            for prefix in ('bohep_', 'bohep_job_'):
+                if prefix + name in series:
+                    lines.append(f'# HELP {prefix}{name} {help_text}')
+                    lines.append(f'# TYPE {prefix}{name} {metric_type}')
+                    lines.extend(series[prefix + name])
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by all BohepDownloader instances in this process
+default_registry = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = default_registry
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = self.registry.prometheus().encode()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps(self.registry.summary()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port=9464, host='127.0.0.1', registry=None):
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread."""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry or default_registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
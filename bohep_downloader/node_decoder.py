@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import json
+import subprocess
+import threading
+
+from bohep_downloader.transport import register_abortable
+
+
+class NodeDecoder:
+    """Keeps one `node decode_packed.js --serve` process for all decodes.
+
+    Starting Node.js costs more than most decodes, so the process is started
+    on the first decode and reused by later ones, across jobs in a
+    long-running process such as the daemon. Decodes are sent one at a time
+    as JSON lines. A decode that times out or whose AbortScope is aborted
+    kills the process; the next decode starts a new one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # held while a decode is in flight
+        self._state_lock = threading.Lock()
+        self._process = None
+        self._command = None
+        self._current = None  # _Decode in flight
+        self._next_id = 0
+        self.started = 0
+        self.decodes = 0
+
+    def run(self, node_path, script, code, timeout=None):
+        """Decode code and return a CompletedProcess like the one-shot script's.
+
+        Raises subprocess.TimeoutExpired if the decode takes longer than
+        timeout seconds, and subprocess.SubprocessError if the process fails
+        for another reason. An aborted decode returns the killed process's
+        return code.
+        """
+        command = [node_path, script, '--serve']
+        with self._lock:
+            process = self._start(command)
+            self._next_id += 1
+            decode = _Decode(self, process)
+            with self._state_lock:
+                self._current = decode
+            register_abortable(decode)
+            timer = threading.Timer(timeout, decode.expire) if timeout else None
+            try:
+                if timer is not None:
+                    timer.start()
+                try:
+                    process.stdin.write(json.dumps({'id': self._next_id, 'code': code}) + '\n')
+                    process.stdin.flush()
+                    reply = self._read_reply(process, self._next_id)
+                except OSError:
+                    reply = None
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                with self._state_lock:
+                    self._current = None
+
+            if reply is None:
+                self._stop(process)
+                if decode.expired:
+                    raise subprocess.TimeoutExpired(command, timeout)
+                if decode.aborted:
+                    return subprocess.CompletedProcess(command, process.returncode, '', '')
+                raise subprocess.SubprocessError(f"Node.js decoder exited with code {process.returncode}")
+            self.decodes += 1
+            return subprocess.CompletedProcess(command, reply['returncode'], reply['stdout'], reply['stderr'])
+
+    def close(self):
+        """Stop the Node.js process, if running."""
+        with self._lock:
+            if self._process is not None:
+                self._stop(self._process)
+
+    def _start(self, command):
+        if self._process is not None and (self._command != command or self._process.poll() is not None):
+            self._stop(self._process)
+        if self._process is None:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                             stderr=subprocess.DEVNULL, text=True, encoding='utf-8')
+            self._command = command
+            self.started += 1
+        return self._process
+
+    def _stop(self, process):
+        process.kill()
+        process.wait()
+        for pipe in (process.stdin, process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        if self._process is process:
+            self._process = None
+
+    @staticmethod
+    def _read_reply(process, request_id):
+        """Return the reply to request_id, or None if the process went away."""
+        while True:
+            line = process.stdout.readline()
+            if not line:
+                return None
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                continue  # not a reply, e.g. output of a timer the script left behind
+            if isinstance(reply, dict) and reply.get('id') == request_id:
+                return reply
+
+    def _kill(self, decode):
+        """Kill the process if decode is still the one it is serving."""
+        with self._state_lock:
+            if self._current is decode:
+                decode.process.kill()
+
+
+class _Decode:
+    """A decode in flight, registered with the caller's AbortScope."""
+
+    def __init__(self, decoder, process):
+        self.decoder = decoder
+        self.process = process
+        self.aborted = False
+        self.expired = False
+
+    def abort(self):
+        self.aborted = True
+        self.decoder._kill(self)
+
+    def expire(self):
+        self.expired = True
+        self.decoder._kill(self)
+
+
+# Shared by all downloaders of the process; set to None to start Node.js per decode
+node_decoder = NodeDecoder()
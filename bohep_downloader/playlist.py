@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import threading
+from array import array
+
+# Per-segment flags in SegmentTable.flags
+FLAG_DISCONTINUITY = 0x01  # EXT-X-DISCONTINUITY before the segment
+FLAG_GAP = 0x02  # EXT-X-GAP: the segment is missing on the server
+FLAG_RELATIVE = 0x04  # the stored URI is relative to the table's base URI
+FLAG_DONE = 0x10  # downloaded in the current job
+
+ABSOLUTE_PREFIXES = (b'http://', b'https://')
+
+
+class Segment:
+    """Lightweight view of one row of a SegmentTable.
+
+    Has the attributes of an m3u8 Segment that the downloader uses (uri,
+    base_uri, duration, discontinuity) and reads them from the table's
+    arrays, so views are only created for the segments being worked on.
+    """
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def uri(self):
+        return self.table.uri(self.index)
+
+    @property
+    def base_uri(self):
+        return self.table.base_uri
+
+    @property
+    def duration(self):
+        return self.table.durations[self.index]
+
+    @property
+    def discontinuity(self):
+        return bool(self.table.flags[self.index] & FLAG_DISCONTINUITY)
+
+    @property
+    def gap(self):
+        return bool(self.table.flags[self.index] & FLAG_GAP)
+
+    @property
+    def byterange(self):
+        return self.table.byterange(self.index)
+
+    def __repr__(self):
+        return f"Segment({self.index}, {self.uri!r}, {self.duration})"
+
+
+class SegmentTable:
+    """Media playlist segments stored as parallel arrays.
+
+    All URIs live in one byte buffer, with the end offset of each one in
+    `uri_ends`; URIs below the base URI are stored relative to it. Durations,
+    byte ranges and flags are typed arrays, so a segment costs a few dozen
+    bytes plus its URI instead of a full object graph. Indexing returns a
+    Segment view.
+
+    A table can be read while PlaylistParser is still filling it from
+    another thread: wait() blocks until more segments arrive, and `loaded`
+    is set once the whole playlist has been parsed, with `error` holding
+    the exception if fetching it failed.
+    """
+
+    def __init__(self, base_uri=''):
+        self.base_uri = base_uri
+        self._base = base_uri.encode()
+        self._uris = bytearray()
+        self.uri_ends = array('Q')
+        self.durations = array('d')
+        self.range_lengths = array('q')  # -1 without EXT-X-BYTERANGE
+        self.range_offsets = array('q')
+        self.flags = bytearray()
+        self.media_sequence = 0
+        self.target_duration = None
+        self.ended = False  # EXT-X-ENDLIST seen
+        self.loaded = False
+        self.error = None
+        self._duration = 0.0
+        self._grown = threading.Condition()
+
+    def append(self, uri, duration, byterange=None, flags=0):
+        """Add a segment; uri is bytes as it appears in the playlist."""
+        if uri.startswith(ABSOLUTE_PREFIXES):
+            if self._base and uri.startswith(self._base):
+                uri = uri[len(self._base):]
+                flags |= FLAG_RELATIVE
+        else:
+            flags |= FLAG_RELATIVE
+        self._uris += uri
+        self.uri_ends.append(len(self._uris))
+        self.durations.append(duration)
+        length, offset = byterange if byterange else (-1, 0)
+        self.range_lengths.append(length)
+        self.range_offsets.append(offset)
+        self._duration += duration
+        # Appended last: the segment counts once its flags are there
+        self.flags.append(flags)
+
+    def uri(self, index):
+        """Return the absolute URI of a segment."""
+        start = self.uri_ends[index - 1] if index else 0
+        uri = self._uris[start:self.uri_ends[index]].decode('utf-8', errors='ignore')
+        if self.flags[index] & FLAG_RELATIVE:
+            return self.base_uri + uri
+        return uri
+
+    def byterange(self, index):
+        """Return (length, offset) of a segment's byte range, or None."""
+        length = self.range_lengths[index]
+        if length < 0:
+            return None
+        return length, self.range_offsets[index]
+
+    def duration(self):
+        """Return the summed EXTINF duration of the segments parsed so far."""
+        return self._duration
+
+    def notify(self):
+        """Wake up threads waiting for segments."""
+        with self._grown:
+            self._grown.notify_all()
+
+    def finish(self, error=None):
+        """Mark the playlist as completely parsed, or failed with error."""
+        self.error = error
+        self.loaded = True
+        self.notify()
+
+    def wait(self, count, timeout=None):
+        """Wait until the table has count segments or is loaded; return False on timeout."""
+        with self._grown:
+            return self._grown.wait_for(lambda: len(self) >= count or self.loaded, timeout)
+
+    def mark_done(self, index):
+        self.flags[index] |= FLAG_DONE
+
+    def is_done(self, index):
+        return bool(self.flags[index] & FLAG_DONE)
+
+    def reset_state(self):
+        """Clear the per-job state flags."""
+        for index in range(len(self.flags)):
+            self.flags[index] &= ~FLAG_DONE
+
+    def nbytes(self):
+        """Return the memory held by the table's buffers."""
+        arrays = (self.uri_ends, self.durations, self.range_lengths, self.range_offsets)
+        return len(self._uris) + len(self.flags) + sum(a.itemsize * len(a) for a in arrays)
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Segment(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("segment index out of range")
+        return Segment(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Segment(self, index)
+
+
+class PlaylistParser:
+    """Incremental media playlist parser that fills a SegmentTable.
+
+    feed() takes the playlist in chunks of any size, as they arrive from
+    the network, and appends a segment as soon as its URI line is complete.
+    close() or fail() marks the table as loaded. Only the tags the
+    downloader needs are parsed; a master playlist yields no segments, like
+    m3u8.loads().
+    """
+
+    def __init__(self, base_uri=''):
+        self.table = SegmentTable(base_uri)
+        self.bytes = 0
+        self.master = False  # EXT-X-STREAM-INF seen
+        self._partial = b''
+        self._duration = None  # EXTINF duration waiting for its URI
+        self._byterange = None
+        self._flags = 0
+        self._range_end = 0  # where a byte range without @offset starts
+
+    def feed(self, data):
+        """Parse a chunk; return the number of segments it completed."""
+        self.bytes += len(data)
+        before = len(self.table)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line)
+        added = len(self.table) - before
+        if added:
+            self.table.notify()
+        return added
+
+    def close(self):
+        """Parse the last line if it had no newline and return the loaded table."""
+        if self._partial:
+            self._line(self._partial)
+            self._partial = b''
+        self.table.finish()
+        return self.table
+
+    def fail(self, error):
+        """Mark the table as loaded with the segments parsed before error."""
+        self._partial = b''
+        self.table.finish(error)
+
+    def _line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        if not line.startswith(b'#'):
+            if self._duration is None:
+                # Variant URI of a master playlist, or a URI without EXTINF
+                return
+            self.table.append(line, self._duration, self._byterange, self._flags)
+            self._duration = None
+            self._byterange = None
+            self._flags = 0
+            return
+        tag, _, value = line.partition(b':')
+        if tag == b'#EXTINF':
+            self._duration = float(value.split(b',', 1)[0] or 0)
+        elif tag == b'#EXT-X-BYTERANGE':
+            length, _, offset = value.partition(b'@')
+            start = int(offset) if offset else self._range_end
+            self._byterange = (int(length), start)
+            self._range_end = start + int(length)
+        elif tag == b'#EXT-X-DISCONTINUITY':
+            self._flags |= FLAG_DISCONTINUITY
+        elif tag == b'#EXT-X-GAP':
+            self._flags |= FLAG_GAP
+        elif tag == b'#EXT-X-MEDIA-SEQUENCE':
+            self.table.media_sequence = int(value)
+        elif tag == b'#EXT-X-TARGETDURATION':
+            self.table.target_duration = float(value)
+        elif tag == b'#EXT-X-ENDLIST':
+            self.table.ended = True
+        elif tag == b'#EXT-X-STREAM-INF':
+            self.master = True
+
+
+def parse_playlist(source, base_uri=''):
+    """Parse playlist text (str or bytes) or an iterable of byte chunks into a SegmentTable."""
+    parser = PlaylistParser(base_uri)
+    if isinstance(source, str):
+        source = source.encode()
+    if isinstance(source, (bytes, bytearray)):
+        parser.feed(bytes(source))
+    else:
+        for chunk in source:
+            parser.feed(chunk)
+    return parser.close()
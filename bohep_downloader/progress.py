@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+import threading
+import time
+
+try:
+    from tqdm import tqdm
+except ImportError:  # optional, only needed for TqdmProgress
+    tqdm = None
+
+
+class ProgressBus:
+    """Aggregates job progress and publishes snapshots at a fixed rate.
+
+    Workers add bytes to a counter owned by their own thread, so the hot path
+    never takes a lock; a publisher thread sums the counters every `interval`
+    seconds and hands the snapshot to every subscriber. Snapshots carry the
+    keys progress callbacks always got (percentage, completed, total, speed,
+    eta, stage) plus bytes, bytes_per_second, elapsed, media_seconds and
+    media_total.
+
+    When `media_total` (the playlist duration) is known, percentage and eta
+    follow media time rather than the segment count, so short and long
+    segments weigh what they play for.
+    """
+
+    def __init__(self, total=0, interval=0.1):
+        self.total = total
+        self.interval = interval
+        self.completed = 0  # only written by the scheduling thread
+        self.media_total = 0.0  # seconds of media in the job
+        self.media_seconds = 0.0  # seconds of media in the finished segments
+        self.started = time.monotonic()
+        self._counters = []  # one [bytes] list per worker thread
+        self._local = threading.local()
+        self._override = None  # stage fields set by report()
+        self._subscribers = []
+        self._publish_lock = threading.Lock()
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, subscriber):
+        """Add a callable that receives snapshot dicts."""
+        self._subscribers.append(subscriber)
+
+    def add_bytes(self, amount):
+        counter = getattr(self._local, 'counter', None)
+        if counter is None:
+            counter = self._local.counter = [0]
+            self._counters.append(counter)
+        counter[0] += amount
+
+    def segment_done(self, media_seconds=0.0):
+        self.completed += 1
+        self.media_seconds += media_seconds
+
+    def report(self, data):
+        """Override snapshot fields for a stage the counters don't describe (combine, complete)."""
+        self._override = dict(data)
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started
+        nbytes = sum(counter[0] for counter in list(self._counters))
+        completed = self.completed
+        speed = completed / elapsed if elapsed > 0 else 0
+        if self.media_total:
+            media_seconds = min(self.media_seconds, self.media_total)
+            fraction = media_seconds / self.media_total
+            media_speed = media_seconds / elapsed if elapsed > 0 else 0
+            eta = (self.media_total - media_seconds) / media_speed if media_speed > 0 else 0
+        else:
+            fraction = completed / self.total if self.total else 0
+            eta = (self.total - completed) / speed if speed > 0 else 0
+        snapshot = {
+            'percentage': fraction * 90,
+            'completed': completed,
+            'total': self.total,
+            'speed': speed,
+            'eta': eta,
+            'stage': 'download',
+            'bytes': nbytes,
+            'bytes_per_second': nbytes / elapsed if elapsed > 0 else 0,
+            'elapsed': elapsed,
+            'media_seconds': self.media_seconds,
+            'media_total': self.media_total,
+        }
+        if self._override:
+            snapshot.update(self._override)
+        return snapshot
+
+    def publish(self):
+        """Send a snapshot to the subscribers if anything changed since the last one."""
+        with self._publish_lock:
+            snapshot = self.snapshot()
+            key = (snapshot['stage'], snapshot['percentage'], snapshot['completed'], snapshot['bytes'])
+            if key == self._last:
+                return
+            self._last = key
+            for subscriber in self._subscribers:
+                try:
+                    subscriber(snapshot)
+                except Exception as e:
+                    # A broken subscriber must not break the download
+                    print(f"Error in progress subscriber: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='progress-bus', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.publish()
+
+    def close(self):
+        """Stop publishing, send the final snapshot and close the subscribers."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.publish()
+        for subscriber in self._subscribers:
+            close = getattr(subscriber, 'close', None)
+            if close is not None:
+                close()
+
+
+class TqdmProgress:
+    """Renders snapshots as tqdm progress bars, one per stage."""
+
+    def __init__(self, **kwargs):
+        if tqdm is None:
+            raise ImportError("TqdmProgress requires tqdm (pip install tqdm)")
+        self.kwargs = kwargs
+        self.bar = None
+        self.stage = None
+
+    def __call__(self, snapshot):
+        stage = snapshot['stage']
+        if stage == 'complete':
+            stage = self.stage
+        if stage != self.stage:
+            self.close()
+            self.stage = stage
+            if stage == 'download':
+                self.bar = tqdm(total=snapshot['total'], desc="Downloading segments", unit="segment", **self.kwargs)
+            else:
+                self.bar = tqdm(total=100, desc="Combining segments", unit="%", **self.kwargs)
+        if self.bar is None:
+            return
+        if stage == 'download':
+            self.bar.n = snapshot['completed']
+            self.bar.set_postfix_str(f"{snapshot['bytes_per_second'] / 1024 / 1024:.1f} MB/s", refresh=False)
+        else:
+            self.bar.n = int(snapshot['percentage'])
+        self.bar.refresh()
+
+    def close(self):
+        if self.bar is not None:
+            self.bar.close()
+        self.bar = None
+        self.stage = None
+
+
+class JsonLogProgress:
+    """Writes each snapshot as one JSON line (stderr by default)."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def __call__(self, snapshot):
+        self.stream.write(json.dumps(snapshot) + '\n')
+        self.stream.flush()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+
+class QualitySelector:
+    """Picks the highest variant whose projected download time meets a deadline.
+
+    variants are the dicts returned by get_m3u8_url() (url, resolution,
+    bandwidth). After record_sample() has measured the throughput on a few
+    segments of one variant, each variant's size is projected from the media
+    duration: the sampled variant uses its measured bitrate, the others that
+    bitrate scaled by their declared bandwidth (or the declared bandwidth
+    alone when the sampled variant declares none). A deadline of None means
+    the download must be no slower than real time.
+    """
+
+    def __init__(self, variants, media_duration, deadline=None):
+        self.variants = sorted(variants, key=lambda v: v['resolution'], reverse=True)
+        self.media_duration = media_duration
+        self.deadline = deadline if deadline is not None else media_duration
+        self.sampled = None  # variant the throughput was measured on
+        self.throughput = 0.0  # bytes/s
+        self.sample_bitrate = 0.0  # bytes per media second of the sampled variant
+
+    def record_sample(self, variant, nbytes, media_seconds, elapsed):
+        self.sampled = variant
+        self.throughput = nbytes / elapsed if elapsed > 0 else 0.0
+        self.sample_bitrate = nbytes / media_seconds if media_seconds > 0 else 0.0
+
+    def projected_bytes(self, variant):
+        """Return the projected size of a variant in bytes, or None if unknown."""
+        declared = variant.get('bandwidth') or 0
+        if self.sample_bitrate:
+            if variant is self.sampled:
+                return self.sample_bitrate * self.media_duration
+            sampled_declared = self.sampled.get('bandwidth') or 0
+            if declared and sampled_declared:
+                return self.sample_bitrate * declared / sampled_declared * self.media_duration
+        if not declared:
+            return None
+        return declared / 8 * self.media_duration
+
+    def projected_time(self, variant):
+        """Return the projected download time of a variant in seconds, or None if unknown."""
+        projected = self.projected_bytes(variant)
+        if not self.throughput or projected is None:
+            return None
+        return projected / self.throughput
+
+    def choose(self):
+        """Return the highest variant that meets the deadline, else the lowest one."""
+        for variant in self.variants:
+            projected = self.projected_time(variant)
+            if projected is not None and projected <= self.deadline:
+                return variant
+        return self.variants[-1]
+
+    def summary(self, chosen=None):
+        return {
+            'deadline': round(self.deadline, 1),
+            'throughput': round(self.throughput),
+            'sampled': self.sampled['resolution'] if self.sampled else None,
+            'chosen': chosen['resolution'] if chosen else None,
+            'projected': {
+                f"{v['resolution']}p": None if self.projected_time(v) is None else round(self.projected_time(v), 1)
+                for v in self.variants
+            },
+        }
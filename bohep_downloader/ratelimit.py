@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """Thread-safe token bucket where one token is one byte."""
+
+    def __init__(self, rate=None, burst=None):
+        self._cond = threading.Condition()
+        self.rate = None
+        self.burst = 0.0
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """Change the rate in bytes/s at runtime. None or 0 means unlimited."""
+        with self._cond:
+            self._refill()
+            self.rate = float(rate) if rate else None
+            # Default burst is one second worth of traffic
+            self.burst = float(burst) if burst else (self.rate or 0.0)
+            self.tokens = min(self.tokens, self.burst) if self.rate else 0.0
+            # Wake up waiters so they pick up the new rate immediately
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def wake(self):
+        """Wake up waiting threads, e.g. so they notice a cancellation right away."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def refund(self, amount):
+        """Give back tokens consumed for bytes that were never transferred."""
+        with self._cond:
+            if not self.rate:
+                return
+            self._refill()
+            self.tokens = min(self.burst, self.tokens + amount)
+            self._cond.notify_all()
+
+    def consume(self, amount, is_cancelled=None):
+        """Block until `amount` bytes may be transferred. Returns False if cancelled."""
+        with self._cond:
+            while True:
+                if not self.rate:
+                    return True
+                if is_cancelled and is_cancelled():
+                    return False
+                self._refill()
+                # Reads larger than the burst go into debt instead of waiting forever
+                needed = min(amount, self.burst)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return True
+                # Wake up periodically to observe cancellation and rate changes
+                wait = (needed - self.tokens) / self.rate
+                self._cond.wait(min(wait, 0.1))
+
+
+class BandwidthLimiter:
+    """Global and per-host bandwidth limits shared by every download job."""
+
+    def __init__(self, global_rate=None):
+        self._lock = threading.Lock()
+        self.global_bucket = TokenBucket(global_rate)
+        self.host_buckets = {}
+
+    def set_global_rate(self, rate, burst=None):
+        """Set the process-wide rate limit in bytes/s (None for unlimited)."""
+        self.global_bucket.set_rate(rate, burst)
+
+    def set_host_rate(self, host, rate, burst=None):
+        """Set the rate limit in bytes/s for a single host (None for unlimited)."""
+        with self._lock:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                if not rate:
+                    return
+                self.host_buckets[host] = TokenBucket(rate, burst)
+                return
+        bucket.set_rate(rate, burst)
+
+    def wake(self):
+        """Wake up every thread waiting on a bucket of this limiter."""
+        with self._lock:
+            buckets = [self.global_bucket, *self.host_buckets.values()]
+        for bucket in buckets:
+            bucket.wake()
+
+    def get_rates(self):
+        """Return the currently configured limits."""
+        with self._lock:
+            hosts = {host: bucket.rate for host, bucket in self.host_buckets.items() if bucket.rate}
+        return {'global': self.global_bucket.rate, 'hosts': hosts}
+
+    def _buckets(self, url, job_bucket):
+        buckets = []
+        if job_bucket is not None:
+            buckets.append(job_bucket)
+        if url and self.host_buckets:
+            bucket = self.host_buckets.get(urlsplit(url).hostname)
+            if bucket is not None:
+                buckets.append(bucket)
+        buckets.append(self.global_bucket)
+        return buckets
+
+    def throttle(self, amount, url=None, job_bucket=None, is_cancelled=None):
+        """Wait for `amount` bytes on the job, host and global buckets in turn."""
+        for bucket in self._buckets(url, job_bucket):
+            if not bucket.consume(amount, is_cancelled):
+                return False
+        return True
+
+    def refund(self, amount, url=None, job_bucket=None):
+        """Give `amount` bytes paid with throttle() but not transferred back to the buckets."""
+        if amount > 0:
+            for bucket in self._buckets(url, job_bucket):
+                bucket.refund(amount)
+
+
+# Shared by all BohepDownloader instances unless one is given its own limiter
+default_limiter = BandwidthLimiter()
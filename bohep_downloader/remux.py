@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bohep_downloader.tracing import tracer
+
+
+class RemuxTask:
+    """A segment set handed to the RemuxPool; result() returns the output path."""
+
+    def __init__(self, store, output_path, stats, progress_callback=None):
+        self.store = store
+        self.output_path = output_path
+        self.stats = stats  # the job's stats dict, updated when the remux finishes
+        self.progress_callback = progress_callback  # the job's, gets the combine progress
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def cancel(self):
+        """Drop the task if still queued, or terminate its FFmpeg process."""
+        self.cancelled.set()
+        self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class RemuxPool:
+    """Bounded pool of FFmpeg remux processes fed by finished downloads.
+
+    Each worker thread supervises one FFmpeg process, so at most `workers`
+    remuxes (default: one per CPU core) run at a time. submit() blocks once
+    `max_pending` segment sets are queued or running, which bounds the memory
+    held by finished but not yet remuxed downloads. FFmpeg runs with `nice`
+    added to its niceness and `-threads threads` so it doesn't starve the
+    network stage.
+    """
+
+    def __init__(self, workers=None, nice=10, threads=None, max_pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.nice = nice
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='remux-worker')
+
+    def submit(self, downloader, store, output_path, stats, progress_callback=None):
+        """Remux the segments in store into output_path; the pool takes ownership of store.
+
+        progress_callback gets the combine progress, as with an inline remux.
+        """
+        self._slots.acquire()
+        task = RemuxTask(store, output_path, stats, progress_callback)
+        task.future = self._executor.submit(self._run, downloader, task)
+        task.future.add_done_callback(lambda future: self._finish(task))
+        return task
+
+    def _run(self, downloader, task):
+        with tracer.span('remux', output=task.output_path):
+            output_path = downloader.combine_segments(
+                task.store, task.output_path,
+                progress_callback=task.progress_callback,
+                stats=task.stats,
+                is_cancelled=task.cancelled.is_set,
+                nice=self.nice,
+                threads=self.threads
+            )
+        task.stats['output_file'] = output_path
+        return output_path
+
+    def _finish(self, task):
+        task.store.close()
+        self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+# Query parameters signed CDN URLs carry their expiry time in (Unix seconds)
+EXPIRY_PARAMS = ('expires', 'expire', 'exp', 'e', 'validto', 'valid_to', 'deadline')
+
+
+def url_expiry(url):
+    """Return the expiry time encoded in a signed URL's query, or None."""
+    for key, value in parse_qsl(urlsplit(url).query):
+        if key.lower() in EXPIRY_PARAMS and value.isdigit() and int(value) > 1e9:
+            return int(value)
+    return None
+
+
+class Resolution:
+    """A resolved video page: its variants and how long their URLs stay valid.
+
+    Returned by BohepDownloader.resolve() and accepted by download(), so the
+    page fetch and the Node.js decode run once per video. The URLs are
+    considered expired at the earliest expiry found in their query strings,
+    or max_age seconds after resolving when they carry none.
+    """
+
+    def __init__(self, page_url, video_id, variants, max_age=900):
+        self.page_url = page_url
+        self.video_id = video_id
+        self.variants = variants
+        self.resolved_at = time.time()
+        expiries = [url_expiry(v['url']) for v in variants if isinstance(v, dict) and v.get('url')]
+        expiries = [e for e in expiries if e is not None]
+        self.expires_at = min(expiries) if expiries else self.resolved_at + max_age
+
+    def expired(self, margin=30):
+        """Return True if the URLs expire within margin seconds."""
+        return time.time() + margin >= self.expires_at
+
+    def qualities(self):
+        """Return the available resolutions, highest first."""
+        return sorted({
+            v['resolution'] for v in self.variants
+            if isinstance(v, dict) and isinstance(v.get('resolution'), (int, float))
+        }, reverse=True)
+
+    def select(self, quality):
+        """Return the variant matching quality (e.g. "720p"), else the closest one, or None."""
+        target_resolution = int(str(quality).replace('p', ''))
+        selected = None
+        for url_info in self.variants:
+            if not isinstance(url_info, dict):
+                continue
+            resolution = url_info.get('resolution')
+            if not isinstance(resolution, (int, float)) or not url_info.get('url'):
+                continue
+            if resolution == target_resolution:
+                return url_info
+            if selected is None or abs(resolution - target_resolution) < abs(selected['resolution'] - target_resolution):
+                selected = url_info
+        return selected
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from bohep_downloader.ts_validator import InvalidSegmentError
+
+# Signature and expiry query parameters that change between page loads for
+# the same segment. Short generic names (e, s, st, hash, ...) are left out
+# since some CDNs use them to select the content.
+VOLATILE_PARAMS = frozenset({
+    'expires', 'expire', 'signature', 'token', 'validfrom', 'validto', 'policy', 'key-pair-id',
+    'hdnts', 'hdnea',
+})
+VOLATILE_PREFIXES = ('x-amz-', 'x-goog-')
+
+
+def normalize_url(url, volatile=VOLATILE_PARAMS, prefixes=VOLATILE_PREFIXES):
+    """Return url without its fragment and volatile (signing) query parameters."""
+    parts = urlsplit(url)
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in volatile and not name.lower().startswith(prefixes)
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+
+class SegmentCache:
+    """On-disk segment cache shared across runs, with a size cap and LRU eviction.
+
+    Entries are keyed by the segment URL without the query parameters in
+    `volatile_params` (or starting with `volatile_prefixes`) and stored as
+    `<sha256 of url>.<length>.ts`. The length is what was written, so a
+    file whose size doesn't match it (truncated, or evicted by another
+    process) is treated as a miss; it doesn't tell apart different content
+    served under the same normalized URL, which would take a request per
+    segment. Recency is kept in file modification times so eviction order
+    survives restarts, and entries are written to a temporary file and
+    renamed so concurrent processes never see partial segments; temporary
+    files left behind by interrupted writes are removed on start. read_into()
+    can check a hit with a TSValidator before it is used.
+    """
+
+    # Temporary files older than this are leftovers of interrupted put() calls
+    STALE_TEMP_AGE = 3600
+
+    def __init__(self, directory=None, max_bytes=2 * 1024 ** 3, volatile_params=VOLATILE_PARAMS,
+                 volatile_prefixes=VOLATILE_PREFIXES):
+        self.directory = Path(directory or Path.home() / '.cache' / 'bohep_downloader' / 'segments')
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.volatile_params = frozenset(name.lower() for name in volatile_params)
+        self.volatile_prefixes = tuple(prefix.lower() for prefix in volatile_prefixes)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # url hash -> (length, path), least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self._load()
+
+    def _load(self):
+        now = time.time()
+        for path in self.directory.glob('*.tmp'):
+            try:
+                # A recent one may still be written by another process
+                if now - path.stat().st_mtime > self.STALE_TEMP_AGE:
+                    path.unlink()
+            except OSError:
+                continue
+        files = []
+        for path in self.directory.glob('*.ts'):
+            try:
+                key, length, _ = path.name.split('.')
+                files.append((path.stat().st_mtime, key, int(length), path))
+            except (ValueError, OSError):
+                continue
+        for _, key, length, path in sorted(files):
+            self._add(key, length, path)
+
+    def _add(self, key, length, path):
+        # Caller holds self._lock (or is __init__)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old[0]
+            if old[1] != path:
+                self._remove_file(old[1])
+        self._entries[key] = (length, path)
+        self.total_bytes += length
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _key(self, url):
+        normalized = normalize_url(url, self.volatile_params, self.volatile_prefixes)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def lookup(self, url):
+        """Return the path of the cached segment for url, or None."""
+        key = self._key(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                length, path = entry
+                try:
+                    valid = os.path.getsize(path) == length
+                except OSError:
+                    valid = False
+                if not valid:
+                    # Evicted by another process or truncated
+                    self._entries.pop(key)
+                    self.total_bytes -= length
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.hit_bytes += length
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def read_into(self, url, sink, chunk_size=1024 * 1024, validator=None):
+        """Copy the cached segment for url into sink; return its size, or None on a miss.
+
+        With a validator (TSValidator), each chunk is checked before it is
+        written; an entry that fails is dropped and reported as a miss, and
+        sink may hold part of it.
+        """
+        path = self.lookup(url)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                if validator is None:
+                    shutil.copyfileobj(f, sink, chunk_size)
+                else:
+                    while True:
+                        chunk = f.read(chunk_size)
+                        if not chunk:
+                            break
+                        validator.feed(chunk)
+                        sink.write(chunk)
+                    validator.finish()
+        except OSError:
+            return None
+        except InvalidSegmentError as e:
+            print(f"Dropping invalid cached segment {url}: {e}")
+            self.discard(url, hit=True)
+            return None
+        return os.path.getsize(path)
+
+    def discard(self, url, hit=False):
+        """Remove the entry for url; with hit set, its lookup is recounted as a miss."""
+        key = self._key(url)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            length, path = entry
+            self.total_bytes -= length
+            if hit:
+                self.hits -= 1
+                self.hit_bytes -= length
+                self.misses += 1
+        self._remove_file(path)
+
+    def put(self, url, data=None, path=None):
+        """Store a segment given as a bytes-like object or as the path of a file holding it."""
+        key = self._key(url)
+        length = len(data) if data is not None else os.path.getsize(path)
+        if not length or length > self.max_bytes:
+            return
+        target = self.directory / f'{key}.{length}.ts'
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if data is not None:
+                    f.write(data)
+                else:
+                    with open(path, 'rb') as src:
+                        shutil.copyfileobj(src, f, 1024 * 1024)
+            os.replace(temp_path, target)
+        except OSError:
+            self._remove_file(temp_path)
+            return
+        with self._lock:
+            self._add(key, length, target)
+            self._evict()
+
+    def _evict(self):
+        # Caller holds self._lock
+        while self.total_bytes > self.max_bytes and self._entries:
+            _, (length, path) = self._entries.popitem(last=False)
+            self.total_bytes -= length
+            self._remove_file(path)
+
+    def clear(self):
+        with self._lock:
+            for length, path in self._entries.values():
+                self._remove_file(path)
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def summary(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_bytes': self.hit_bytes,
+            }
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from bohep_downloader.concat import Concatenator
+
+
+class SegmentStore:
+    """Holds downloaded segments until they are combined.
+
+    Workers call create() to get a writable sink for one request, then the
+    engine either commit()s the sink as the data of a segment or discard()s it.
+    Readers get the committed segments back in playlist order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.peak_resident_bytes = 0
+
+    def create(self, index, attempt=0):
+        raise NotImplementedError
+
+    def commit(self, index, sink):
+        raise NotImplementedError
+
+    def discard(self, sink):
+        raise NotImplementedError
+
+    def indexes(self):
+        """Return the indexes of committed segments in playlist order."""
+        raise NotImplementedError
+
+    def paths(self):
+        """Return segment file paths in order, or None if some live in memory."""
+        return None
+
+    def write_to(self, fileobj):
+        """Write all committed segments in order to a binary file object with a fileno().
+
+        Returns the Concatenator used, for reporting.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Free all stored data."""
+        raise NotImplementedError
+
+    def summary(self):
+        return {'peak_resident_bytes': self.peak_resident_bytes}
+
+
+class DiskSegmentStore(SegmentStore):
+    """Stores every segment as a file in a temporary directory."""
+
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = Path(directory or tempfile.mkdtemp())
+        self.files = {}
+
+    def create(self, index, attempt=0):
+        return open(self.directory / f"segment_{index:05d}.ts.part{attempt}", 'wb')
+
+    def commit(self, index, sink):
+        sink.close()
+        path = self.directory / f"segment_{index:05d}.ts"
+        os.replace(sink.name, path)
+        with self._lock:
+            self.files[index] = path
+
+    def discard(self, sink):
+        sink.close()
+        if os.path.exists(sink.name):
+            os.remove(sink.name)
+
+    def indexes(self):
+        with self._lock:
+            return sorted(self.files)
+
+    def paths(self):
+        with self._lock:
+            return [self.files[index] for index in sorted(self.files)]
+
+    def write_to(self, fileobj):
+        concat = Concatenator(fileobj)
+        for path in self.paths():
+            concat.append_file(path)
+        return concat
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class MemorySink:
+    """Writable in-memory buffer for one segment request."""
+
+    def __init__(self, store):
+        self.store = store
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        self.store._grow(len(data))
+        return len(data)
+
+    def seek(self, offset):
+        # Writes always append; a sink can only be rewound to start over
+        if offset != 0:
+            raise ValueError("MemorySink can only seek to the start")
+        return 0
+
+    def truncate(self, size=0):
+        """Drop the buffered data, e.g. before retrying the request."""
+        if size != 0:
+            raise ValueError("MemorySink can only be truncated to zero")
+        self.store._grow(-len(self.buffer))
+        self.buffer = bytearray()
+
+    def close(self):
+        pass
+
+
+class MemorySegmentStore(SegmentStore):
+    """Keeps segments in RAM and spills them to disk beyond a memory budget.
+
+    When resident bytes exceed `budget`, committed segments are moved to
+    disk, oldest first or largest first depending on `spill_policy`. Requests
+    that are still in flight are never spilled, so the budget can be
+    overshot by at most the data of the running requests.
+    """
+
+    def __init__(self, budget=256 * 1024 * 1024, spill_dir=None, spill_policy='oldest'):
+        super().__init__()
+        if spill_policy not in ('oldest', 'largest'):
+            raise ValueError(f"Unknown spill policy: {spill_policy}")
+        self.budget = budget
+        self.spill_policy = spill_policy
+        self._spill_dir = spill_dir
+        self._spill_dir_created = False
+        self.in_memory = OrderedDict()  # index -> MemorySink, in commit order
+        self.spilled = {}  # index -> path
+        self.spilled_bytes = 0
+
+    def create(self, index, attempt=0):
+        return MemorySink(self)
+
+    def commit(self, index, sink):
+        with self._lock:
+            self.in_memory[index] = sink
+            self._spill_over_budget()
+
+    def discard(self, sink):
+        with self._lock:
+            self.resident_bytes -= len(sink.buffer)
+        sink.buffer = bytearray()
+
+    def _grow(self, nbytes):
+        with self._lock:
+            self.resident_bytes += nbytes
+            self.peak_resident_bytes = max(self.peak_resident_bytes, self.resident_bytes)
+            self._spill_over_budget()
+
+    def _spill_over_budget(self):
+        # Caller holds self._lock
+        while self.resident_bytes > self.budget and self.in_memory:
+            if self.spill_policy == 'largest':
+                index = max(self.in_memory, key=lambda i: len(self.in_memory[i].buffer))
+            else:
+                index = next(iter(self.in_memory))
+            sink = self.in_memory.pop(index)
+
+            if not self._spill_dir_created:
+                self._spill_dir = self._spill_dir or tempfile.mkdtemp()
+                os.makedirs(self._spill_dir, exist_ok=True)
+                self._spill_dir_created = True
+            path = os.path.join(self._spill_dir, f"segment_{index:05d}.ts")
+            with open(path, 'wb') as f:
+                f.write(sink.buffer)
+
+            self.spilled[index] = path
+            self.spilled_bytes += len(sink.buffer)
+            self.resident_bytes -= len(sink.buffer)
+            sink.buffer = bytearray()
+
+    def indexes(self):
+        with self._lock:
+            return sorted(list(self.in_memory) + list(self.spilled))
+
+    def paths(self):
+        with self._lock:
+            if self.in_memory:
+                return None
+            return [self.spilled[index] for index in sorted(self.spilled)]
+
+    def write_to(self, fileobj):
+        concat = Concatenator(fileobj)
+        for index in self.indexes():
+            with self._lock:
+                sink = self.in_memory.get(index)
+                path = self.spilled.get(index)
+            if sink is not None:
+                concat.append_buffer(sink.buffer)
+            else:
+                concat.append_file(path)
+        return concat
+
+    def close(self):
+        with self._lock:
+            self.in_memory.clear()
+            self.spilled.clear()
+            self.resident_bytes = 0
+        if self._spill_dir_created:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    def summary(self):
+        return {
+            'peak_resident_bytes': self.peak_resident_bytes,
+            'spilled_segments': len(self.spilled),
+            'spilled_bytes': self.spilled_bytes,
+        }
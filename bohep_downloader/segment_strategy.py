@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import posixpath
+import threading
+from collections import Counter
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from bohep_downloader.ts_validator import InvalidSegmentError
+
+# Extensions CDNs that disguise segments serve them under, in probing order
+SEGMENT_EXTENSIONS = ('.ts', '.jpeg', '.mp4')
+
+# Returned by HostStrategies.begin() when should_stop() ended the wait
+STOPPED = object()
+
+
+class SegmentStrategy:
+    """How to request a host's segments: which URL extension, and whether to send Range."""
+
+    __slots__ = ('extension', 'use_range')
+
+    def __init__(self, extension=None, use_range=True):
+        self.extension = extension  # None keeps the playlist's extension
+        self.use_range = use_range
+
+    def apply(self, url):
+        """Return the (url, headers) to request a segment URL with."""
+        if self.extension is not None:
+            parts = urlsplit(url)
+            root, ext = posixpath.splitext(parts.path)
+            if ext:
+                url = urlunsplit(parts._replace(path=root + self.extension))
+        # The session sends Range: bytes=0- by default; None removes it
+        return url, None if self.use_range else {'Range': None}
+
+    def __eq__(self, other):
+        return isinstance(other, SegmentStrategy) and (self.extension, self.use_range) == (other.extension, other.use_range)
+
+    def __repr__(self):
+        return f"SegmentStrategy({self.extension!r}, use_range={self.use_range})"
+
+
+def is_probe_error(error):
+    """Return True for failures another extension or Range setting might avoid."""
+    if isinstance(error, InvalidSegmentError):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return 400 <= status < 500 and status != 429
+    return False
+
+
+def is_strategy_error(error):
+    """Return True if a learned strategy probably stopped working (not an expired URL)."""
+    return is_probe_error(error) and not (
+        isinstance(error, requests.HTTPError) and error.response.status_code in (401, 403, 410)
+    )
+
+
+class HostStrategies:
+    """Segment request strategies learned per host.
+
+    The first segment fetched from a host is probed: as listed in the
+    playlist with and without the Range header, then under each of
+    SEGMENT_EXTENSIONS. The first combination that works is remembered for
+    the host and used for every later segment, so a disguising CDN costs
+    the extra round trips once instead of per segment. While one worker
+    probes a host, the others wait for its result. A learned strategy that
+    starts failing is forgotten and the host probed again.
+    """
+
+    def __init__(self, extensions=SEGMENT_EXTENSIONS):
+        self.extensions = extensions
+        self._cond = threading.Condition()
+        self._known = {}  # host -> SegmentStrategy
+        self._probing = set()  # hosts a worker is probing
+        self.stats = Counter()
+
+    def candidates(self, url):
+        """Return the strategies to probe for a segment URL, in order."""
+        ext = posixpath.splitext(urlsplit(url).path)[1].lower()
+        strategies = [SegmentStrategy(None, True), SegmentStrategy(None, False)]
+        if ext:
+            for extension in self.extensions:
+                if extension != ext:
+                    strategies += [SegmentStrategy(extension, True), SegmentStrategy(extension, False)]
+        return strategies
+
+    def begin(self, host, should_stop=None):
+        """Return the host's strategy, or None if the caller should probe it.
+
+        A caller that gets None owns the probe and must call end() when it is
+        over. STOPPED is returned if should_stop() became true while another
+        worker was probing; the caller must not probe or call end() then.
+        """
+        with self._cond:
+            while True:
+                strategy = self._known.get(host)
+                if strategy is not None:
+                    return strategy
+                if should_stop is not None and should_stop():
+                    return STOPPED
+                if host not in self._probing:
+                    self._probing.add(host)
+                    return None
+                self._cond.wait(0.1)
+
+    def end(self, host, strategy=None):
+        """Finish probing a host, remembering the strategy that worked if any."""
+        with self._cond:
+            self._probing.discard(host)
+            if strategy is not None:
+                self._known[host] = strategy
+                self.stats['learned'] += 1
+            self._cond.notify_all()
+
+    def forget(self, host, strategy):
+        """Drop a host's strategy after it failed, unless another worker already replaced it."""
+        with self._cond:
+            if self._known.get(host) == strategy:
+                del self._known[host]
+                self.stats['forgotten'] += 1
+
+    def count(self, key, amount=1):
+        with self._cond:
+            self.stats[key] += amount
+
+    def known(self):
+        """Return the learned strategies by host."""
+        with self._cond:
+            return dict(self._known)
+
+
+segment_strategies = HostStrategies()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import time
+
+import requests
+
+
+class SegmentWriter:
+    """Streams HTTP response bodies to disk through one preallocated buffer.
+
+    Each read goes straight into the buffer with readinto, so no bytes object
+    is allocated per chunk, and the buffer is written out in large batches.
+    The read size adapts to the observed throughput so that one read takes
+    roughly `target_read_time` seconds. A writer is not thread-safe; use one
+    per worker thread.
+    """
+
+    MIN_READ = 64 * 1024
+    MAX_READ = 4 * 1024 * 1024
+
+    def __init__(self, buffer_size=MAX_READ, min_read=MIN_READ, max_read=MAX_READ, target_read_time=0.1):
+        self.buffer = bytearray(max(buffer_size, max_read))
+        self.view = memoryview(self.buffer)
+        self.min_read = min_read
+        self.max_read = max_read
+        self.target_read_time = target_read_time
+        self.read_size = min_read
+        self.throughput = 0.0  # bytes/s, exponentially weighted
+
+    def _readinto(self, response):
+        """Return a readinto(view) function for the response body."""
+        raw = response.raw
+        encoding = response.headers.get('content-encoding', 'identity').lower()
+        fp = getattr(raw, '_fp', None)
+        if encoding == 'identity' and fp is not None and hasattr(fp, 'readinto'):
+            # Read from the http.client response directly to skip urllib3's
+            # per-read bytes allocation. That also skips urllib3's error
+            # handling, so socket errors are raised as requests exceptions here.
+            def readinto(view):
+                try:
+                    return fp.readinto(view)
+                except TimeoutError as e:
+                    raise requests.exceptions.ReadTimeout(e, response=response)
+                except OSError as e:
+                    raise requests.exceptions.ConnectionError(e, response=response)
+            return readinto
+
+        # Compressed bodies have to go through urllib3's decoder
+        def readinto(view):
+            data = raw.read(len(view), decode_content=True)
+            view[:len(data)] = data
+            return len(data)
+        return readinto
+
+    def _adapt(self, nbytes, elapsed):
+        """Update the throughput estimate and pick the next read size."""
+        if elapsed <= 0 or nbytes <= 0:
+            return
+        rate = nbytes / elapsed
+        self.throughput = rate if not self.throughput else 0.7 * self.throughput + 0.3 * rate
+        wanted = int(self.throughput * self.target_read_time)
+        size = self.min_read
+        while size < wanted and size < self.max_read:
+            size *= 2
+        self.read_size = min(size, self.max_read)
+
+    def write(self, response, output_file, on_read=None, should_stop=None, validator=None, normalizer=None):
+        """Write the response body and return the number of bytes read.
+
+        output_file is a path or a writable binary file object. on_read(total_bytes)
+        is called after every read; the transfer stops early when should_stop()
+        returns True. Each chunk read is passed to validator.feed() straight
+        from the buffer, so a bad body fails on its first read.
+
+        With a normalizer (TSNormalizer), the start of the body stays in the
+        buffer until normalizer.find_start() locates the payload; the bytes
+        before it are neither written nor validated.
+        """
+        readinto = self._readinto(response)
+        if hasattr(output_file, 'write'):
+            return self._copy(readinto, output_file, on_read, should_stop, validator, normalizer)
+        with open(output_file, 'wb') as f:
+            return self._copy(readinto, f, on_read, should_stop, validator, normalizer)
+
+    def _copy(self, readinto, f, on_read, should_stop, validator=None, normalizer=None):
+        view = self.view
+        capacity = len(self.buffer)
+        start = 0  # buffered bytes before this are a stripped prefix
+        filled = 0
+        written = 0
+        searching = normalizer is not None
+
+        while True:
+            if should_stop and should_stop():
+                break
+
+            # Flush when the next read would not fit in the buffer
+            size = self.read_size
+            if searching:
+                # Nothing is flushed before the payload is found
+                size = min(size, capacity - filled)
+            elif filled + size > capacity:
+                f.write(view[start:filled])
+                start = filled = 0
+
+            started = time.monotonic()
+            n = readinto(view[filled:filled + size])
+            if not n:
+                break
+            self._adapt(n, time.monotonic() - started)
+            chunk = filled
+            filled += n
+            written += n
+
+            if searching:
+                offset = normalizer.find_start(view[:filled], final=filled == capacity)
+                if offset is None:
+                    if on_read:
+                        on_read(written)
+                    continue
+                searching = False
+                start = chunk = offset
+                if validator is not None and offset:
+                    validator.skip(offset)
+
+            if validator is not None and filled > chunk:
+                validator.feed(view[chunk:filled])
+            if on_read:
+                on_read(written)
+
+        if searching and filled:
+            # The body ended before the payload was certain
+            start = normalizer.find_start(view[:filled], final=True)
+            if validator is not None:
+                validator.skip(start)
+                validator.feed(view[start:filled])
+        if filled > start:
+            f.write(view[start:filled])
+
+        return written
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import statistics
+
+from bohep_downloader.ts_validator import PacketStream, SYNC_BYTE, TS_PACKET_SIZE, np
+
+PTS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+
+
+def decode_pts(b0, b1, b2, b3, b4):
+    """Decode the 33-bit PTS from the five timestamp bytes of a PES header."""
+    return ((b0 >> 1) & 0x07) << 30 | b1 << 22 | (b2 >> 1) << 15 | b3 << 7 | b4 >> 1
+
+
+class PTSScanner(PacketStream):
+    """Collects the presentation timestamps of one elementary stream in a segment.
+
+    Only packets starting a PES packet are looked at, and of those only the
+    header bytes, so a segment is scanned without parsing its payload. With
+    NumPy the header bytes of all PES starts in a chunk are gathered from the
+    (packets, 188) view in one go. The first stream with timestamps is
+    followed, preferring video over audio, so the timestamps of different
+    streams aren't mixed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.pid = None
+        self.timestamps = []
+        self._audio = {}  # audio pid -> timestamps, used when there is no video
+
+    def _add(self, pid, stream_id, pts):
+        if 0xE0 <= stream_id <= 0xEF:
+            if self.pid is None:
+                self.pid = pid
+            if pid == self.pid:
+                self.timestamps.append(pts)
+        elif self.pid is None:
+            self._audio.setdefault(pid, []).append(pts)
+
+    def _numpy_packets(self, data):
+        packets = np.frombuffer(data, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+        control = packets[:, 3] >> 4
+        # Payload unit start with a payload; bad sync is the validator's problem
+        rows = np.flatnonzero(
+            (packets[:, 0] == SYNC_BYTE) & ((packets[:, 1] & 0x40) != 0) & ((control & 0x1) != 0))
+        if not rows.size:
+            return
+        start = 4 + np.where(control[rows] & 0x2, packets[rows, 4].astype(np.intp) + 1, 0)
+        fits = start + 14 <= TS_PACKET_SIZE
+        rows, start = rows[fits], start[fits]
+
+        def field(offset):
+            return packets[rows, start + offset]
+
+        stream_id = field(3)
+        selected = (
+            (field(0) == 0) & (field(1) == 0) & (field(2) == 1)
+            & (stream_id >= 0xC0) & (stream_id <= 0xEF) & ((field(7) & 0x80) != 0)
+        )
+        if not selected.any():
+            return
+        rows, start, stream_id = rows[selected], start[selected], stream_id[selected]
+        pts = decode_pts(*(field(offset).astype(np.int64) for offset in range(9, 14)))
+        pid = ((packets[rows, 1] & 0x1F).astype(np.uint16) << 8) | packets[rows, 2]
+        for p, s, t in zip(pid.tolist(), stream_id.tolist(), pts.tolist()):
+            self._add(p, s, t)
+
+    def _python_packets(self, data):
+        for offset in range(0, len(data), TS_PACKET_SIZE):
+            if data[offset] != SYNC_BYTE or not data[offset + 1] & 0x40:
+                continue
+            control = data[offset + 3] >> 4
+            if not control & 0x1:
+                continue
+            start = offset + 4 + (data[offset + 4] + 1 if control & 0x2 else 0)
+            if start + 14 > offset + TS_PACKET_SIZE:
+                continue
+            header = data[start:start + 14]
+            if header[0:3] != b'\x00\x00\x01' or not 0xC0 <= header[3] <= 0xEF or not header[7] & 0x80:
+                continue
+            pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+            self._add(pid, header[3], decode_pts(*header[9:14]))
+
+    def result(self):
+        """Return the segment's timestamps, or None if it carried no PTS."""
+        timestamps = self.timestamps
+        if not timestamps and self._audio:
+            timestamps = max(self._audio.values(), key=len)
+        if not timestamps:
+            return None
+        first = timestamps[0]
+        # Unwrap relative to the first PTS so a 33-bit rollover inside the segment is harmless
+        ordered = sorted(set((pts - first) % PTS_WRAP for pts in timestamps))
+        steps = [b - a for a, b in zip(ordered, ordered[1:])]
+        frame = statistics.median(steps) if steps else 0
+        start = (first + ordered[0]) % PTS_WRAP
+        return {
+            'first_pts': first,
+            'last_pts': timestamps[-1],
+            'start_pts': start,
+            'end_pts': (first + ordered[-1]) % PTS_WRAP,
+            'frame_duration': frame / PTS_CLOCK,
+            'duration': (ordered[-1] - ordered[0] + frame) / PTS_CLOCK,
+        }
+
+
+def scan_pts(source, chunk_size=1024 * 1024):
+    """Scan a bytes-like object or a binary file object and return PTSScanner.result()."""
+    scanner = PTSScanner()
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            scanner.feed(chunk)
+    else:
+        scanner.feed(source)
+    return scanner.result()
+
+
+class Timeline:
+    """Media timeline of a download, built from the PTS ranges of its segments.
+
+    add() records each segment's scan result (or only its EXTINF duration if
+    it had no timestamps) as segments finish, in any order. summary() walks
+    the segments in playlist order and reports the real media duration, gaps
+    where media is missing between two segments, and discontinuities where
+    the timestamps jump backwards or far ahead (a timestamp reset, a splice,
+    or an ad break).
+    """
+
+    def __init__(self, gap_tolerance=0.25, jump_threshold=30.0):
+        self.gap_tolerance = gap_tolerance
+        self.jump_threshold = jump_threshold
+        self.segments = {}  # index -> (scan result or None, EXTINF duration, playlist discontinuity)
+
+    def add(self, index, scan, extinf=None, discontinuity=False):
+        self.segments[index] = (scan, float(extinf or 0), discontinuity)
+
+    def summary(self):
+        indexes = sorted(self.segments)
+        playlist_duration = sum(self.segments[i][1] for i in indexes)
+        duration = 0.0
+        gaps = []
+        discontinuities = []
+        previous = None  # (index, end_pts, frame_duration)
+        for index in indexes:
+            scan, extinf, marked = self.segments[index]
+            if scan is None:
+                duration += extinf
+                previous = None
+                continue
+            duration += scan['duration']
+            if previous is not None and previous[0] == index - 1:
+                # Signed distance from the previous segment's last frame, modulo the 33-bit wrap
+                delta = (scan['start_pts'] - previous[1]) % PTS_WRAP
+                if delta >= PTS_WRAP // 2:
+                    delta -= PTS_WRAP
+                delta /= PTS_CLOCK
+                missing = delta - previous[2]
+                if delta < 0 or missing > self.jump_threshold:
+                    discontinuities.append({'index': index, 'jump': round(missing, 3), 'signalled': marked})
+                elif missing > self.gap_tolerance:
+                    gaps.append({'index': index, 'missing': round(missing, 3)})
+            previous = (index, scan['end_pts'], scan['frame_duration'])
+        return {
+            'duration': round(duration, 3),
+            'playlist_duration': round(playlist_duration, 3),
+            'segments': len(indexes),
+            'scanned': sum(1 for i in indexes if self.segments[i][0] is not None),
+            'gaps': gaps,
+            'discontinuities': discontinuities,
+        }
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+import time
+
+
+class _NullSpan:
+    """Returned while tracing is off so instrumented code costs one attribute check."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A timed section of the pipeline, recorded as a Chrome trace complete event."""
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        """Attach extra arguments (bytes, status, ...) to the span."""
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = repr(exc)
+        self.tracer._add({
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': (self.start - self.tracer.origin) * 1e6,
+            'dur': (end - self.start) * 1e6,
+            'pid': self.tracer.pid,
+            'tid': threading.get_ident(),
+            'args': self.args,
+        })
+        return False
+
+
+class Tracer:
+    """Collects pipeline spans and writes them as Chrome Trace Event JSON.
+
+    Disabled by default. Open the written file in chrome://tracing or
+    https://ui.perfetto.dev to see stage timings and worker concurrency.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = {}
+
+    def enable(self):
+        with self._lock:
+            self.enabled = True
+            self.origin = time.perf_counter()
+            self._events = []
+            self._threads = {}
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, category='pipeline', **args):
+        """Return a context manager timing the enclosed block."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, category, args)
+
+    def instant(self, name, category='pipeline', **args):
+        """Record a point-in-time event."""
+        if not self.enabled:
+            return
+        self._add({
+            'name': name,
+            'cat': category,
+            'ph': 'i',
+            's': 't',
+            'ts': (time.perf_counter() - self.origin) * 1e6,
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+    def _add(self, event):
+        thread = threading.current_thread()
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(event['tid'], thread.name)
+
+    def events(self):
+        """Return the recorded events, with thread name metadata first."""
+        with self._lock:
+            metadata = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in self._threads.items()
+            ]
+            return metadata + list(self._events)
+
+    def write(self, path):
+        """Write a Chrome Trace Event / Perfetto compatible JSON file."""
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, f)
+        print(f"Trace written to: {path}")
+
+
+# Process-wide tracer used by the download pipeline
+tracer = Tracer()
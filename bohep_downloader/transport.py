@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+import ipaddress
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from urllib3.util import connection
+
+# Per-thread timing of the connection set up for the current request, and
+# the AbortScope the thread's requests run in
+_timing = threading.local()
+
+
+def take_connect_time():
+    """Return and reset the connect time (TCP + TLS, including DNS) of this thread's last request."""
+    elapsed = getattr(_timing, 'connect', 0.0)
+    _timing.connect = 0.0
+    return elapsed
+
+
+def add_connect_time(seconds):
+    """Add connection set up time to this thread's current request (for other transports)."""
+    _timing.connect = getattr(_timing, 'connect', 0.0) + seconds
+
+
+class DNSCache:
+    """In-process cache of getaddrinfo() results, kept for `ttl` seconds.
+
+    The system resolver doesn't report record TTLs, so one fixed TTL applies
+    to every host. Segment workers connecting to the same CDN host, within a
+    job or across jobs, then resolve it once.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # (host, port) -> (expires, addresses)
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, host, port):
+        """Return the (family, address) pairs for host, from the cache when fresh."""
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        addresses = []
+        for family, _, _, _, sockaddr in socket.getaddrinfo(host, port, connection.allowed_gai_family(),
+                                                             socket.SOCK_STREAM):
+            if (family, sockaddr[0]) not in addresses:
+                addresses.append((family, sockaddr[0]))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    def invalidate(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by all connections of the process; set to None to resolve on every connect
+dns_cache = DNSCache()
+
+
+class AbortScope:
+    """Lets another thread abort the requests a thread makes inside `with scope:`.
+
+    Every connection used inside the scope is registered with it; abort()
+    shuts their sockets down, which wakes a thread blocked in connect, in
+    waiting for the response headers or in reading the body at once. The
+    request then fails with a connection error and urllib3 drops the
+    connection, so its pool slot is free for the next request. Transports
+    whose connections are shared between requests register an object with
+    an abort() method instead (see register_abortable()).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = set()
+        self.aborted = False
+
+    def __enter__(self):
+        self._outer = getattr(_timing, 'scope', None)
+        _timing.scope = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _timing.scope = self._outer
+        with self._lock:
+            self._connections.clear()
+
+    def add(self, conn):
+        with self._lock:
+            if not self.aborted:
+                self._connections.add(conn)
+                return
+        _shutdown(conn)
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            _shutdown(conn)
+
+
+def _shutdown(conn):
+    abort = getattr(conn, 'abort', None)
+    if abort is not None:
+        abort()
+        return
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # Already closed
+        pass
+
+
+def _register(conn):
+    scope = getattr(_timing, 'scope', None)
+    if scope is not None:
+        scope.add(conn)
+
+
+def register_abortable(request):
+    """Register a request with this thread's AbortScope, if any.
+
+    request.abort() is called when the scope is aborted (right away if it
+    already was).
+    """
+    _register(request)
+
+
+class KillOnAbort:
+    """Registers a subprocess with an AbortScope: aborting the scope kills it."""
+
+    def __init__(self, process):
+        self.process = process
+
+    def abort(self):
+        self.process.kill()
+
+
+def _is_ip(host):
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+    except ValueError:
+        return False
+    return True
+
+
+class _TimedConnectionMixin:
+    def _new_conn(self):
+        host = self._dns_host
+        if dns_cache is None or _is_ip(host):
+            return super()._new_conn()
+        try:
+            addresses = dns_cache.resolve(host, self.port)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        error = None
+        for _, address in addresses:
+            try:
+                return connection.create_connection(
+                    (address, self.port),
+                    self.timeout,
+                    source_address=self.source_address,
+                    socket_options=self.socket_options,
+                )
+            except socket.timeout as e:
+                error = ConnectTimeoutError(
+                    self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})")
+                error.__cause__ = e
+            except OSError as e:
+                error = NewConnectionError(self, f"Failed to establish a new connection: {e}")
+                error.__cause__ = e
+        # The host may have moved; resolve again next time
+        dns_cache.invalidate(host, self.port)
+        raise error
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            add_connect_time(time.perf_counter() - started)
+        _register(self)
+
+    def request(self, *args, **kwargs):
+        # Pooled connections are reused without connect()
+        _register(self)
+        return super().request(*args, **kwargs)
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTP adapter whose connections record how long they took to open.
+
+    Host names are resolved through dns_cache.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def mount_timed_adapter(session, pool_maxsize=10):
+    """Install TimedHTTPAdapter on a requests session for http and https."""
+    adapter = TimedHTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return adapter
+
+
+def prewarm(session, url, count):
+    """Open `count` connections to the host of url in the background and pool them.
+
+    Returns the started thread (None if the session's adapter can't pre-warm),
+    so the connections are being set up while the playlist is fetched and
+    parsed; the first wave of segment requests then finds them idle in the
+    pool instead of all connecting at once.
+    """
+    adapter = session.get_adapter(url)
+    # An HTTP2Adapter sends the URLs it doesn't serve itself to an HTTP/1.1 adapter
+    adapter_for = getattr(adapter, 'adapter_for', None)
+    if adapter_for is not None:
+        adapter = adapter_for(url)
+    if not isinstance(adapter, HTTPAdapter):
+        return None
+    # Same settings as Session.send(), so the connections land in the pool requests will use
+    settings = session.merge_environment_settings(url, {}, None, None, None)
+    if hasattr(adapter, 'get_connection_with_tls_context'):
+        request = requests.Request('GET', url).prepare()
+        pool = adapter.get_connection_with_tls_context(
+            request, settings['verify'], proxies=settings['proxies'], cert=settings['cert'])
+    else:
+        pool = adapter.get_connection(url, settings['proxies'])
+    count = min(count, pool.pool.maxsize if pool.pool is not None else count)
+    # Hold every connection until all are open, or a fast thread would
+    # return its connection and the next one would take it again
+    opened = threading.Barrier(count)
+
+    def open_one():
+        conn = None
+        try:
+            conn = pool._get_conn()
+            if conn.sock is None:
+                conn.connect()
+        except Exception:
+            # Only an optimization; the requests will connect themselves
+            if conn is not None:
+                conn.close()
+        try:
+            opened.wait(timeout=30)
+        except threading.BrokenBarrierError:
+            pass
+        if conn is not None:
+            pool._put_conn(conn)
+
+    def run():
+        threads = [threading.Thread(target=open_one, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    thread = threading.Thread(target=run, name=f'prewarm-{urlsplit(url).hostname}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+from bohep_downloader.ts_validator import SYNC_BYTE, TS_PACKET_SIZE, np
+
+# Signatures of the image headers some CDNs put in front of TS segments
+IMAGE_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',
+    b'\xff\xd8\xff',  # JPEG
+    b'GIF87a',
+    b'GIF89a',
+    b'BM',
+    b'RIFF',  # WebP
+)
+
+
+class TSNormalizer:
+    """Finds where the MPEG-TS data starts in a segment disguised as an image.
+
+    Some CDNs serve segments behind a fake PNG or JPEG header. The
+    SegmentWriter calls find_start() on the buffered start of the body
+    until it returns an offset, and only writes (and validates) the data
+    from there on, so the wrapper is dropped without a second pass over
+    the file. A body that starts with an image signature is searched for
+    the first offset where `run_packets` packets in a row begin with the
+    0x47 sync byte; any other body starts at 0, so that an error page
+    still fails validation on its first read.
+    """
+
+    def __init__(self, run_packets=5, max_prefix=1024 * 1024):
+        self.run_packets = run_packets
+        self.max_prefix = max_prefix
+        self.stripped = 0  # bytes dropped in front of the TS data
+        self._resume = 0  # offsets before this were already ruled out
+
+    def find_start(self, data, final=False):
+        """Return the offset of the TS data in data, or None if more data is needed.
+
+        data is everything buffered so far; with final set it is the whole
+        body. If no TS data is found the offset is 0 and the validator
+        decides what to make of the body.
+        """
+        data = memoryview(data)
+        if not len(data):
+            return 0 if final else None
+        if data[0] == SYNC_BYTE:
+            return 0
+        head = bytes(data[:8])
+        if not head.startswith(IMAGE_SIGNATURES):
+            if not final and any(len(head) < len(s) and s.startswith(head) for s in IMAGE_SIGNATURES):
+                return None  # too short to tell yet
+            return 0
+        window = data[:self.max_prefix + self.run_packets * TS_PACKET_SIZE]
+        if np is not None:
+            offset = self._numpy_search(window, final)
+        else:
+            offset = self._python_search(window, final)
+        if offset is None:
+            # Every offset with its whole run buffered has been checked
+            self._resume = max(self._resume, len(window) - (self.run_packets - 1) * TS_PACKET_SIZE)
+            # Give up at the end of the body or past max_prefix
+            return 0 if final or len(data) > len(window) else None
+        self.stripped = offset
+        return offset
+
+    def _run_length(self, available):
+        """Return the packets a run must have given the bytes available after its start."""
+        return min(self.run_packets, max(1, available // TS_PACKET_SIZE))
+
+    def _numpy_search(self, data, final):
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        size = len(buffer)
+        span = (self.run_packets - 1) * TS_PACKET_SIZE
+        candidates = np.flatnonzero(buffer[self._resume:] == SYNC_BYTE) + self._resume
+        if not final:
+            # Only offsets whose whole run has arrived can be decided now
+            candidates = candidates[candidates + span < size]
+        if not candidates.size:
+            return None
+        # Sync byte at each packet start of the run, for all candidates at once
+        positions = candidates[:, None] + np.arange(self.run_packets) * TS_PACKET_SIZE
+        inside = positions < size
+        synced = np.where(inside, buffer[np.minimum(positions, size - 1)] == SYNC_BYTE, True)
+        found = synced.all(axis=1)
+        if final:
+            # Near the end a shorter run will do, as long as the rest is whole packets
+            found &= (size - candidates) % TS_PACKET_SIZE == 0
+        hits = np.flatnonzero(found)
+        return int(candidates[hits[0]]) if hits.size else None
+
+    def _python_search(self, data, final):
+        data = bytes(data)
+        size = len(data)
+        offset = data.find(SYNC_BYTE, self._resume)
+        while offset != -1:
+            run = self._run_length(size - offset) if final else self.run_packets
+            if offset + (run - 1) * TS_PACKET_SIZE >= size:
+                return None
+            if all(data[offset + i * TS_PACKET_SIZE] == SYNC_BYTE for i in range(run)) and (
+                    not final or (size - offset) % TS_PACKET_SIZE == 0):
+                return offset
+            offset = data.find(SYNC_BYTE, offset + 1)
+        return None
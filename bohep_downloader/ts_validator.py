@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+from urllib.parse import urlsplit
+
+try:
+    import numpy as np
+except ImportError:  # optional, the pure-Python checks are used instead
+    np = None
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+NULL_PID = 0x1FFF
+
+# Segment URL extensions that are not MPEG-TS
+NON_TS_EXTENSIONS = ('.m4s', '.mp4', '.m4a', '.aac', '.vtt')
+
+
+def is_ts_url(url):
+    """Return True if a segment URL is expected to serve MPEG-TS."""
+    return not urlsplit(url).path.lower().endswith(NON_TS_EXTENSIONS)
+
+
+class InvalidSegmentError(Exception):
+    """A downloaded segment is not a well-formed MPEG-TS stream."""
+
+
+class PacketStream:
+    """Splits a byte stream fed in arbitrary chunks into whole 188-byte packets.
+
+    Subclasses implement _numpy_packets() and _python_packets(), which get a
+    buffer holding a whole number of packets.
+    """
+
+    def __init__(self):
+        self.length = 0
+        self.packets = 0
+        self._partial = bytearray()
+
+    def feed(self, data):
+        data = memoryview(data)
+        self.length += len(data)
+        if self._partial:
+            need = TS_PACKET_SIZE - len(self._partial)
+            self._partial += data[:need]
+            data = data[need:]
+            if len(self._partial) < TS_PACKET_SIZE:
+                return
+            self._python_packets(self._partial)
+            self.packets += 1
+            self._partial = bytearray()
+
+        full = len(data) - len(data) % TS_PACKET_SIZE
+        if full:
+            if np is not None:
+                self._numpy_packets(data[:full])
+            else:
+                self._python_packets(data[:full])
+            self.packets += full // TS_PACKET_SIZE
+        if full < len(data):
+            self._partial = bytearray(data[full:])
+
+    def _numpy_packets(self, data):
+        raise NotImplementedError
+
+    def _python_packets(self, data):
+        raise NotImplementedError
+
+
+class TSValidator(PacketStream):
+    """Checks an MPEG-TS segment incrementally while it is being downloaded.
+
+    feed() takes the chunks as they arrive and raises InvalidSegmentError as
+    soon as a packet lacks the 0x47 sync byte (e.g. an HTML error page), so
+    the request can be abandoned and retried right away. finish() checks
+    188-byte alignment and the Content-Length. Continuity counter errors are
+    counted per PID; they only make the segment invalid when
+    `strict_continuity` is set, since some encoders get them wrong.
+
+    With NumPy the packets of each chunk are checked as one array; without
+    it, a pure-Python loop does the same checks.
+    """
+
+    def __init__(self, expected_length=None, strict_continuity=False):
+        super().__init__()
+        self.expected_length = expected_length
+        self.strict_continuity = strict_continuity
+        self.continuity_errors = 0
+        self._last_cc = {}  # pid -> continuity counter of its last payload packet
+
+    def feed(self, data):
+        data = memoryview(data)
+        if not self.length and len(data) and data[0] != SYNC_BYTE:
+            # Fail before a whole packet arrives, e.g. for a short error page
+            self._sync_error(0)
+        super().feed(data)
+
+    def skip(self, nbytes):
+        """Account for nbytes stripped from the front of the body before feeding it."""
+        if nbytes and self.expected_length is not None:
+            self.expected_length -= nbytes
+
+    def finish(self):
+        """Run the end-of-segment checks and return a summary."""
+        if not self.length:
+            raise InvalidSegmentError("Empty segment")
+        if self.expected_length is not None and self.length != self.expected_length:
+            raise InvalidSegmentError(
+                f"Segment truncated: got {self.length} of {self.expected_length} bytes")
+        if self._partial:
+            raise InvalidSegmentError(
+                f"Segment length {self.length} is not a multiple of {TS_PACKET_SIZE} bytes")
+        if self.strict_continuity and self.continuity_errors:
+            raise InvalidSegmentError(f"{self.continuity_errors} continuity counter errors")
+        return {'packets': self.packets, 'continuity_errors': self.continuity_errors}
+
+    def _sync_error(self, packet):
+        offset = (self.packets + packet) * TS_PACKET_SIZE
+        raise InvalidSegmentError(f"Lost MPEG-TS sync at byte {offset}")
+
+    def _numpy_packets(self, data):
+        packets = np.frombuffer(data, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+        bad = np.flatnonzero(packets[:, 0] != SYNC_BYTE)
+        if bad.size:
+            self._sync_error(int(bad[0]))
+
+        pid = ((packets[:, 1] & 0x1F).astype(np.uint16) << 8) | packets[:, 2]
+        control = packets[:, 3] >> 4
+        cc = packets[:, 3] & 0x0F
+        discontinuity = ((control & 0x2) != 0) & (packets[:, 4] > 0) & ((packets[:, 5] & 0x80) != 0)
+        # Only packets carrying payload advance the counter
+        selected = ((control & 0x1) != 0) & (pid != NULL_PID)
+        pid, cc, discontinuity = pid[selected], cc[selected], discontinuity[selected]
+        if not pid.size:
+            return
+
+        order = np.argsort(pid, kind='stable')
+        pid, cc, discontinuity = pid[order], cc[order], discontinuity[order]
+        same = pid[1:] == pid[:-1]
+        step = (cc[1:] - cc[:-1]) & 0x0F
+        # A step of 0 is an allowed duplicate packet
+        errors = same & (step > 1) & ~discontinuity[1:]
+        self.continuity_errors += int(np.count_nonzero(errors))
+
+        # Check each PID's first packet against the previous chunk
+        starts = np.flatnonzero(np.concatenate(([True], ~same)))
+        ends = np.concatenate((starts[1:], [len(pid)])) - 1
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            self._check_cc(int(pid[start]), int(cc[start]), bool(discontinuity[start]))
+            self._last_cc[int(pid[start])] = int(cc[end])
+
+    def _python_packets(self, data):
+        for offset in range(0, len(data), TS_PACKET_SIZE):
+            if data[offset] != SYNC_BYTE:
+                self._sync_error(offset // TS_PACKET_SIZE)
+            pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+            control = data[offset + 3] >> 4
+            if not control & 0x1 or pid == NULL_PID:
+                continue
+            discontinuity = bool(control & 0x2) and data[offset + 4] > 0 and bool(data[offset + 5] & 0x80)
+            cc = data[offset + 3] & 0x0F
+            self._check_cc(pid, cc, discontinuity)
+            self._last_cc[pid] = cc
+
+    def _check_cc(self, pid, cc, discontinuity):
+        last = self._last_cc.get(pid)
+        if last is not None and not discontinuity and (cc - last) & 0x0F > 1:
+            self.continuity_errors += 1
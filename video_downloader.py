@@ -18,6 +18,8 @@ import concurrent.futures
 import threading
 from queue import Queue
 
+from bohep_downloader.concat import concat_files
+
 class VideoDownloader:
     def __init__(self):
         self.download_dir = str(Path.home() / "Downloads")
@@ -396,10 +398,7 @@ class VideoDownloader:
             except Exception as e:
                 # Fallback to direct file concatenation if FFmpeg fails
                 print("Falling back to direct file concatenation...")
-                with open(output_path, 'wb') as outfile:
-                    for segment_file in tqdm(segment_files, desc="Combining segments"):
-                        with open(segment_file, 'rb') as infile:
-                            outfile.write(infile.read())
+                concat_files(tqdm(segment_files, desc="Combining segments"), output_path)
             
             print("Cleaning up temporary files...")
             for file in segment_files: